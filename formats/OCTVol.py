@@ -1,5 +1,10 @@
+from OCT.formats.io_stats import phase, counting
 import numpy as np
+import contextlib
 import datetime
+import tempfile
+import shutil
+import os
 
 
 class OCTVol:
@@ -11,6 +16,23 @@ class OCTVol:
     ----------
     vol_path : str
          Path to vol file
+    mmap : bool, optional
+        If True, the vol file is memory-mapped instead of read into memory. The headers and segmentation are decoded as
+        usual but slo and b_scans become read-only views into the file, so the image data is only read from disk when
+        it is indexed. Default is False
+    load : tuple of str, optional
+        The parts of the vol file to read, any of LOAD_ITEMS: 'header' (always read, incl. the thickness grid), 'slo',
+        'b_scan_header' (the B scan header fields), 'segmentation' (the boundary_N items of b_scan_header, implies
+        'b_scan_header') and 'b_scans'. Parts not read are None (slo, b_scans) or an empty dict (b_scan_header).
+        Default is LOAD_ITEMS, i.e. the whole file
+    b_scan_indices : slice or list of int, optional
+        The B scans to read b_scan_header and b_scans for, e.g. slice(40, 61). Only the records of these B scans are
+        read from the file. Default is None, i.e. all B scans
+    vol_file : file object, optional
+        An open binary file object with the content of the vol file that is read instead of opening vol_path, e.g. a
+        vol file already read into memory by prefetch_vols. Not used with mmap. Default is None
+    stats : IOStats, optional
+        If given, the time of each phase of reading and the I/O are recorded into it. Default is None
 
      Attributes
      ----------
@@ -26,19 +48,35 @@ class OCTVol:
         OCT image
     thickness_grid : dict
         Dictionary containing thickness map and related information e.g. 'grid_type', 'central_thk', etc
+    load : tuple of str
+        The parts of the vol file that were read
+    mmap : bool
+        Whether slo and b_scans are views into a memory map of the vol file
+    b_scan_indices : numpy.ndarray
+        The indices (within the vol file) of the B scans held in b_scan_header and b_scans
 
     Class Attributes
     ----------------
+    LOAD_ITEMS : tuple of str
+        The parts of a vol file that can be read, see the load parameter
     EXAM_TIME_OFFSET : int
         The time origin change from python origin to exam_time origin of the vol file 1/1/1601 in seconds (needed for
         conversion from timestamp)
     VISIT_DATE_DOB_OFFSET : int
         The offset needs to convert visit_date and dob (date of birth) from int to time
+    HEADER_DTYPE : numpy.dtype
+        Structured dtype describing the 2048 bytes of the vol file header
+    B_SCAN_HEADER_DTYPE : numpy.dtype
+        Structured dtype describing the B scan header fields at the beginning of each B scan header (before the
+        segmentation)
+    THICKNESS_GRID_DTYPE : numpy.dtype
+        Structured dtype describing the thickness grid stored at grid_offset, with the 9 sectors as (thickness, volume)
+        pairs
 
     Raises
     ------
     ValueError
-        if the file does not contain .vol in the file name
+        if the file does not contain .vol in the file name or load contains an unknown item
 
     Notes
     -----
@@ -52,19 +90,38 @@ class OCTVol:
         Seyedamirhosein Motamedi, Charité - Universitätsmedizin Berlin,
         seyedamirhosein.motamedi@charite.de
     """
+    LOAD_ITEMS = ('header', 'slo', 'b_scan_header', 'segmentation', 'b_scans')
+    HEADER_DTYPE = np.dtype([('version', 'S12'), ('size_x', '<i4'), ('num_b_scans', '<i4'), ('size_z', '<i4'),
+                             ('scale_x', '<f8'), ('distance', '<f8'), ('scale_z', '<f8'), ('size_x_slo', '<i4'),
+                             ('size_y_slo', '<i4'), ('scale_x_slo', '<f8'), ('scale_y_slo', '<f8'),
+                             ('field_size_slo', '<i4'), ('scan_focus', '<f8'), ('scan_position', 'S4'),
+                             ('unconverted_exam_time', '<u8'), ('scan_pattern', '<i4'), ('b_scan_hdr_size', '<i4'),
+                             ('id', 'S16'), ('reference_id', 'S16'), ('pid', '<i4'), ('patient_id', 'S21'),
+                             ('padding', 'i1', (3,)), ('unconverted_dob', '<f8'), ('vid', '<i4'), ('visit_id', 'S24'),
+                             ('unconverted_visit_date', '<f8'), ('grid_type', '<i4'), ('grid_offset', '<i4'),
+                             ('spare', 'i1', (1832,))])
+    B_SCAN_HEADER_DTYPE = np.dtype([('version', 'S12'), ('b_scan_hdr_size', '<i4'), ('start_x', '<f8'),
+                                    ('start_y', '<f8'), ('end_x', '<f8'), ('end_y', '<f8'), ('num_seg', '<i4'),
+                                    ('off_seg', '<i4'), ('quality', '<f4'), ('shift', '<i4'), ('spare', 'i1', (192,))])
+    THICKNESS_GRID_DTYPE = np.dtype([('type', '<i4'), ('diameter', '<f8', (3,)), ('center_pos', '<f8', (2,)),
+                                     ('central_thk', '<f4'), ('min_central_thk', '<f4'), ('max_central_thk', '<f4'),
+                                     ('total_volume', '<f4'), ('sectors', '<f4', (9, 2))])
     EXAM_TIME_OFFSET = (datetime.date.toordinal(datetime.date(1970, 1, 1)) -
                         datetime.date.toordinal(datetime.date(1601, 1, 1))) * 24 * 60 * 60
     VISIT_DATE_DOB_OFFSET = (datetime.date.toordinal(datetime.date(1970, 1, 1)) -
                              datetime.date.toordinal(datetime.date(1899, 12, 30))) * 24 * 60 * 60
 
-    def __init__(self, vol_path):
+    def __init__(self, vol_path, mmap=False, load=LOAD_ITEMS, b_scan_indices=None, vol_file=None, stats=None):
         if '.vol' not in vol_path:
             raise ValueError('The file path does not point to a .vol file. Please check the path and make sure that the full path is given including the file .vol extension.')
         self.vol_path = vol_path
-        self.header, self.slo, self.b_scan_header, self.b_scans, self.thickness_grid = OCTVol._open_vol(vol_path)
+        self.load = OCTVol._check_load(load)
+        self.mmap = mmap
+        self.header, self.slo, self.b_scan_header, self.b_scans, self.thickness_grid = OCTVol._open_vol(vol_path, mmap=mmap, load=load, b_scan_indices=b_scan_indices, vol_file=vol_file, stats=stats)
+        self.b_scan_indices = OCTVol._select_b_scans(self.header['num_b_scans'], b_scan_indices)
 
     @classmethod
-    def _open_vol(cls, vol_path):
+    def _open_vol(cls, vol_path, mmap=False, load=LOAD_ITEMS, b_scan_indices=None, vol_file=None, stats=None):
         """"
         Reads (opens) OCT .vol files
 
@@ -72,6 +129,18 @@ class OCTVol:
         -----------
         vol_path : str
             Path to vol file
+        mmap : bool, optional
+            If True, slo and b_scans are returned as read-only views into a memory map of the file instead of being read.
+            Default is False
+        load : tuple of str, optional
+            The parts of the vol file to read, see LOAD_ITEMS. Default is LOAD_ITEMS
+        b_scan_indices : slice or list of int, optional
+            The B scans to read. Default is None, i.e. all B scans
+        vol_file : file object, optional
+            An open binary file object read instead of opening vol_path, it is not closed. Default is None
+        stats : IOStats, optional
+            Records the time of the phases 'read_header', 'read_slo', 'read_b_scan_headers' (incl. segmentation),
+            'read_b_scans', 'parse_b_scan_headers' and 'read_thickness_grid' and the reads and seeks. Default is None
 
         Returns
         -------
@@ -84,116 +153,310 @@ class OCTVol:
         directly.
 
         """
+        load = cls._check_load(load)
+        if stats is not None:
+            stats.files += 1
+        if mmap:
+            return cls._map_vol(vol_path, load=load, b_scan_indices=b_scan_indices, stats=stats)
+
         # Open the file and read header, slo image, B scan header (segmentation), B scans, and thickness grid
-        with open(vol_path, mode='rb') as vf:
+        with open(vol_path, mode='rb') if vol_file is None else contextlib.nullcontext(vol_file) as vf:
+            vf = counting(vf, stats)
 
             # Read Header
-            header = dict(version="".join(map(chr, vf.read(12))).rstrip("\0"),
-                          size_x=np.fromfile(vf, dtype='int32', count=1)[0],
-                          num_b_scans=np.fromfile(vf, dtype='int32', count=1)[0],
-                          size_z=np.fromfile(vf, dtype='int32', count=1)[0],
-                          scale_x=np.fromfile(vf, dtype='float64', count=1)[0],
-                          distance=np.fromfile(vf, dtype='float64', count=1)[0],
-                          scale_z=np.fromfile(vf, dtype='float64', count=1)[0],
-                          size_x_slo=np.fromfile(vf, dtype='int32', count=1)[0],
-                          size_y_slo=np.fromfile(vf, dtype='int32', count=1)[0],
-                          scale_x_slo=np.fromfile(vf, dtype='float64', count=1)[0],
-                          scale_y_slo=np.fromfile(vf, dtype='float64', count=1)[0],
-                          field_size_slo=np.fromfile(vf, dtype='int32', count=1)[0],
-                          scan_focus=np.fromfile(vf, dtype='float64', count=1)[0],
-                          scan_position="".join(map(chr, vf.read(4))).rstrip("\0"),
-                          unconverted_exam_time=np.fromfile(vf, dtype='uint64', count=1)[0],
-                          scan_pattern=np.fromfile(vf, dtype='int32', count=1)[0],
-                          b_scan_hdr_size=np.fromfile(vf, dtype='int32', count=1)[0],
-                          id="".join(map(chr, vf.read(16))).rstrip("\0"),
-                          reference_id="".join(map(chr, vf.read(16))).rstrip("\0"),
-                          pid=np.fromfile(vf, dtype='int32', count=1)[0],
-                          patient_id="".join(map(chr, vf.read(21))).rstrip("\0"),
-                          padding=np.fromfile(vf, dtype='int8', count=3),
-                          unconverted_dob=np.fromfile(vf, dtype='float64', count=1)[0],
-                          vid=np.fromfile(vf, dtype='int32', count=1)[0],
-                          visit_id="".join(map(chr, vf.read(24))).rstrip("\0"),
-                          unconverted_visit_date=np.fromfile(vf, dtype='float64', count=1)[0],
-                          grid_type=np.fromfile(vf, dtype='int32', count=1)[0],
-                          grid_offset=np.fromfile(vf, dtype='int32', count=1)[0],
-                          spare=np.fromfile(vf, dtype='int8', count=1832))
-            header['exam_time'] = datetime.datetime.utcfromtimestamp(header['unconverted_exam_time']/1e7 - OCTVol.EXAM_TIME_OFFSET)
-            header['dob'] = (datetime.datetime.utcfromtimestamp(0) + datetime.timedelta(seconds=header['unconverted_dob']*24*60*60 - OCTVol.VISIT_DATE_DOB_OFFSET)).date()
-            header['visit_date'] = datetime.datetime.utcfromtimestamp(header['unconverted_visit_date']*24*60*60 - OCTVol.VISIT_DATE_DOB_OFFSET)
+            with phase(stats, 'read_header'):
+                header = cls._parse_header(cls._read_exactly(vf, cls.HEADER_DTYPE.itemsize))
+            b_scan_indices = cls._select_b_scans(header['num_b_scans'], b_scan_indices)
 
             # Read SLO image
-            vf.seek(2048)
-            slo = np.fromfile(vf, dtype='uint8', count=header['size_x_slo']*header['size_y_slo']).reshape((header['size_y_slo'], header['size_x_slo']))
-
-            # Create B scan and B scan header objects
-            b_scan_header = dict(version=np.full((12, header['num_b_scans']), "\0", dtype='U'),
-                                 b_scan_hdr_size=np.full(header['num_b_scans'], np.nan, dtype='int32'),
-                                 start_x=np.full(header['num_b_scans'], np.nan, dtype='float64'),
-                                 start_y=np.full(header['num_b_scans'], np.nan, dtype='float64'),
-                                 end_x=np.full(header['num_b_scans'], np.nan, dtype='float64'),
-                                 end_y=np.full(header['num_b_scans'], np.nan, dtype='float64'),
-                                 num_seg=np.full(header['num_b_scans'], np.nan, dtype='int32'),
-                                 off_seg=np.full(header['num_b_scans'], np.nan, dtype='int32'),
-                                 quality=np.full(header['num_b_scans'], np.nan, dtype='float32'),
-                                 shift=np.full(header['num_b_scans'], np.nan, dtype='int32'),
-                                 spare=np.full((192, header['num_b_scans']), np.nan, dtype='int8'))
-            b_scans = np.full((header['size_z'], header['size_x'], header['num_b_scans']), np.nan, dtype='float32')
-
-            # Read B scan and B scan header (incl. segmentation)
-            for i_b_scan in range(header['num_b_scans']):
-                # go to the position of the B scan header on the file
-                vf.seek(2048 + header['size_x_slo'] * header['size_y_slo'] + i_b_scan * (header['b_scan_hdr_size'] + header['size_x'] * header['size_z'] * 4))
-
-                # Read B scan header (except segmentation)
-                b_scan_header['version'][:, i_b_scan] = [*map(chr, vf.read(12))]
-                b_scan_header['b_scan_hdr_size'][i_b_scan] = np.fromfile(vf, dtype='int32', count=1)
-                b_scan_header['start_x'][i_b_scan] = np.fromfile(vf, dtype='float64', count=1)
-                b_scan_header['start_y'][i_b_scan] = np.fromfile(vf, dtype='float64', count=1)
-                b_scan_header['end_x'][i_b_scan] = np.fromfile(vf, dtype='float64', count=1)
-                b_scan_header['end_y'][i_b_scan] = np.fromfile(vf, dtype='float64', count=1)
-                b_scan_header['num_seg'][i_b_scan] = np.fromfile(vf, dtype='int32', count=1)
-                b_scan_header['off_seg'][i_b_scan] = np.fromfile(vf, dtype='int32', count=1)
-                b_scan_header['quality'][i_b_scan] = np.fromfile(vf, dtype='float32', count=1)
-                b_scan_header['shift'][i_b_scan] = np.fromfile(vf, dtype='int32', count=1)
-                b_scan_header['spare'][:, i_b_scan] = np.fromfile(vf, dtype='int8', count=192)
-
-                # Create boundaries items now that we know the number of segmentation lines from the first iteration
-                if i_b_scan == 0:
-                    for i_boundary in range(b_scan_header['num_seg'][0]):
-                        b_scan_header['boundary_{}'.format(i_boundary + 1)] = np.full((header['num_b_scans'], header['size_x']), np.nan, dtype='float32')
-
-                # Read segmentation
-                vf.seek(2048 + header['size_x_slo'] * header['size_y_slo'] + b_scan_header['off_seg'][i_b_scan] + i_b_scan * (header['b_scan_hdr_size'] + header['size_x'] * header['size_z'] * 4))
-                for i_boundary in range(b_scan_header['num_seg'][i_b_scan]):
-                    b_scan_header['boundary_{}'.format(i_boundary+1)][i_b_scan, :] = np.fromfile(vf, dtype='float32', count=header['size_x'])
-
-                # Read B scans
-                vf.seek(2048 + header['size_x_slo'] * header['size_y_slo'] + header['b_scan_hdr_size'] + i_b_scan * (header['b_scan_hdr_size'] + header['size_x'] * header['size_z'] * 4))
-                b_scans[:, :, i_b_scan] = np.fromfile(vf, dtype='float32', count=header['size_x'] * header['size_z']).reshape((header['size_z'], header['size_x']))
+            slo = None
+            if 'slo' in load:
+                with phase(stats, 'read_slo'):
+                    vf.seek(cls.HEADER_DTYPE.itemsize)
+                    slo = np.empty((header['size_y_slo'], header['size_x_slo']), dtype='uint8')
+                    cls._read_into(vf, slo)
+
+            # Read B scan headers (incl. segmentation) and B scans. Each B scan record consists of the B scan header
+            # followed by the B scan and the records are stored back to back, so consecutive B scans are read in one
+            # sequential pass without seeking. The raw headers are collected in one array and decoded together afterwards
+            b_scan_header, b_scans = dict(), None
+            if 'b_scan_header' in load or 'b_scans' in load:
+                records_offset = cls.HEADER_DTYPE.itemsize + header['size_x_slo'] * header['size_y_slo']
+                record_size = header['b_scan_hdr_size'] + header['size_x'] * header['size_z'] * 4
+
+                # Only the B scan header fields are needed if neither the segmentation nor the B scans are read
+                if 'segmentation' in load or 'b_scans' in load:
+                    b_scan_header_size = header['b_scan_hdr_size']
+                else:
+                    b_scan_header_size = cls.B_SCAN_HEADER_DTYPE.itemsize
+                b_scan_headers_raw = np.empty((len(b_scan_indices), b_scan_header_size), dtype='uint8')
+                if 'b_scans' in load:
+                    b_scans = np.empty((header['size_z'], header['size_x'], len(b_scan_indices)), dtype='float32')
+                    b_scan = np.empty((header['size_z'], header['size_x']), dtype='float32')
+
+                position = None
+                for i_read, i_b_scan in enumerate(b_scan_indices):
+                    with phase(stats, 'read_b_scan_headers'):
+                        # go to the position of the B scan header on the file unless we are already there
+                        if position != records_offset + i_b_scan * record_size:
+                            position = records_offset + i_b_scan * record_size
+                            vf.seek(position)
+                        cls._read_into(vf, b_scan_headers_raw[i_read])
+                        position += b_scan_header_size
+                    if b_scans is not None:
+                        with phase(stats, 'read_b_scans'):
+                            cls._read_into(vf, b_scan)
+                            b_scans[:, :, i_read] = b_scan
+                            position += b_scan.nbytes
+
+                if 'b_scan_header' in load:
+                    with phase(stats, 'parse_b_scan_headers'):
+                        b_scan_header = cls._parse_b_scan_headers(b_scan_headers_raw, header, segmentation='segmentation' in load)
 
             # Read the thickness info if it exists
+            thickness_grid = dict()
             if header['grid_type'] != 0:
-                vf.seek(header['grid_offset'])
-
-                # Read the thickness grid up to the sector part
-                thickness_grid = dict(type=np.fromfile(vf, dtype='int32', count=1)[0],
-                                      diameter=np.fromfile(vf, dtype='float64', count=3),
-                                      center_pos=np.fromfile(vf, dtype='float64', count=2),
-                                      central_thk=np.fromfile(vf, dtype='float32', count=1)[0],
-                                      min_central_thk=np.fromfile(vf, dtype='float32', count=1)[0],
-                                      max_central_thk=np.fromfile(vf, dtype='float32', count=1)[0],
-                                      total_volume=np.fromfile(vf, dtype='float32', count=1)[0])
-
-                # Read sectors information
-                for i_sector in range(9):
-                    thickness_grid['sector_{}'.format(i_sector+1)] = dict(thickness=np.fromfile(vf, dtype='float32', count=1)[0],
-                                                                          volume=np.fromfile(vf, dtype='float32', count=1)[0])
-            else:
-                thickness_grid = dict()
+                with phase(stats, 'read_thickness_grid'):
+                    vf.seek(header['grid_offset'])
+                    thickness_grid = cls._parse_thickness_grid(cls._read_exactly(vf, cls.THICKNESS_GRID_DTYPE.itemsize))
+
+        return header, slo, b_scan_header, b_scans, thickness_grid
+
+    @classmethod
+    def _map_vol(cls, vol_path, load=LOAD_ITEMS, b_scan_indices=None, stats=None):
+        """
+        Memory-maps OCT .vol files
+
+        Parameters
+        -----------
+        vol_path : str
+            Path to vol file
+        load : tuple of str, optional
+            The parts of the vol file to read, see LOAD_ITEMS. Default is LOAD_ITEMS
+        b_scan_indices : slice or list of int, optional
+            The B scans to read. Default is None, i.e. all B scans
+        stats : IOStats, optional
+            Records the time of the phases 'read_header', 'read_b_scan_headers' (copying the B scan headers out of the
+            memory map), 'parse_b_scan_headers', 'read_b_scans' (only if the selected B scans are copied) and
+            'read_thickness_grid' and the bytes touched in the memory map, each header, B scan header and thickness grid
+            counted as one read. The slo and b_scans views are not counted until they are indexed, e.g. by
+            combine_oct_and_segmentation_as_numpy. Default is None
+
+        Returns
+        -------
+        tuple
+            header, slo, b_scan_header, b_scans, thickness_grid of the oct vol file, where slo and b_scans are read-only
+            views into the memory map
+
+        Notes
+        -----
+        b_scans is a strided view over the interleaved B scan header/B scan records with the usual shape of
+        size_z * size_x * num_b_scans, so indexing it only reads the touched B scans from the file. If b_scan_indices
+        is a list rather than a slice, the selected B scans are read (copied) instead since they cannot be expressed
+        as a view.
+
+        """
+        with phase(stats, 'read_header'):
+            vol_map = np.memmap(vol_path, dtype='uint8', mode='r')
+            header = cls._parse_header(cls._map_exactly(vol_map, 0, cls.HEADER_DTYPE.itemsize, vol_path))
+        cls._count_mapped_read(stats, cls.HEADER_DTYPE.itemsize)
+        selected_b_scans = cls._select_b_scans(header['num_b_scans'], b_scan_indices)
+
+        # Map the SLO image
+        slo_offset = cls.HEADER_DTYPE.itemsize
+        slo_size = header['size_x_slo'] * header['size_y_slo']
+        slo = None
+        if 'slo' in load:
+            slo = cls._map_exactly(vol_map, slo_offset, slo_size, vol_path).reshape((header['size_y_slo'], header['size_x_slo']))
+
+        # Map the B scan records. The B scan headers are copied (touching only the header pages) and decoded while the B
+        # scans stay a view which skips the headers between consecutive B scans
+        if len(selected_b_scans) > 0:
+            cls._map_exactly(vol_map, slo_offset + slo_size, (selected_b_scans.max() + 1) * cls._record_size(header), vol_path)
+        b_scan_headers_raw, b_scans_map = cls._map_records(vol_map, header)
+
+        b_scan_header, b_scans = dict(), None
+        if 'b_scan_header' in load:
+            b_scan_header_size = header['b_scan_hdr_size'] if 'segmentation' in load else cls.B_SCAN_HEADER_DTYPE.itemsize
+            b_scan_headers_raw = b_scan_headers_raw[:, :b_scan_header_size]
+            with phase(stats, 'read_b_scan_headers'):
+                b_scan_headers_raw = b_scan_headers_raw[selected_b_scans]
+            cls._count_mapped_read(stats, b_scan_headers_raw.nbytes, len(selected_b_scans))
+            with phase(stats, 'parse_b_scan_headers'):
+                b_scan_header = cls._parse_b_scan_headers(b_scan_headers_raw, header, segmentation='segmentation' in load)
+        if 'b_scans' in load:
+            b_scans = b_scans_map
+            if isinstance(b_scan_indices, slice):
+                b_scans = b_scans[:, :, b_scan_indices]
+            elif b_scan_indices is not None:
+                with phase(stats, 'read_b_scans'):
+                    b_scans = b_scans[:, :, selected_b_scans]
+                cls._count_mapped_read(stats, b_scans.nbytes, len(selected_b_scans))
+
+        # Read the thickness info if it exists
+        thickness_grid = dict()
+        if header['grid_type'] != 0:
+            with phase(stats, 'read_thickness_grid'):
+                thickness_grid = cls._parse_thickness_grid(cls._map_exactly(vol_map, header['grid_offset'], cls.THICKNESS_GRID_DTYPE.itemsize, vol_path).tobytes())
+            cls._count_mapped_read(stats, cls.THICKNESS_GRID_DTYPE.itemsize)
 
         return header, slo, b_scan_header, b_scans, thickness_grid
 
-    def write_vol(self, write_vol_path):
+    @staticmethod
+    def _record_size(header):
+        """ Return the size in bytes of a B scan record, i.e. a B scan header followed by the B scan """
+        return header['b_scan_hdr_size'] + header['size_x'] * header['size_z'] * 4
+
+    @classmethod
+    def _map_records(cls, vol_map, header):
+        """
+        Return strided views over the interleaved B scan records of a memory-mapped vol file: the raw B scan headers
+        (incl. segmentation) of num_b_scans * b_scan_hdr_size bytes and the B scans of size_z * size_x * num_b_scans
+        """
+        records_offset = cls.HEADER_DTYPE.itemsize + header['size_x_slo'] * header['size_y_slo']
+        record_size = cls._record_size(header)
+        b_scan_headers_raw = np.ndarray((header['num_b_scans'], header['b_scan_hdr_size']), dtype='uint8', buffer=vol_map,
+                                        offset=records_offset, strides=(record_size, 1))
+        b_scans = np.ndarray((header['size_z'], header['size_x'], header['num_b_scans']), dtype='<f4', buffer=vol_map,
+                             offset=records_offset + header['b_scan_hdr_size'],
+                             strides=(header['size_x'] * 4, 4, record_size))
+        return b_scan_headers_raw, b_scans
+
+    @staticmethod
+    def _count_mapped_read(stats, n_bytes, reads=1):
+        """ Count bytes copied out of a memory map as reads into stats, if given """
+        if stats is not None:
+            stats.reads += reads
+            stats.bytes_read += int(n_bytes)
+
+    @classmethod
+    def _check_load(cls, load):
+        """ Validate the parts of the vol file to read and add the ones they depend on """
+        load = tuple(load)
+        unknown_items = [item for item in load if item not in cls.LOAD_ITEMS]
+        if unknown_items:
+            raise ValueError('Unknown item(s) {} in load. Valid items are {}.'.format(unknown_items, cls.LOAD_ITEMS))
+        load = set(load) | {'header'}
+        if 'segmentation' in load:
+            load.add('b_scan_header')
+        return tuple(item for item in cls.LOAD_ITEMS if item in load)
+
+    @staticmethod
+    def _select_b_scans(num_b_scans, b_scan_indices):
+        """ Turn b_scan_indices (None, a slice or a list of indices) into an array of B scan indices within the file """
+        if b_scan_indices is None:
+            return np.arange(num_b_scans)
+        return np.atleast_1d(np.arange(num_b_scans)[b_scan_indices])
+
+    @staticmethod
+    def _map_exactly(vol_map, offset, size, vol_path):
+        """ Return size bytes of the memory map from offset on and raise an error if the file ends before that """
+        if offset + size > vol_map.shape[0]:
+            raise ValueError('Unexpected end of file while reading {}. The vol file seems to be truncated.'.format(vol_path))
+        return vol_map[offset:offset + size]
+
+    @staticmethod
+    def _read_exactly(vf, size):
+        """ Read size bytes from the binary file object vf and raise an error if the file ends before that """
+        data = vf.read(size)
+        if len(data) != size:
+            raise ValueError('Unexpected end of file while reading {}. The vol file seems to be truncated.'.format(getattr(vf, 'name', 'the vol file')))
+        return data
+
+    @staticmethod
+    def _read_into(vf, array):
+        """ Fill the (contiguous) numpy array with the next bytes of the binary file object vf """
+        if vf.readinto(array) != array.nbytes:
+            raise ValueError('Unexpected end of file while reading {}. The vol file seems to be truncated.'.format(getattr(vf, 'name', 'the vol file')))
+
+    @classmethod
+    def _parse_header(cls, buffer):
+        """ Decode the 2048 bytes of the file header into the header dict, incl. the converted dates """
+        raw_header = np.frombuffer(buffer, dtype=cls.HEADER_DTYPE, count=1)[0]
+        header = dict()
+        for name in cls.HEADER_DTYPE.names:
+            if cls.HEADER_DTYPE.fields[name][0].kind == 'S':
+                header[name] = raw_header[name].decode('latin-1')
+            elif cls.HEADER_DTYPE.fields[name][0].subdtype is not None:
+                header[name] = raw_header[name].copy()
+            else:
+                header[name] = raw_header[name]
+        header['exam_time'] = datetime.datetime.utcfromtimestamp(header['unconverted_exam_time']/1e7 - OCTVol.EXAM_TIME_OFFSET)
+        header['dob'] = (datetime.datetime.utcfromtimestamp(0) + datetime.timedelta(seconds=header['unconverted_dob']*24*60*60 - OCTVol.VISIT_DATE_DOB_OFFSET)).date()
+        header['visit_date'] = datetime.datetime.utcfromtimestamp(header['unconverted_visit_date']*24*60*60 - OCTVol.VISIT_DATE_DOB_OFFSET)
+        return header
+
+    @classmethod
+    def _parse_b_scan_headers(cls, b_scan_headers_raw, header, segmentation=True):
+        """
+        Decode the raw B scan headers into the b_scan_header dict
+
+        Parameters
+        ----------
+        b_scan_headers_raw : numpy.ndarray
+            uint8 array of shape num_b_scans * b_scan_hdr_size holding the raw B scan headers (incl. segmentation)
+        header : dict
+            The already decoded file header
+        segmentation : bool, optional
+            If False, only the B scan header fields are decoded but not the boundary_N items. Default is True
+
+        Returns
+        -------
+        dict
+            b_scan_header with one entry per B scan in each item
+        """
+        num_b_scans = b_scan_headers_raw.shape[0]
+
+        # View all B scan headers as one strided structured array and copy each field out in one go
+        b_scan_headers_raw = np.ascontiguousarray(b_scan_headers_raw)
+        raw = np.ndarray((num_b_scans,), dtype=cls.B_SCAN_HEADER_DTYPE, buffer=b_scan_headers_raw,
+                         strides=(b_scan_headers_raw.strides[0],))
+        b_scan_header = dict(version=b_scan_headers_raw[:, :cls.B_SCAN_HEADER_DTYPE['version'].itemsize].astype('uint32').view('U1').T.copy())
+        for name in cls.B_SCAN_HEADER_DTYPE.names[1:]:
+            b_scan_header[name] = raw[name].T.copy()
+
+        if num_b_scans == 0 or not segmentation:
+            return b_scan_header
+
+        # Create boundaries items now that we know the number of segmentation lines from the first B scan
+        for i_boundary in range(b_scan_header['num_seg'][0]):
+            b_scan_header['boundary_{}'.format(i_boundary + 1)] = np.full((num_b_scans, header['size_x']), np.nan, dtype='float32')
+
+        # Read segmentation, all B scans at once if the segmentation is laid out the same way in all of them (which is
+        # the normal case) or B scan by B scan otherwise
+        num_seg, off_seg = b_scan_header['num_seg'], b_scan_header['off_seg']
+        if np.all(num_seg == num_seg[0]) and np.all(off_seg == off_seg[0]) and \
+                off_seg[0] + num_seg[0] * header['size_x'] * 4 <= b_scan_headers_raw.shape[1]:
+            segmentation = np.ascontiguousarray(b_scan_headers_raw[:, off_seg[0]:off_seg[0] + num_seg[0] * header['size_x'] * 4])
+            segmentation = segmentation.view('<f4').reshape((num_b_scans, num_seg[0], header['size_x']))
+            for i_boundary in range(num_seg[0]):
+                b_scan_header['boundary_{}'.format(i_boundary + 1)][:, :] = segmentation[:, i_boundary, :]
+        else:
+            for i_b_scan in range(num_b_scans):
+                segmentation = np.frombuffer(b_scan_headers_raw[i_b_scan, off_seg[i_b_scan]:].tobytes(), dtype='<f4',
+                                             count=num_seg[i_b_scan] * header['size_x'])
+                for i_boundary in range(num_seg[i_b_scan]):
+                    b_scan_header['boundary_{}'.format(i_boundary + 1)][i_b_scan, :] = segmentation[i_boundary * header['size_x']:(i_boundary + 1) * header['size_x']]
+
+        return b_scan_header
+
+    @classmethod
+    def _parse_thickness_grid(cls, buffer):
+        """ Decode the raw thickness grid into the thickness_grid dict """
+        raw_grid = np.frombuffer(buffer, dtype=cls.THICKNESS_GRID_DTYPE, count=1)[0]
+        thickness_grid = dict(type=raw_grid['type'],
+                              diameter=raw_grid['diameter'].copy(),
+                              center_pos=raw_grid['center_pos'].copy(),
+                              central_thk=raw_grid['central_thk'],
+                              min_central_thk=raw_grid['min_central_thk'],
+                              max_central_thk=raw_grid['max_central_thk'],
+                              total_volume=raw_grid['total_volume'])
+        for i_sector in range(9):
+            thickness_grid['sector_{}'.format(i_sector+1)] = dict(thickness=raw_grid['sectors'][i_sector, 0],
+                                                                  volume=raw_grid['sectors'][i_sector, 1])
+        return thickness_grid
+
+    def write_vol(self, write_vol_path, stats=None):
         """
         Writes the OCTVol object, which contains an OCT image and its information, into a .vol file
 
@@ -201,73 +464,292 @@ class OCTVol:
         ----------
         write_vol_path : str
             The path where the vol file is written to
+        stats : IOStats, optional
+            If given, the time of each phase of writing and the I/O are recorded into it, see write_vol_stream. Default
+            is None
+
+        Raises
+        ------
+        ValueError
+            if only a part of the vol file (see load and b_scan_indices) was read into the OCTVol object
+        """
+        if self.load != OCTVol.LOAD_ITEMS or not np.array_equal(self.b_scan_indices, np.arange(self.header['num_b_scans'])):
+            raise ValueError('Only a part of {} was read, so it cannot be written as a vol file. Please read the whole file to write it.'.format(self.vol_path))
+
+        OCTVol.write_vol_stream(write_vol_path, self.header, self.slo, self.b_scan_header,
+                                (self.b_scans[:, :, i_b_scan] for i_b_scan in range(self.header['num_b_scans'])),
+                                self.thickness_grid, stats=stats)
+
+    @classmethod
+    def write_vol_stream(cls, write_vol_path, header, slo, b_scan_header, b_scans, thickness_grid=None, stats=None):
+        """
+        Writes an OCT image and its information into a .vol file, taking the B scans one by one from an iterable
+
+        Parameters
+        ----------
+        write_vol_path : str
+            The path where the vol file is written to
+        header : dict
+            The vol file header with the items of HEADER_DTYPE, e.g. the header of another OCTVol object
+        slo : numpy.ndarray
+            SLO image of size_y_slo * size_x_slo
+        b_scan_header : dict
+            B scan headers and segmentation with one entry per B scan in each item, as in OCTVol.b_scan_header
+        b_scans : iterable of numpy.ndarray
+            The num_b_scans B scans, each of size_z * size_x, e.g. a generator producing them one at a time
+        thickness_grid : dict, optional
+            Thickness grid as in OCTVol.thickness_grid, written if header['grid_type'] is not 0. Default is None
+        stats : IOStats, optional
+            Records the time of the phases 'write_header', 'write_slo', 'write_b_scans' (incl. producing and encoding
+            the B scan records) and 'write_thickness_grid' and the writes and seeks. Default is None
+
+        Raises
+        ------
+        ValueError
+            if b_scans does not yield num_b_scans B scans
+
+        Notes
+        -----
+        Each B scan record (B scan header, segmentation at off_seg and the B scan) is put together in one buffer and
+        written at once, so only one B scan has to be held in memory at a time.
         """
+        if stats is not None:
+            stats.files += 1
         with open(write_vol_path if '.vol' in write_vol_path else write_vol_path + '.vol', 'wb') as vf:
-            # Write the header
-            vf.write(self.header['version'].encode() + (12 - len(self.header['version'])) * b'\0')
-            self.header['size_x'].tofile(vf)
-            self.header['num_b_scans'].tofile(vf)
-            self.header['size_z'].tofile(vf)
-            self.header['scale_x'].tofile(vf)
-            self.header['distance'].tofile(vf)
-            self.header['scale_z'].tofile(vf)
-            self.header['size_x_slo'].tofile(vf)
-            self.header['size_y_slo'].tofile(vf)
-            self.header['scale_x_slo'].tofile(vf)
-            self.header['scale_y_slo'].tofile(vf)
-            self.header['field_size_slo'].tofile(vf)
-            self.header['scan_focus'].tofile(vf)
-            vf.write(self.header['scan_position'].encode() + (4 - len(self.header['scan_position'])) * b'\0')
-            self.header['unconverted_exam_time'].tofile(vf)
-            self.header['scan_pattern'].tofile(vf)
-            self.header['b_scan_hdr_size'].tofile(vf)
-            vf.write(self.header['id'].encode() + (16 - len(self.header['id'])) * b'\0')
-            vf.write(self.header['reference_id'].encode() + (16 - len(self.header['reference_id'])) * b'\0')
-            self.header['pid'].tofile(vf)
-            vf.write(self.header['patient_id'].encode() + (21 - len(self.header['patient_id'])) * b'\0')
-            self.header['padding'].tofile(vf)
-            self.header['unconverted_dob'].tofile(vf)
-            self.header['vid'].tofile(vf)
-            vf.write(self.header['visit_id'].encode() + (24 - len(self.header['visit_id'])) * b'\0')
-            self.header['unconverted_visit_date'].tofile(vf)
-            self.header['grid_type'].tofile(vf)
-            self.header['grid_offset'].tofile(vf)
-            self.header['spare'].tofile(vf)
-
-            # Write the slo image
-            vf.seek(2048)
-            self.slo.reshape(-1).tofile(vf)
-
-            # Write BScan and BScan header
-            for i_b_scan in range(self.header['num_b_scans']):
-                vf.seek(2048 + self.header['size_x_slo']*self.header['size_y_slo'] + i_b_scan*(self.header['b_scan_hdr_size']+self.header['size_x']*self.header['size_z']*4))
-                np.vectorize(str.encode)(self.b_scan_header['version'][:, i_b_scan]).tofile(vf)
-                self.b_scan_header['b_scan_hdr_size'][i_b_scan].tofile(vf)
-                self.b_scan_header['start_x'][i_b_scan].tofile(vf)
-                self.b_scan_header['start_y'][i_b_scan].tofile(vf)
-                self.b_scan_header['end_x'][i_b_scan].tofile(vf)
-                self.b_scan_header['end_y'][i_b_scan].tofile(vf)
-                self.b_scan_header['num_seg'][i_b_scan].tofile(vf)
-                self.b_scan_header['off_seg'][i_b_scan].tofile(vf)
-                self.b_scan_header['quality'][i_b_scan].tofile(vf)
-                self.b_scan_header['shift'][i_b_scan].tofile(vf)
-                self.b_scan_header['spare'][:, i_b_scan].tofile(vf)
-                vf.seek(2048 + self.header['size_x_slo']*self.header['size_y_slo'] + i_b_scan*(self.header['b_scan_hdr_size']+self.header['size_x']*self.header['size_z']*4) + self.b_scan_header['off_seg'][i_b_scan])
-                for i_boundary in range(self.b_scan_header['num_seg'][i_b_scan]):
-                    self.b_scan_header['boundary_{}'.format(i_boundary+1)][i_b_scan, :].tofile(vf)
-                vf.seek(2048 + self.header['size_x_slo']*self.header['size_y_slo'] + i_b_scan*(self.header['b_scan_hdr_size']+self.header['size_x']*self.header['size_z']*4) + self.header['b_scan_hdr_size'])
-                self.b_scans[:, :, i_b_scan].reshape(-1).tofile(vf)
+            vf = counting(vf, stats)
+
+            # Write the header and the slo image
+            with phase(stats, 'write_header'):
+                vf.write(cls._build_header(header).tobytes())
+            with phase(stats, 'write_slo'):
+                vf.write(np.ascontiguousarray(slo, dtype='uint8'))
+
+            # Write BScan and BScan header, one record at a time
+            with phase(stats, 'write_b_scans'):
+                b_scan_headers = cls._build_b_scan_headers(b_scan_header).view('uint8').reshape((header['num_b_scans'], -1))
+                record = np.zeros(header['b_scan_hdr_size'] + header['size_x'] * header['size_z'] * 4, dtype='uint8')
+                record_b_scan = record[header['b_scan_hdr_size']:].view('<f4').reshape((header['size_z'], header['size_x']))
+                i_b_scan = -1
+                for i_b_scan, b_scan in enumerate(b_scans):
+                    if i_b_scan >= header['num_b_scans']:
+                        raise ValueError('More than num_b_scans={} B scans were given.'.format(header['num_b_scans']))
+                    record[:header['b_scan_hdr_size']] = 0
+                    record[:b_scan_headers.shape[1]] = b_scan_headers[i_b_scan]
+                    seg_offset = b_scan_header['off_seg'][i_b_scan]
+                    for i_boundary in range(b_scan_header['num_seg'][i_b_scan]):
+                        boundary = np.asarray(b_scan_header['boundary_{}'.format(i_boundary+1)][i_b_scan, :], dtype='<f4')
+                        record[seg_offset:seg_offset + boundary.nbytes] = boundary.view('uint8')
+                        seg_offset += boundary.nbytes
+                    record_b_scan[...] = b_scan
+                    vf.write(record)
+            if i_b_scan + 1 != header['num_b_scans']:
+                raise ValueError('Only {} of num_b_scans={} B scans were given.'.format(i_b_scan + 1, header['num_b_scans']))
 
             # Write the thickness grid if it exists
-            vf.seek(self.header['grid_offset'])
-            if self.header['grid_type'] != 0:
-                self.thickness_grid['type'].tofile(vf)
-                self.thickness_grid['diameter'].tofile(vf)
-                self.thickness_grid['center_pos'].tofile(vf)
-                self.thickness_grid['central_thk'].tofile(vf)
-                self.thickness_grid['min_central_thk'].tofile(vf)
-                self.thickness_grid['max_central_thk'].tofile(vf)
-                self.thickness_grid['total_volume'].tofile(vf)
-                for i_sector in range(9):
-                    self.thickness_grid['sector_{}'.format(i_sector+1)]['thickness'].tofile(vf)
-                    self.thickness_grid['sector_{}'.format(i_sector+1)]['volume'].tofile(vf)
+            if header['grid_type'] != 0:
+                with phase(stats, 'write_thickness_grid'):
+                    vf.seek(header['grid_offset'])
+                    vf.write(cls._build_thickness_grid(thickness_grid).tobytes())
+
+    @classmethod
+    def patch_vol(cls, vol_path, header=None, b_scan_header=None, thickness_grid=None, b_scan_indices=None,
+                  atomic=False, stats=None):
+        """
+        Overwrites header fields, B scan header fields (incl. segmentation) or thickness grid fields of an existing .vol
+        file in place, without reading or rewriting the rest of the file
+
+        Parameters
+        ----------
+        vol_path : str
+            The path to the vol file
+        header : dict, optional
+            Header fields (of HEADER_DTYPE, e.g. 'patient_id' or 'unconverted_exam_time') mapped to their new values.
+            Default is None
+        b_scan_header : dict, optional
+            B scan header fields ('start_x', 'start_y', 'end_x', 'end_y', 'quality', 'shift') and boundaries
+            ('boundary_N') mapped to their new values with one entry per B scan of b_scan_indices, as in
+            OCTVol.b_scan_header, e.g. boundary_1=array of num_b_scans * size_x. Default is None
+        thickness_grid : dict, optional
+            Thickness grid fields (as in OCTVol.thickness_grid, e.g. 'central_thk' or 'sector_1', a dict of 'thickness'
+            and/or 'volume') mapped to their new values. The vol file must have a thickness grid. Default is None
+        b_scan_indices : slice or list of int, optional
+            The B scans the values of b_scan_header are for. Default is None, i.e. all B scans
+        atomic : bool, optional
+            If True, a copy of the vol file (with its permissions) is patched and then replaces it, so readers never see a
+            partially patched file. This copies the whole file. Default is False, i.e. only the patched bytes are written
+        stats : IOStats, optional
+            If given, the phases 'read_patch_layout' and 'write_patch' and the I/O are recorded into it. Default is None
+
+        Returns
+        -------
+        int
+            The number of bytes written into the vol file (excluding the copy if atomic)
+
+        Raises
+        ------
+        ValueError
+            if a field is unknown or defines the layout of the file (e.g. 'size_x', 'num_seg' or 'grid_offset'), if a
+            value does not have one entry per B scan, if a boundary is not stored in a B scan or if the thickness grid
+            is patched in a vol file without one. Nothing is written in that case
+
+        Notes
+        -----
+        All changes are checked and encoded before the first byte is written. Adjacent patched bytes, e.g. all
+        boundaries of a B scan, are written in one go. The derived header fields 'exam_time', 'dob' and 'visit_date'
+        are patched through 'unconverted_exam_time', 'unconverted_dob' and 'unconverted_visit_date'.
+        """
+        header, b_scan_header, thickness_grid = header or dict(), b_scan_header or dict(), thickness_grid or dict()
+        if stats is not None:
+            stats.files += 1
+
+        with open(vol_path, mode='rb') as vf:
+            vf = counting(vf, stats)
+            with phase(stats, 'read_patch_layout'):
+                file_header = cls._parse_header(cls._read_exactly(vf, cls.HEADER_DTYPE.itemsize))
+                patches = cls._header_patches(header)
+                if b_scan_header:
+                    patches += cls._b_scan_header_patches(vf, file_header, b_scan_header, b_scan_indices)
+                if thickness_grid:
+                    patches += cls._thickness_grid_patches(vf, file_header, thickness_grid)
+
+        # Merge adjacent patches into single writes
+        writes = []
+        for offset, data in sorted(patches, key=lambda patch: patch[0]):
+            if writes and writes[-1][0] + len(writes[-1][1]) == offset:
+                writes[-1][1].extend(data)
+            else:
+                writes.append((offset, bytearray(data)))
+
+        patch_path = vol_path
+        if atomic:
+            # A unique copy next to the vol file (on the same file system for os.replace) with the same permissions
+            patch_file, patch_path = tempfile.mkstemp(suffix='.patch.tmp', prefix=os.path.basename(vol_path) + '.',
+                                                      dir=os.path.dirname(os.path.abspath(vol_path)))
+            os.close(patch_file)
+        try:
+            if atomic:
+                shutil.copy2(vol_path, patch_path)
+            with open(patch_path, mode='r+b') as vf:
+                vf = counting(vf, stats)
+                with phase(stats, 'write_patch'):
+                    for offset, data in writes:
+                        vf.seek(offset)
+                        vf.write(data)
+            if atomic:
+                os.replace(patch_path, vol_path)
+        finally:
+            if atomic and os.path.exists(patch_path):
+                os.remove(patch_path)
+
+        return sum(len(data) for _, data in writes)
+
+    @classmethod
+    def _header_patches(cls, header):
+        """ Encode the header fields to patch into (offset in the file, bytes) """
+        layout_fields = ('size_x', 'num_b_scans', 'size_z', 'size_x_slo', 'size_y_slo', 'b_scan_hdr_size', 'grid_type',
+                         'grid_offset')
+        patches = []
+        for name, value in header.items():
+            if name not in cls.HEADER_DTYPE.names or name in layout_fields:
+                raise ValueError('The header field {} cannot be patched. Valid fields are {}.'.format(
+                    name, [field for field in cls.HEADER_DTYPE.names if field not in layout_fields]))
+            field_dtype, offset = cls.HEADER_DTYPE.fields[name][:2]
+            patches.append((offset, cls._encode_field(value, field_dtype)))
+        return patches
+
+    @classmethod
+    def _b_scan_header_patches(cls, vf, header, b_scan_header, b_scan_indices):
+        """ Encode the B scan header fields and boundaries to patch into (offset in the file, bytes) """
+        patchable_fields = ('start_x', 'start_y', 'end_x', 'end_y', 'quality', 'shift')
+        selected_b_scans = cls._select_b_scans(header['num_b_scans'], b_scan_indices)
+        records_offset = cls.HEADER_DTYPE.itemsize + header['size_x_slo'] * header['size_y_slo']
+        record_size = header['b_scan_hdr_size'] + header['size_x'] * header['size_z'] * 4
+
+        # The position of the segmentation in the B scan headers to patch
+        num_seg, off_seg = np.empty(len(selected_b_scans), dtype=int), np.empty(len(selected_b_scans), dtype=int)
+        for i_patch, i_b_scan in enumerate(selected_b_scans):
+            vf.seek(records_offset + i_b_scan * record_size)
+            raw = np.frombuffer(cls._read_exactly(vf, cls.B_SCAN_HEADER_DTYPE.itemsize), dtype=cls.B_SCAN_HEADER_DTYPE)[0]
+            num_seg[i_patch], off_seg[i_patch] = raw['num_seg'], raw['off_seg']
+
+        patches = []
+        for name, values in b_scan_header.items():
+            values = np.asarray(values)
+            if name.startswith('boundary_') and name[len('boundary_'):].isdigit():
+                i_boundary = int(name[len('boundary_'):]) - 1
+                field_dtype, offsets = np.dtype(('<f4', (header['size_x'],))), off_seg + i_boundary * header['size_x'] * 4
+                if i_boundary < 0 or np.any(i_boundary >= num_seg) or np.any(offsets + field_dtype.itemsize > header['b_scan_hdr_size']):
+                    raise ValueError('{} is not stored in all the B scans to patch.'.format(name))
+            elif name in patchable_fields:
+                field_dtype, offset = cls.B_SCAN_HEADER_DTYPE.fields[name][:2]
+                offsets = np.full(len(selected_b_scans), offset)
+            else:
+                raise ValueError('The B scan header field {} cannot be patched. Valid fields are {} and the boundaries.'.format(
+                    name, list(patchable_fields)))
+            if values.shape != (len(selected_b_scans),) + field_dtype.shape:
+                raise ValueError('{} has the shape {} instead of {}.'.format(
+                    name, values.shape, (len(selected_b_scans),) + field_dtype.shape))
+            for i_patch, i_b_scan in enumerate(selected_b_scans):
+                patches.append((records_offset + i_b_scan * record_size + offsets[i_patch],
+                                cls._encode_field(values[i_patch], field_dtype)))
+        return patches
+
+    @classmethod
+    def _thickness_grid_patches(cls, vf, header, thickness_grid):
+        """ Encode the thickness grid fields to patch into (offset in the file, bytes) """
+        if header['grid_type'] == 0:
+            raise ValueError('The vol file has no thickness grid to patch.')
+        vf.seek(header['grid_offset'])
+        raw_grid = np.frombuffer(cls._read_exactly(vf, cls.THICKNESS_GRID_DTYPE.itemsize), dtype=cls.THICKNESS_GRID_DTYPE).copy()
+        for name, value in thickness_grid.items():
+            if name.startswith('sector_') and name[len('sector_'):].isdigit() and 1 <= int(name[len('sector_'):]) <= 9:
+                for i_item, item in enumerate(('thickness', 'volume')):
+                    if item in value:
+                        raw_grid['sectors'][0, int(name[len('sector_'):]) - 1, i_item] = value[item]
+            elif name in cls.THICKNESS_GRID_DTYPE.names[:-1]:
+                raw_grid[name][0] = value
+            else:
+                raise ValueError('Unknown thickness grid field {}. Valid fields are {} and sector_1 to sector_9.'.format(
+                    name, list(cls.THICKNESS_GRID_DTYPE.names[:-1])))
+        return [(header['grid_offset'], raw_grid.tobytes())]
+
+    @staticmethod
+    def _encode_field(value, field_dtype):
+        """ Encode a value as the bytes of a field of field_dtype, strings as latin-1 """
+        if field_dtype.kind == 'S':
+            value = value.encode('latin-1') if isinstance(value, str) else value
+            if len(value) > field_dtype.itemsize:
+                raise ValueError('{} does not fit into {} bytes.'.format(value, field_dtype.itemsize))
+        return np.broadcast_to(np.asarray(value, dtype=field_dtype.base), field_dtype.shape).tobytes()
+
+    @classmethod
+    def _build_header(cls, header):
+        """ Encode the header dict into a HEADER_DTYPE record """
+        raw_header = np.zeros((), dtype=cls.HEADER_DTYPE)
+        for name in cls.HEADER_DTYPE.names:
+            if cls.HEADER_DTYPE.fields[name][0].kind == 'S':
+                raw_header[name] = header[name].encode('latin-1')
+            else:
+                raw_header[name] = header[name]
+        return raw_header
+
+    @classmethod
+    def _build_b_scan_headers(cls, b_scan_header):
+        """ Encode the B scan header fields of the b_scan_header dict into an array of B_SCAN_HEADER_DTYPE records """
+        raw = np.zeros(len(b_scan_header['b_scan_hdr_size']), dtype=cls.B_SCAN_HEADER_DTYPE)
+        raw.view('uint8').reshape((len(raw), -1))[:, :cls.B_SCAN_HEADER_DTYPE['version'].itemsize] = \
+            np.ascontiguousarray(b_scan_header['version'].T, dtype='U1').view('<u4')
+        for name in cls.B_SCAN_HEADER_DTYPE.names[1:]:
+            raw[name] = b_scan_header[name].T
+        return raw
+
+    @classmethod
+    def _build_thickness_grid(cls, thickness_grid):
+        """ Encode the thickness_grid dict into a THICKNESS_GRID_DTYPE record """
+        raw_grid = np.zeros((), dtype=cls.THICKNESS_GRID_DTYPE)
+        for name in cls.THICKNESS_GRID_DTYPE.names[:-1]:
+            raw_grid[name] = thickness_grid[name]
+        for i_sector in range(9):
+            raw_grid['sectors'][i_sector] = (thickness_grid['sector_{}'.format(i_sector+1)]['thickness'],
+                                             thickness_grid['sector_{}'.format(i_sector+1)]['volume'])
+        return raw_grid
@@ -0,0 +1,147 @@
+import contextlib
+import tracemalloc
+import time
+
+
+_NO_PHASE = contextlib.nullcontext()
+
+
+class IOStats:
+    """
+    The IOStats object records where the time of reading, writing and converting vol files goes
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        If True, the peak of the memory allocated (e.g. numpy arrays) during each phase is traced with tracemalloc,
+        which slows down allocations while a phase runs. Default is False
+
+    Attributes
+    ----------
+    seconds : dict
+        The wall time spent in each phase by phase name, e.g. 'read_header', 'read_b_scans', 'transform' or 'save'
+    calls : dict
+        How often each phase ran
+    peak_bytes : dict
+        The largest peak of allocated memory of each phase, only if trace_memory is True
+    bytes_read, bytes_written : int
+        The bytes read from and written to files
+    reads, writes, seeks : int
+        The number of read, write and seek calls on files
+    files : int
+        The number of files the stats were recorded for
+
+    Notes
+    -----
+    Pass an IOStats object as the stats argument of OCTVol, write_vol, write_vol_stream and the conversion functions to
+    record into it. Without it (stats=None, the default) nothing is recorded, the file objects are used directly and
+    the only cost is a check per phase. Stats of several files or runs are added up with merge.
+
+    Examples
+    --------
+    >>> stats = IOStats()
+    >>> oct_vol = OCTVol("/path/to/file.vol", stats=stats)
+    >>> print(stats.report())
+    """
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.seconds = dict()
+        self.calls = dict()
+        self.peak_bytes = dict()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.reads = 0
+        self.writes = 0
+        self.seeks = 0
+        self.files = 0
+
+    @contextlib.contextmanager
+    def _phase(self, name: str):
+        if self.trace_memory:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.trace_memory:
+                self.peak_bytes[name] = max(self.peak_bytes.get(name, 0),
+                                            tracemalloc.get_traced_memory()[1] - traced_before)
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def merge(self, other: 'IOStats') -> 'IOStats':
+        """ Add the stats of other to these stats and return them """
+        for name, seconds in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+        for name, peak_bytes in other.peak_bytes.items():
+            self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), peak_bytes)
+        for counter in ('bytes_read', 'bytes_written', 'reads', 'writes', 'seeks', 'files'):
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        return self
+
+    def as_dict(self) -> dict:
+        """ Return the stats as a JSON serializable dict """
+        return dict(seconds=dict(self.seconds), calls=dict(self.calls), peak_bytes=dict(self.peak_bytes),
+                    bytes_read=self.bytes_read, bytes_written=self.bytes_written, reads=self.reads,
+                    writes=self.writes, seeks=self.seeks, files=self.files)
+
+    def report(self) -> str:
+        """ Return the stats as a table of the phases, slowest first, followed by the I/O totals """
+        total_seconds = sum(self.seconds.values())
+        lines = ['{:<28}{:>12}{:>8}{:>8}{:>12}'.format('phase', 'seconds', '%', 'calls', 'peak MB')]
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            lines.append('{:<28}{:>12.4f}{:>8.1f}{:>8}{:>12}'.format(
+                name, self.seconds[name], 100 * self.seconds[name] / total_seconds if total_seconds else 0,
+                self.calls[name], '{:.1f}'.format(self.peak_bytes[name] / 1e6) if name in self.peak_bytes else '-'))
+        lines.append('{} files, {:.1f} MB read in {} reads and {} seeks, {:.1f} MB written in {} writes'.format(
+            self.files, self.bytes_read / 1e6, self.reads, self.seeks, self.bytes_written / 1e6, self.writes))
+        return '\n'.join(lines)
+
+
+def phase(stats: IOStats, name: str):
+    """ Return a context manager timing a phase into stats, one doing nothing if stats is None """
+    return _NO_PHASE if stats is None else stats._phase(name)
+
+
+class CountingFile:
+    """ A wrapper of a binary file object that counts the reads, writes, seeks and bytes into an IOStats object """
+    def __init__(self, file, stats: IOStats):
+        self._file = file
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self._stats.reads += 1
+        self._stats.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        n_read = self._file.readinto(buffer)
+        self._stats.reads += 1
+        self._stats.bytes_read += n_read or 0
+        return n_read
+
+    def write(self, buffer) -> int:
+        n_written = self._file.write(buffer)
+        self._stats.writes += 1
+        self._stats.bytes_written += n_written
+        return n_written
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self._stats.seeks += 1
+        return self._file.seek(offset, whence)
+
+
+def counting(file, stats: IOStats):
+    """ Return file wrapped to count its I/O into stats, or file itself if stats is None """
+    return file if stats is None else CountingFile(file, stats)
@@ -0,0 +1,129 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.save_OCT_and_segmentation_as_numpy import extract_segmentation, combine_oct_and_segmentation_as_numpy
+from OCT.src.synthetic_vol import make_synthetic_vol
+import numpy as np
+import tempfile
+import tracemalloc
+import argparse
+import json
+import time
+import sys
+import os
+
+
+DEFAULT_SIZES = ((512, 496, 25), (512, 496, 97), (768, 496, 61))  # size_x, size_z, num_b_scans
+
+
+def _benchmark_cases(vol_path: str, work_dir: str) -> dict:
+    """ Return the benchmarked operations by name, each a function of an eagerly read OCTVol object of vol_path """
+    return {
+        'open': lambda oct_vol: OCTVol(vol_path),
+        'open_mmap': lambda oct_vol: OCTVol(vol_path, mmap=True),
+        'open_header': lambda oct_vol: OCTVol(vol_path, load=('header',)),
+        'write_vol': lambda oct_vol: oct_vol.write_vol(os.path.join(work_dir, 'written.vol')),
+        'extract_segmentation': lambda oct_vol: extract_segmentation(oct_vol),
+        'extract_segmentation_label_map': lambda oct_vol: extract_segmentation(oct_vol, label_map=True),
+        'combine_oct_and_segmentation_as_numpy': lambda oct_vol: combine_oct_and_segmentation_as_numpy(oct_vol),
+        'combine_oct_and_segmentation_as_numpy_uint8': lambda oct_vol: combine_oct_and_segmentation_as_numpy(oct_vol, dtype=np.uint8),
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat: int = 3, work_dir: str = None) -> list[dict]:
+    """
+    Time reading, writing and converting synthetic vol files of different sizes
+
+    Parameters
+    ----------
+    sizes : list of tuple of int, optional
+        The (size_x, size_z, num_b_scans) of the benchmarked volumes. Default is DEFAULT_SIZES
+    repeat : int, optional
+        How often each operation is timed, the fastest run is reported. Default is 3
+    work_dir : str, optional
+        The directory the synthetic vol files are written to, None for a temporary directory. Default is None
+
+    Returns
+    -------
+    list of dict
+        One result per volume size and operation with 'case', 'size' (size_x, size_z, num_b_scans), 'seconds' (of
+        the fastest run), 'mb_per_s' (MB of the vol file per second), 'b_scans_per_s' and 'peak_mb' (the peak of the
+        memory allocated during the operation, measured in a separate run)
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = temp_dir if work_dir is None else work_dir
+        results = []
+        for size_x, size_z, num_b_scans in sizes:
+            vol_path = make_synthetic_vol(os.path.join(work_dir, 'synthetic_{}x{}x{}.vol'.format(size_x, size_z, num_b_scans)),
+                                          size_x=size_x, size_z=size_z, num_b_scans=num_b_scans)
+            vol_mb = os.path.getsize(vol_path) / 1e6
+            oct_vol = OCTVol(vol_path)
+
+            for case, operation in _benchmark_cases(vol_path, work_dir).items():
+                seconds = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    operation(oct_vol)
+                    seconds.append(time.perf_counter() - start)
+
+                tracemalloc.start()
+                operation(oct_vol)
+                peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+
+                results.append(dict(case=case, size=[size_x, size_z, num_b_scans], seconds=min(seconds),
+                                    mb_per_s=vol_mb / min(seconds), b_scans_per_s=num_b_scans / min(seconds),
+                                    peak_mb=peak_mb))
+            os.remove(vol_path)
+
+    return results
+
+
+def find_regressions(results: list[dict], baseline: list[dict], tolerance: float = 0.2) -> list[str]:
+    """ Compare results against the results of a previous run and describe the ones that became slower than tolerance """
+    baseline = {(result['case'], tuple(result['size'])): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['case'], tuple(result['size'])))
+        if previous is not None and result['seconds'] > previous['seconds'] * (1 + tolerance):
+            regressions.append('{} {}: {:.4f} s instead of {:.4f} s'.format(
+                result['case'], 'x'.join(map(str, result['size'])), result['seconds'], previous['seconds']))
+    return regressions
+
+
+def print_results(results: list[dict]) -> None:
+    """ Print the results of run_benchmarks as a table """
+    print('{:<40}{:>14}{:>12}{:>12}{:>14}{:>12}'.format('case', 'size', 'seconds', 'MB/s', 'B-scans/s', 'peak MB'))
+    for result in results:
+        print('{:<40}{:>14}{:>12.4f}{:>12.1f}{:>14.1f}{:>12.1f}'.format(
+            result['case'], 'x'.join(map(str, result['size'])), result['seconds'], result['mb_per_s'],
+            result['b_scans_per_s'], result['peak_mb']))
+
+
+def main(argv: list[str] = None) -> int:
+    """ Command line entry point of the benchmarks, returns 1 if a regression against --compare was found """
+    parser = argparse.ArgumentParser(description="Benchmark reading, writing and converting synthetic vol files")
+    parser.add_argument("--sizes", nargs="+", default=['x'.join(map(str, size)) for size in DEFAULT_SIZES],
+                        help="Volume sizes as size_x x size_z x num_b_scans, e.g. 512x496x25")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per operation (default: 3)")
+    parser.add_argument("--output", help="Save the results as JSON to this file")
+    parser.add_argument("--compare", help="Compare against the JSON results of a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative slowdown reported as regression by --compare (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks([tuple(int(n) for n in size.split('x')) for size in args.sizes], repeat=args.repeat)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=1)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.save_OCT_and_segmentation_as_numpy import order_segmented_layers, rasterize_layers, _layer_ranges, \
+    LABEL_MAP_UNLABELED
+import numpy as np
+
+
+class BoundarySegmentation:
+    """
+    The BoundarySegmentation object holds the segmentation of a volume as its boundaries and rasterizes the layers
+    only on demand, e.g. for single B-scans or regions
+
+    Parameters
+    ----------
+    boundaries : np.ndarray
+        The boundaries from the innermost to the outermost as float32 array of n boundaries * num_b_scans * size_x, as
+        in the b_scan_header of an OCTVol object (invalid A-scans hold the largest float32 number)
+    names : list of str
+        The names of the boundaries, e.g. 'boundary_1'
+    size_z : int
+        The number of pixels of an A-scan
+
+    Attributes
+    ----------
+    boundaries : np.ndarray
+        The boundaries, n boundaries * num_b_scans * size_x
+    names : list of str
+        The names of the boundaries
+    size_z : int
+        The number of pixels of an A-scan
+
+    Notes
+    -----
+    The layers are the ones of rasterize_layers, i.e. layer 0 above the first boundary, layer i from boundary i to
+    boundary i+1 and the last layer below the last boundary. Saved with save, the segmentation takes 4 bytes per
+    boundary and A-scan (before compression) instead of the size_z * (n boundaries + 1) values per A-scan of the
+    one-hot encoded layers.
+
+    Examples
+    --------
+    >>> segmentation = BoundarySegmentation.from_oct_vol(OCTVol("/path/to/file.vol", load=('header', 'segmentation')))
+    >>> labels = segmentation.rasterize(b_scan_indices=10)  # label map of size_z * size_x * 1
+    >>> segmentation.save("/path/to/file_segmentation.npz")
+    """
+    def __init__(self, boundaries: np.ndarray, names: list[str], size_z: int):
+        self.boundaries = np.asarray(boundaries, dtype=np.float32)
+        self.names = list(names)
+        self.size_z = int(size_z)
+        if self.boundaries.ndim != 3 or self.boundaries.shape[0] != len(self.names):
+            raise ValueError('The boundaries must be an array of {} boundaries * num_b_scans * size_x, not {}.'.format(
+                len(self.names), self.boundaries.shape))
+
+    @classmethod
+    def from_oct_vol(cls, oct_vol: OCTVol) -> 'BoundarySegmentation':
+        """ Create the segmentation of the segmented boundaries of an OCTVol object (see order_segmented_layers) """
+        names = order_segmented_layers(oct_vol)
+        boundaries = np.empty((len(names), oct_vol.header['num_b_scans'], oct_vol.header['size_x']), dtype=np.float32)
+        for i_boundary, name in enumerate(names):
+            boundaries[i_boundary] = oct_vol.b_scan_header[name]
+        return cls(boundaries, names, oct_vol.header['size_z'])
+
+    @classmethod
+    def load(cls, file) -> 'BoundarySegmentation':
+        """ Load a segmentation saved with save from a file path or file object """
+        with np.load(file) as data:
+            return cls(data['boundaries'], data['names'].tolist(), int(data['size_z']))
+
+    def save(self, file, compressed: bool = True) -> None:
+        """ Save the segmentation as .npz to a file path or file object, compressed unless compressed is False """
+        save = np.savez_compressed if compressed else np.savez
+        save(file, boundaries=self.boundaries, names=np.array(self.names), size_z=self.size_z)
+
+    def __len__(self) -> int:
+        return self.boundaries.shape[1]
+
+    @property
+    def num_layers(self) -> int:
+        return len(self.names) + 1
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        """ The shape of the label map of the whole volume, size_z * size_x * num_b_scans """
+        return self.size_z, self.boundaries.shape[2], self.boundaries.shape[1]
+
+    def rasterize(self, b_scan_indices=slice(None), a_scan_indices=slice(None), z_range: tuple[int, int] = None,
+                  label_map: bool = True, dtype=np.uint8) -> np.ndarray:
+        """
+        Rasterize the layers of some B-scans, or of a region of them
+
+        Parameters
+        ----------
+        b_scan_indices : int, slice or list of int, optional
+            The B-scans to rasterize. Default is all
+        a_scan_indices : int, slice or list of int, optional
+            The A-scans of the B-scans to rasterize. Default is all
+        z_range : tuple of int, optional
+            The first and the last (exclusive) pixel of the A-scans to return. Default is None, i.e. all
+        label_map : bool, optional
+            If True, return a uint8 label map, otherwise the one-hot encoded layers (see rasterize_layers). Default is
+            True
+        dtype : data-type, optional
+            The dtype of the one-hot encoded layers. Default is np.uint8
+
+        Returns
+        --------
+        np.ndarray
+            The label map of z * x * b or the one-hot encoded layers of n layers * z * x * b, where b and x are the
+            number of the selected B-scans and A-scans
+        """
+        boundaries = self.boundaries[:, np.atleast_1d(np.arange(len(self))[b_scan_indices])]
+        boundaries = boundaries[:, :, np.atleast_1d(np.arange(self.boundaries.shape[2])[a_scan_indices])]
+        return rasterize_layers(list(boundaries), self.size_z, dtype=dtype, label_map=label_map, z_range=z_range)
+
+    def layer_at(self, z, x, b) -> np.ndarray:
+        """
+        Return the layer of points, i.e. the value of the label map (see rasterize) at the pixels (z, x, b)
+
+        Parameters
+        ----------
+        z, x, b : int or array_like of int
+            The pixel in the A-scan, the A-scan and the B-scan of the points, broadcast against each other
+
+        Returns
+        --------
+        np.ndarray
+            The uint8 layer index of each point (the outer one where layers overlap), LABEL_MAP_UNLABELED where no layer
+            is defined
+        """
+        z, x, b = np.broadcast_arrays(z, x, b)
+        layer_ranges = _layer_ranges(list(self.boundaries[:, b, x]), self.size_z)
+        layers = np.full(z.shape, LABEL_MAP_UNLABELED, dtype=np.uint8)
+        for i_layer, (first, stop) in enumerate(layer_ranges):
+            layers[(z >= first) & (z < stop)] = i_layer
+        return layers
+
+    def in_layer(self, layer: int, z, x, b) -> np.ndarray:
+        """ Return whether points (z, x, b) belong to a layer, which can overlap with the next one (see rasterize_layers) """
+        z, x, b = np.broadcast_arrays(z, x, b)
+        first, stop = _layer_ranges(list(self.boundaries[:, b, x]), self.size_z)[layer]
+        return (z >= first) & (z < stop)
@@ -0,0 +1,162 @@
+import numpy as np
+import json
+import lzma
+import zlib
+import os
+
+
+COMPRESSIONS = dict(zlib=(zlib.compress, zlib.decompress),
+                    lzma=(lzma.compress, lzma.decompress),
+                    none=(bytes, bytes))
+DATA_SUFFIX = ".chunks"  # the compressed chunks of all channels, one after another
+INDEX_SUFFIX = ".index.json"  # the position of every chunk in the data file and the layout of the channels
+FORMAT_VERSION = 1
+
+
+class ChunkedStoreWriter:
+    """
+    The ChunkedStoreWriter object writes a chunked store, i.e. per B-scan arrays (channels such as an image and its
+    labels) compressed in chunks of chunk_size B-scans, with an index file for random access to every chunk
+
+    Parameters
+    ----------
+    store_path : str
+        Path of the store without suffix. The data is written to store_path + DATA_SUFFIX and the index to
+        store_path + INDEX_SUFFIX
+    chunk_size : int, optional
+        The number of B-scans per chunk. Default is 1
+    compression : str, optional
+        The standard library compression of the chunks, one of COMPRESSIONS. Default is 'zlib'
+    attributes : dict, optional
+        JSON serializable information stored in the index, e.g. the source vol file. Default is None
+
+    Notes
+    -----
+    Use it as a context manager and call add_chunk for consecutive chunks. The index is only written on closing, so a
+    store without index is incomplete. The index of an existing store at store_path is removed when it is rewritten.
+    """
+    def __init__(self, store_path: str, chunk_size: int = 1, compression: str = 'zlib', attributes: dict = None):
+        if compression not in COMPRESSIONS:
+            raise ValueError('Unknown compression {}. Valid compressions are {}.'.format(compression, list(COMPRESSIONS)))
+        self.store_path = store_path
+        self.index = dict(format_version=FORMAT_VERSION, num_b_scans=0, chunk_size=chunk_size,
+                          compression=compression, channels=dict(), attributes=attributes or dict())
+        self._compress = COMPRESSIONS[compression][0]
+        # The index of a previous store would point into the new data file until this one is complete
+        if os.path.exists(store_path + INDEX_SUFFIX):
+            os.remove(store_path + INDEX_SUFFIX)
+        self._data_file = open(store_path + DATA_SUFFIX, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(write_index=exc_type is None)
+
+    def add_chunk(self, **channels: np.ndarray) -> None:
+        """
+        Compress and append the next chunk
+
+        Parameters
+        ----------
+        **channels : np.ndarray
+            The arrays of the chunk by channel name, each with the B-scans along the first axis. All chunks but the last
+            must hold chunk_size B-scans
+        """
+        num_b_scans = {channel: array.shape[0] for channel, array in channels.items()}
+        if len(set(num_b_scans.values())) != 1:
+            raise ValueError('The channels of a chunk hold different numbers of B-scans: {}.'.format(num_b_scans))
+
+        for channel, array in channels.items():
+            array = np.ascontiguousarray(array)
+            channel_index = self.index['channels'].setdefault(
+                channel, dict(dtype=array.dtype.str, shape=list(array.shape[1:]), chunks=[]))
+            if array.dtype.str != channel_index['dtype'] or list(array.shape[1:]) != channel_index['shape']:
+                raise ValueError('The {} chunk does not match the dtype and shape of the previous ones.'.format(channel))
+
+            compressed = self._compress(array.tobytes())
+            channel_index['chunks'].append([self._data_file.tell(), len(compressed)])
+            self._data_file.write(compressed)
+
+        self.index['num_b_scans'] += next(iter(num_b_scans.values()))
+
+    def close(self, write_index: bool = True) -> None:
+        """ Close the data file and write the index """
+        self._data_file.close()
+        if write_index:
+            with open(self.store_path + INDEX_SUFFIX + '.tmp', 'w') as index_file:
+                json.dump(self.index, index_file)
+            os.replace(self.store_path + INDEX_SUFFIX + '.tmp', self.store_path + INDEX_SUFFIX)
+
+
+class ChunkedStore:
+    """
+    The ChunkedStore object gives random access to the B-scans of a chunked store written by ChunkedStoreWriter
+
+    Parameters
+    ----------
+    store_path : str
+        Path of the store without suffix
+
+    Attributes
+    ----------
+    store_path : str
+        The path of the store
+    index : dict
+        The index of the store, incl. 'num_b_scans', 'chunk_size', 'compression', 'channels' and 'attributes'
+
+    Examples
+    --------
+    >>> store = ChunkedStore("/path/to/numpy_arrays/EYE00023_8370")
+    >>> b_scan = store[10]  # dict of the channels of B-scan 10, e.g. b_scan['image'], b_scan['labels']
+    """
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        with open(store_path + INDEX_SUFFIX) as index_file:
+            self.index = json.load(index_file)
+        self._decompress = COMPRESSIONS[self.index['compression']][1]
+        self._data_file = None
+        self._cached_chunk = (None, None)
+
+    def __len__(self) -> int:
+        return self.index['num_b_scans']
+
+    def __getitem__(self, i_b_scan: int) -> dict:
+        return self.read_b_scan(i_b_scan)
+
+    @property
+    def attributes(self) -> dict:
+        return self.index['attributes']
+
+    def close(self) -> None:
+        """ Close the data file, it is opened again on the next read """
+        if self._data_file is not None:
+            self._data_file.close()
+            self._data_file = None
+
+    def read_chunk(self, i_chunk: int, channels: list[str] = None) -> dict:
+        """ Read and decompress a chunk, returning the arrays of the chunk (B-scans first) by channel name """
+        channels = list(self.index['channels']) if channels is None else channels
+        if self._cached_chunk[0] == i_chunk and all(channel in self._cached_chunk[1] for channel in channels):
+            return {channel: self._cached_chunk[1][channel] for channel in channels}
+
+        if self._data_file is None:
+            self._data_file = open(self.store_path + DATA_SUFFIX, 'rb')
+        chunk = dict()
+        for channel in channels:
+            channel_index = self.index['channels'][channel]
+            offset, size = channel_index['chunks'][i_chunk]
+            self._data_file.seek(offset)
+            chunk[channel] = np.frombuffer(self._decompress(self._data_file.read(size)),
+                                           dtype=channel_index['dtype']).reshape([-1] + channel_index['shape'])
+        self._cached_chunk = (i_chunk, chunk)
+        return chunk
+
+    def read_b_scan(self, i_b_scan: int, channels: list[str] = None) -> dict:
+        """ Read a B-scan, returning its arrays by channel name (only the given channels if channels is not None) """
+        if i_b_scan < 0:
+            i_b_scan += len(self)
+        if not 0 <= i_b_scan < len(self):
+            raise IndexError('B-scan {} is out of range for a store of {} B-scans.'.format(i_b_scan, len(self)))
+        chunk = self.read_chunk(i_b_scan // self.index['chunk_size'], channels)
+        return {channel: array[i_b_scan % self.index['chunk_size']] for channel, array in chunk.items()}
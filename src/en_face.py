@@ -0,0 +1,133 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.save_OCT_and_segmentation_as_numpy import transform_b_scans, _layer_ranges, TRANSFORM_CHUNK_SIZE
+from OCT.src.retinal_thickness import fundus_coordinates
+import numpy as np
+
+
+def en_face_projections(oct_vol: OCTVol, slabs: dict = None, chunk_size: int = TRANSFORM_CHUNK_SIZE) -> dict:
+    """
+    Project the B-scans of a volume along the A-scans into en-face images
+
+    Parameters
+    ----------
+    oct_vol : OCTVol
+        An OCTVol object with the B-scans, ideally memory-mapped (mmap=True), and the segmentation if slabs are given
+    slabs : dict, optional
+        Names of slab projections mapped to the (upper, lower) boundaries they average between, e.g.
+        dict(retina=('boundary_1', 'boundary_2')). Default is None, i.e. only the 'mean' and 'max' projections
+    chunk_size : int, optional
+        The number of B-scans read and projected at a time. Default is TRANSFORM_CHUNK_SIZE
+
+    Returns
+    --------
+    dict
+        The float32 projections of num_b_scans * size_x by name: 'mean' and 'max' of the transformed intensities (see
+        transform_b_scans) of every A-scan and the mean within each slab (the pixels of the layer between its
+        boundaries, see rasterize_layers)
+
+    Notes
+    -----
+    Invalid pixels (stored values above 1) are left out of the projections, and A-scans without any valid pixel (in
+    the slab) are NaN. Only chunk_size B-scans are held in memory at a time besides the projections.
+    """
+    slabs = dict() if slabs is None else slabs
+    for upper, lower in slabs.values():
+        for boundary in (upper, lower):
+            if boundary not in oct_vol.b_scan_header:
+                raise ValueError('{} is not in the B scan header, read the vol file with its segmentation.'.format(boundary))
+
+    size_z, size_x, num_b_scans = oct_vol.b_scans.shape
+    projections = {name: np.empty((num_b_scans, size_x), dtype=np.float32) for name in ['mean', 'max'] + list(slabs)}
+    z = np.arange(size_z).reshape((size_z, 1, 1))
+    for i_first in range(0, num_b_scans, chunk_size):
+        selected = slice(i_first, i_first + chunk_size)
+        stored = np.array(oct_vol.b_scans[:, :, selected])
+        valid = stored <= 1
+        b_scans = transform_b_scans(stored, chunk_size=chunk_size)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n_valid = valid.sum(axis=0)
+            projections['mean'][selected] = (b_scans.sum(axis=0) / n_valid).T
+            projections['max'][selected] = np.where(n_valid > 0, b_scans.max(axis=0), np.nan).T
+            for name, (upper, lower) in slabs.items():
+                first, stop = _layer_ranges([oct_vol.b_scan_header[upper][selected].T,
+                                             oct_vol.b_scan_header[lower][selected].T], size_z)[1]
+                in_slab = valid & (z >= first) & (z < stop)
+                projections[name][selected] = (np.where(in_slab, b_scans, 0).sum(axis=0) / in_slab.sum(axis=0)).T
+
+    return projections
+
+
+def b_scan_positions_on_slo(oct_vol: OCTVol) -> np.ndarray:
+    """
+    Map the start and end of every B-scan onto the SLO image
+
+    Returns
+    --------
+    np.ndarray
+        The positions in SLO pixels as array of num_b_scans * 2 (start, end) * 2 (x, y), i.e. start_x, start_y, end_x
+        and end_y of the B scan header divided by scale_x_slo and scale_y_slo
+    """
+    b_scan_header = oct_vol.b_scan_header
+    positions = np.stack([np.stack([b_scan_header['start_x'], b_scan_header['start_y']], axis=-1),
+                          np.stack([b_scan_header['end_x'], b_scan_header['end_y']], axis=-1)], axis=1)
+    return positions / np.array([oct_vol.header['scale_x_slo'], oct_vol.header['scale_y_slo']])
+
+
+def a_scan_positions_on_slo(oct_vol: OCTVol) -> tuple[np.ndarray, np.ndarray]:
+    """ Return the x and y SLO pixel position of every A-scan, each of num_b_scans * size_x (see fundus_coordinates) """
+    x, y = fundus_coordinates(oct_vol)
+    return x / oct_vol.header['scale_x_slo'], y / oct_vol.header['scale_y_slo']
+
+
+def draw_b_scan_positions(slo: np.ndarray, positions: np.ndarray, value: int = 255) -> np.ndarray:
+    """
+    Draw the B-scan positions as lines onto a copy of the SLO image
+
+    Parameters
+    ----------
+    slo : np.ndarray
+        The SLO image of size_y_slo * size_x_slo
+    positions : np.ndarray
+        The positions of the B-scans in SLO pixels, see b_scan_positions_on_slo. Index it to draw only some B-scans
+    value : int, optional
+        The value of the line pixels. Default is 255
+
+    Returns
+    --------
+    np.ndarray
+        The SLO image with the lines, parts of lines outside of the image are left out
+    """
+    overlay = np.array(slo, copy=True)
+    if len(positions) == 0:
+        return overlay
+
+    # Sample all lines at (at least) one point per pixel at once
+    directions = positions[:, 1] - positions[:, 0]
+    num_samples = int(np.ceil(np.abs(directions).max())) + 1
+    samples = positions[:, np.newaxis, 0] + np.linspace(0, 1, num_samples)[np.newaxis, :, np.newaxis] * directions[:, np.newaxis]
+    pixels = np.rint(samples.reshape((-1, 2))).astype(np.int64)
+    inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < slo.shape[1]) & (pixels[:, 1] >= 0) & (pixels[:, 1] < slo.shape[0])
+    overlay[pixels[inside, 1], pixels[inside, 0]] = value
+    return overlay
+
+
+def en_face_overview(vol_path: str, slabs: dict = None) -> dict:
+    """
+    Compute the en-face projections (see en_face_projections) and the SLO image with the B-scan positions of a vol file,
+    e.g. as thumbnails on ingest
+
+    Returns
+    --------
+    dict
+        The projections by name and 'slo_overlay', the SLO image with the B-scan positions drawn onto it
+
+    Notes
+    -----
+    The vol file is memory-mapped, so only the B-scans are read (one chunk at a time) besides the headers, the
+    segmentation and the SLO image.
+    """
+    oct_vol = OCTVol(vol_path, mmap=True)
+    overview = en_face_projections(oct_vol, slabs=slabs)
+    overview['slo_overlay'] = draw_b_scan_positions(oct_vol.slo, b_scan_positions_on_slo(oct_vol))
+    return overview
@@ -0,0 +1,194 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.save_OCT_and_segmentation_as_numpy import order_segmented_layers
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+
+
+ETDRS_DIAMETERS = (1.0, 3.0, 6.0)  # mm, the central circle and the inner and outer ring
+# The sectors from the central one over the inner to the outer ring, in the order of the sector_N of the thickness grid
+ETDRS_SECTORS = ('central', 'inner_superior', 'inner_nasal', 'inner_inferior', 'inner_temporal',
+                 'outer_superior', 'outer_nasal', 'outer_inferior', 'outer_temporal')
+
+
+def thickness_map(oct_vol: OCTVol, upper: str = 'boundary_1', lower: str = 'boundary_2') -> np.ndarray:
+    """
+    Compute the thickness between two boundaries for every A-scan
+
+    Parameters
+    ----------
+    oct_vol : OCTVol
+        An OCTVol object with the segmentation, e.g. read with load=('header', 'segmentation')
+    upper, lower : str, optional
+        The inner and the outer boundary (see detect_segmented_layers). Default is 'boundary_1' (ILM) and 'boundary_2'
+        (BM), i.e. the total retinal thickness
+
+    Returns
+    --------
+    np.ndarray
+        The thickness in mm as float64 array of num_b_scans * size_x, NaN where either boundary is invalid
+    """
+    invalid = np.finfo(np.float32).max  # this is written as the segmentation if the boundary is missing
+    for boundary in (upper, lower):
+        if boundary not in oct_vol.b_scan_header:
+            raise ValueError('{} is not in the B scan header, read the vol file with its segmentation.'.format(boundary))
+    upper, lower = oct_vol.b_scan_header[upper], oct_vol.b_scan_header[lower]
+
+    thickness = (lower.astype(np.float64) - upper) * oct_vol.header['scale_z']
+    thickness[(upper == invalid) | (lower == invalid)] = np.nan
+    return thickness
+
+
+def layer_thickness_maps(oct_vol: OCTVol) -> dict:
+    """
+    Compute the thickness maps (see thickness_map) of all layers between consecutive segmented boundaries
+
+    Returns
+    --------
+    dict
+        The thickness maps by 'upper_boundary-lower_boundary', from the innermost to the outermost layer, and the total
+        thickness between the innermost and the outermost segmented boundary as 'total'
+    """
+    segmented_boundaries = order_segmented_layers(oct_vol)
+    thickness_maps = {'{}-{}'.format(upper, lower): thickness_map(oct_vol, upper, lower)
+                      for upper, lower in zip(segmented_boundaries[:-1], segmented_boundaries[1:])}
+    if len(segmented_boundaries) > 1:
+        thickness_maps['total'] = thickness_map(oct_vol, segmented_boundaries[0], segmented_boundaries[-1])
+    return thickness_maps
+
+
+def fundus_coordinates(oct_vol: OCTVol) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the position of every A-scan on the fundus, interpolated between the start and end of its B-scan
+
+    Returns
+    --------
+    tuple of np.ndarray
+        The x and y positions in mm (as start_x, start_y, end_x and end_y of the B scan header), each of
+        num_b_scans * size_x
+    """
+    b_scan_header = oct_vol.b_scan_header
+    fraction = np.linspace(0, 1, oct_vol.header['size_x'])
+    x = b_scan_header['start_x'][:, np.newaxis] + np.outer(b_scan_header['end_x'] - b_scan_header['start_x'], fraction)
+    y = b_scan_header['start_y'][:, np.newaxis] + np.outer(b_scan_header['end_y'] - b_scan_header['start_y'], fraction)
+    return x, y
+
+
+def etdrs_sectors(oct_vol: OCTVol, center: tuple[float, float] = None, diameters=ETDRS_DIAMETERS) -> np.ndarray:
+    """
+    Assign every A-scan to its ETDRS sector
+
+    Parameters
+    ----------
+    oct_vol : OCTVol
+        An OCTVol object with the B scan header
+    center : tuple of float, optional
+        The fundus position (x, y) in mm of the center of the sectors. Default is None, i.e. the center_pos of the
+        thickness grid if there is one, otherwise the center of the scanned area
+    diameters : tuple of float, optional
+        The diameters in mm of the central circle and of the inner and the outer ring. Default is ETDRS_DIAMETERS
+
+    Returns
+    --------
+    np.ndarray
+        The index of the sector in ETDRS_SECTORS of every A-scan as int array of num_b_scans * size_x, -1 outside of the
+        outer ring
+
+    Notes
+    -----
+    The fundus y axis points down (inferior) like the rows of the SLO image and the nasal side is on the right of right
+    eyes (scan_position 'OD') and on the left of left eyes.
+    """
+    x, y = fundus_coordinates(oct_vol)
+    if center is None:
+        if oct_vol.thickness_grid:
+            center = oct_vol.thickness_grid['center_pos']
+        else:
+            center = ((x.min() + x.max()) / 2, (y.min() + y.max()) / 2)
+    dx, dy = x - center[0], y - center[1]
+    if oct_vol.header['scan_position'] != 'OD':
+        dx = -dx  # nasal is always +dx from here on
+
+    # The ring (0 central, 1 inner, 2 outer, 3 outside) and the quadrant (0 superior, 1 nasal, 2 inferior, 3 temporal)
+    ring = np.searchsorted(np.asarray(diameters) / 2, np.hypot(dx, dy), side='right')
+    quadrant = np.where(np.abs(dy) >= np.abs(dx), np.where(dy < 0, 0, 2), np.where(dx > 0, 1, 3))
+
+    sectors = np.where(ring == 0, 0, 1 + 4 * (ring - 1) + quadrant)
+    sectors[ring >= len(diameters)] = -1
+    return sectors
+
+
+def sector_statistics(thickness: np.ndarray, sectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Average a thickness map over the ETDRS sectors, ignoring invalid (NaN) A-scans
+
+    Parameters
+    ----------
+    thickness : np.ndarray
+        A thickness map of num_b_scans * size_x, see thickness_map
+    sectors : np.ndarray
+        The sector of every A-scan, see etdrs_sectors
+
+    Returns
+    --------
+    tuple of np.ndarray
+        The mean thickness of each sector of ETDRS_SECTORS (NaN for sectors without valid A-scans) and the number of
+        valid A-scans per sector
+    """
+    valid = (sectors >= 0) & ~np.isnan(thickness)
+    counts = np.bincount(sectors[valid], minlength=len(ETDRS_SECTORS))
+    sums = np.bincount(sectors[valid], weights=thickness[valid], minlength=len(ETDRS_SECTORS))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts, counts
+
+
+def _vol_sector_statistics(vol_file_path: str, upper: str, lower: str) -> tuple[np.ndarray, np.ndarray, str]:
+    """ Read the segmentation of a vol file and return its sector means and counts and the error raised, if any """
+    try:
+        oct_vol = OCTVol(vol_file_path, load=('header', 'segmentation'))
+        means, counts = sector_statistics(thickness_map(oct_vol, upper, lower), etdrs_sectors(oct_vol))
+    except Exception as error:
+        return np.full(len(ETDRS_SECTORS), np.nan), np.zeros(len(ETDRS_SECTORS), dtype=np.int64), repr(error)
+    return means, counts, None
+
+
+def batch_sector_statistics(vol_file_paths: list[str], upper: str = 'boundary_1', lower: str = 'boundary_2',
+                            workers: int = 1) -> dict:
+    """
+    Compute the ETDRS sector means of the thickness between two boundaries for many vol files
+
+    Parameters
+    ----------
+    vol_file_paths : list of str
+        The paths to the vol files
+    upper, lower : str, optional
+        The boundaries, see thickness_map. Default is 'boundary_1' and 'boundary_2'
+    workers : int, optional
+        The number of processes reading vol files in parallel, None for one per CPU. Default is 1
+
+    Returns
+    --------
+    dict
+        'paths', the vol file paths, 'means', the mean thickness in mm of every sector of ETDRS_SECTORS as float64
+        array of n vol files * 9 (NaN where a sector has no valid A-scans or the vol file failed), 'counts', the number
+        of valid A-scans per sector, and 'failed', the paths of the vol files that could not be read mapped to the error
+
+    Notes
+    -----
+    Only the headers and the segmentation are read from the vol files, never the SLO image or the B-scans.
+    """
+    vol_file_paths = list(vol_file_paths)
+    compute = partial(_vol_sector_statistics, upper=upper, lower=lower)
+    if workers == 1 or len(vol_file_paths) <= 1:
+        results = [compute(vol_file_path) for vol_file_path in vol_file_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(compute, vol_file_paths, chunksize=16))
+
+    statistics = dict(paths=vol_file_paths, means=np.empty((len(results), len(ETDRS_SECTORS))),
+                      counts=np.empty((len(results), len(ETDRS_SECTORS)), dtype=np.int64), failed=dict())
+    for i_vol, (means, counts, error) in enumerate(results):
+        statistics['means'][i_vol], statistics['counts'][i_vol] = means, counts
+        if error is not None:
+            statistics['failed'][vol_file_paths[i_vol]] = error
+    return statistics
@@ -1,8 +1,23 @@
 from OCT.formats.OCTVol import OCTVol
+from OCT.formats.io_stats import IOStats, phase
+from OCT.src.chunked_store import ChunkedStoreWriter, DATA_SUFFIX, INDEX_SUFFIX
+from OCT.src.vol_prefetch import prefetch_vols
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, lru_cache
 from glob import glob
 import numpy as np
+import argparse
+import json
+import sys
 import os
-from copy import deepcopy
+
+
+LABEL_MAP_UNLABELED = 255  # label of the pixels which do not belong to any layer in a label map (invalid boundaries)
+CONVERTER_VERSION = 1  # increase whenever the output of convert_vol_file changes, so that existing outputs are redone
+MANIFEST_FILE_NAME = "manifest.json"  # the manifest of the converted vol files, saved next to the .npy files
+MANIFEST_SAVE_INTERVAL = 100  # vol files converted between saves of the manifest during a conversion
+TRANSFORM_CHUNK_SIZE = 8  # B-Scans transformed and rasterized at a time, which bounds the temporary arrays
+QUANTIZED_DTYPES = (np.uint8, np.uint16)  # integer dtypes of the transformed B-Scans, see _quantization_thresholds
 
 
 def detect_segmented_layers(oct_vol: OCTVol) -> list[str]:
@@ -32,8 +47,97 @@ def detect_segmented_layers(oct_vol: OCTVol) -> list[str]:
     return segmented_boundaries
 
 
-def extract_segmentation(oct_vol: OCTVol) -> np.ndarray:
-    """ One-hot encode segmentation layers and return a numpy array of n+1 boundaries * size_z * size_x * num_b_scans """
+def rasterize_layers(boundaries: list[np.ndarray], size_z: int, dtype=np.float64, label_map: bool = False,
+                     out: np.ndarray = None, z_range: tuple[int, int] = None) -> np.ndarray:
+    """
+    Rasterize the layers between segmentation boundaries
+
+    Parameters
+    ----------
+    boundaries : list of np.ndarray
+        The boundaries from the innermost to the outermost, each an array of num_b_scans * size_x as in the
+        b_scan_header of an OCTVol object
+    size_z : int
+        The number of pixels of an A-scan
+    dtype : data-type, optional
+        The dtype of the one-hot encoded layers, e.g. bool or np.uint8 for a compact output. Ignored if label_map is True.
+        Default is np.float64
+    label_map : bool, optional
+        If True, return a single uint8 label map instead of the one-hot encoded layers. Default is False
+    out : np.ndarray, optional
+        An array of the shape of the result the layers are written into (and which is returned), e.g. a slice of a
+        larger array. Its dtype is used instead of dtype. Default is None, i.e. a new array
+    z_range : tuple of int, optional
+        The first and the last (exclusive) pixel of the A-scans to rasterize, only these rows are computed. Default is
+        None, i.e. all size_z pixels
+
+    Returns
+    --------
+    np.ndarray
+        Either the one-hot encoded layers with the shape of (n boundaries + 1) * size_z * size_x * num_b_scans or, if
+        label_map is True, a uint8 label map of size_z * size_x * num_b_scans holding the layer index of each pixel (the
+        outer one where layers overlap) and LABEL_MAP_UNLABELED where no layer is defined. With a z_range, size_z is
+        replaced by the number of pixels in it
+
+    Notes
+    -----
+    Layer 0 spans the A-scan pixels above the first boundary, layer i the pixels from boundary i to boundary i+1 and
+    the last layer the pixels from the last boundary on, with each boundary position rounded up. A layer is left empty
+    in A-scans where any of its boundaries is invalid (the largest float32 number).
+    """
+    # Compute the first and last (exclusive) pixel of each layer for every A-scan, transposed to size_x * num_b_scans
+    layer_ranges = _layer_ranges([np.asarray(boundary).T for boundary in boundaries], size_z)
+    shape = np.shape(layer_ranges[0][1])
+
+    # Compare the pixel index ramp of the A-scans (or of the part in z_range) against the layer ranges
+    z = np.arange(size_z) if z_range is None else np.arange(size_z)[z_range[0]:z_range[1]]
+    z = z.reshape((len(z), 1, 1))
+    if label_map:
+        if out is None:
+            segmented_layers = np.full((len(z),) + shape, LABEL_MAP_UNLABELED, dtype=np.uint8)
+        else:
+            segmented_layers = out
+            segmented_layers.fill(LABEL_MAP_UNLABELED)
+        for i_layer, (first, stop) in enumerate(layer_ranges):
+            np.copyto(segmented_layers, i_layer, where=(z >= first) & (z < stop))
+    else:
+        segmented_layers = np.empty((len(layer_ranges), len(z)) + shape, dtype=dtype) if out is None else out
+        for i_layer, (first, stop) in enumerate(layer_ranges):
+            segmented_layers[i_layer] = (z >= first) & (z < stop)
+
+    return segmented_layers
+
+
+def _layer_ranges(boundaries: list[np.ndarray], size_z: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Return the first and the last (exclusive) pixel of every layer between the boundaries (see rasterize_layers), each
+    an array of the shape of the boundaries
+
+    Notes
+    -----
+    The rounded up boundaries are clipped to the A-scan like a python slice would do, and invalid boundaries result in
+    empty layers.
+    """
+    if len(boundaries) == 0:
+        raise ValueError('At least one boundary is needed to rasterize layers.')
+
+    invalid = np.finfo(np.float32).max  # this is written as the segmentation if the boundary is missing
+    edges = []
+    for boundary in boundaries:
+        boundary = np.asarray(boundary)
+        edge = np.ceil(boundary.astype(np.float64))
+        edge = np.clip(np.where(edge < 0, edge + size_z, edge), 0, size_z)
+        edges.append((edge, boundary != invalid))
+    layer_ranges = [(0, np.where(edges[0][1], edges[0][0], 0))]
+    for (upper_edge, upper_valid), (lower_edge, lower_valid) in zip(edges[:-1], edges[1:]):
+        valid = upper_valid & lower_valid
+        layer_ranges.append((np.where(valid, upper_edge, 0), np.where(valid, lower_edge, 0)))
+    layer_ranges.append((edges[-1][0], np.where(edges[-1][1], size_z, 0)))
+    return layer_ranges
+
+
+def order_segmented_layers(oct_vol: OCTVol) -> list[str]:
+    """ Detect and return the segmented boundaries of an OCT vol file ordered from the innermost to the outermost """
     # First the segmented boundaries have be extracted
     segmented_boundaries = detect_segmented_layers(oct_vol)
 
@@ -42,35 +146,104 @@ def extract_segmentation(oct_vol: OCTVol) -> np.ndarray:
         segmented_boundaries.remove('boundary_2')
         segmented_boundaries.append('boundary_2')
 
+    return segmented_boundaries
+
+
+def extract_segmentation(oct_vol: OCTVol, dtype=np.float64, label_map: bool = False) -> np.ndarray:
+    """
+    One-hot encode segmentation layers and return a numpy array of n+1 boundaries * size_z * size_x * num_b_scans, or a
+    uint8 label map of size_z * size_x * num_b_scans if label_map is True (see rasterize_layers)
+    """
+    segmented_boundaries = order_segmented_layers(oct_vol)
+
     # One-hot encode the layers using the boundaries. If we have n boundaries then we will have a numpy array of n+1
     # layers times size_z * size_x * num_b_scans
-    invalid = np.finfo(np.float32).max  # this is written as the segmentation if the boundary is missing
-    n_layers = len(segmented_boundaries) + 1
-    segmented_layers = np.zeros((n_layers, oct_vol.header['size_z'], oct_vol.header['size_x'], oct_vol.header['num_b_scans']))
-    for i_layer in range(n_layers):
-        for i_b_scan in range(oct_vol.header['num_b_scans']):
-            for i_a_scan in range(oct_vol.header['size_x']):
-                if i_layer == 0:
-                    if oct_vol.b_scan_header[segmented_boundaries[i_layer]][i_b_scan, i_a_scan] != invalid:
-                        segmented_layers[i_layer, :int(np.ceil(oct_vol.b_scan_header[segmented_boundaries[i_layer]][i_b_scan, i_a_scan])), i_a_scan, i_b_scan] = 1
-                elif i_layer == n_layers-1:
-                    if oct_vol.b_scan_header[segmented_boundaries[i_layer-1]][i_b_scan, i_a_scan] != invalid:
-                        segmented_layers[i_layer, int(np.ceil(oct_vol.b_scan_header[segmented_boundaries[i_layer-1]][i_b_scan, i_a_scan])):, i_a_scan, i_b_scan] = 1
-                else:
-                    if oct_vol.b_scan_header[segmented_boundaries[i_layer-1]][i_b_scan, i_a_scan] != invalid and oct_vol.b_scan_header[segmented_boundaries[i_layer]][i_b_scan, i_a_scan] != invalid:
-                        segmented_layers[i_layer, int(np.ceil(oct_vol.b_scan_header[segmented_boundaries[i_layer-1]][i_b_scan, i_a_scan])):int(np.ceil(oct_vol.b_scan_header[segmented_boundaries[i_layer]][i_b_scan, i_a_scan])), i_a_scan, i_b_scan] = 1
+    return rasterize_layers([oct_vol.b_scan_header[boundary] for boundary in segmented_boundaries],
+                            oct_vol.header['size_z'], dtype=dtype, label_map=label_map)
 
-    return segmented_layers
 
+def transform_b_scans(b_scans: np.ndarray, dtype=None, out: np.ndarray = None,
+                      chunk_size: int = TRANSFORM_CHUNK_SIZE) -> np.ndarray:
+    """
+    Return the B-Scans with the invalid numbers replaced by 0 (black) and the intensity transform of HE applied
 
-def combine_oct_and_segmentation_as_numpy(oct_vol: OCTVol) -> np.ndarray:
+    Parameters
+    ----------
+    b_scans : np.ndarray
+        The B-Scans as stored in a vol file, e.g. the b_scans of an OCTVol object (also memory-mapped), with the B-Scans
+        along the last axis
+    dtype : data-type, optional
+        The dtype of the result. Float dtypes (e.g. np.float16 for a compact output) hold the transformed intensities
+        from 0 to 1, unsigned integer dtypes (np.uint8 or np.uint16) the intensities quantized to 0 to their maximum.
+        Default is None, i.e. the float dtype of b_scans
+    out : np.ndarray, optional
+        An array of the shape of b_scans the result is written into (and which is returned), e.g. a slice of a larger
+        array. Its dtype is used instead of dtype. Default is None, i.e. a new array
+    chunk_size : int, optional
+        The number of B-Scans transformed at a time. Default is TRANSFORM_CHUNK_SIZE
+
+    Returns
+    --------
+    np.ndarray
+        The transformed B-Scans
+
+    Notes
+    -----
+    b_scans is not modified and only the B-Scans of one chunk are copied at a time, so the memory needed besides the
+    result does not grow with the number of B-Scans. The quantization does not compute the 4th root at all: a stored
+    value v is mapped to the number of thresholds ((k - 0.5) / max) ** 4, k = 1 ... max, that are not above v, which is
+    round(v ** 0.25 * max) (see _quantization_thresholds).
+    """
+    if out is None:
+        out = np.empty(b_scans.shape, dtype=np.result_type(b_scans.dtype, np.float32) if dtype is None else dtype)
+    if out.shape != b_scans.shape:
+        raise ValueError('out has the shape {} instead of the shape {} of the B-Scans.'.format(out.shape, b_scans.shape))
+    if out.dtype not in QUANTIZED_DTYPES and not np.issubdtype(out.dtype, np.floating):
+        raise ValueError('Unsupported dtype {} of the transformed B-Scans, use a float dtype, np.uint8 or np.uint16.'.format(out.dtype))
+    thresholds = _quantization_thresholds(out.dtype) if out.dtype in QUANTIZED_DTYPES else None
+
+    for i_first in range(0, b_scans.shape[-1], chunk_size):
+        chunk = b_scans[..., i_first:i_first + chunk_size].astype(np.result_type(b_scans.dtype, np.float32))
+
+        # Get rid of invalid numbers by replacing them with 0 (black)
+        chunk[chunk > 1] = 0
+
+        # Transfer the image with the formula provided by HE (pixel intensity is the 4th root of the stored values)
+        if thresholds is None:
+            out[..., i_first:i_first + chunk_size] = np.power(chunk, 0.25, out=chunk)
+        else:
+            out[..., i_first:i_first + chunk_size] = np.searchsorted(thresholds, chunk, side='right')
+
+    return out
+
+
+@lru_cache(maxsize=None)
+def _quantization_thresholds(dtype) -> np.ndarray:
+    """
+    Return the stored values from which on the transformed intensity is quantized to 1, 2, ... of an integer dtype of
+    QUANTIZED_DTYPES (there is one threshold per value of the dtype)
+    """
+    maximum = np.iinfo(dtype).max
+    return ((np.arange(1, maximum + 1) - 0.5) / maximum) ** 4
+
+
+def combine_oct_and_segmentation_as_numpy(oct_vol: OCTVol, dtype=np.float64, chunk_size: int = TRANSFORM_CHUNK_SIZE,
+                                          stats: IOStats = None) -> np.ndarray:
     """
     Combine the OCT B-Scans and segmentation of an OCTVol object
 
     Parameters
     ----------
     oct_vol : OCTVol
-        An OCTVol object containing an OCT volumetric scan and its information
+        An OCTVol object containing an OCT volumetric scan and its information, also memory-mapped
+    dtype : data-type, optional
+        The dtype of the result, e.g. np.float16 or np.uint8 for a smaller output. With an unsigned integer dtype the
+        OCT image is quantized (see transform_b_scans) and the layers are 0 or 1. Default is np.float64
+    chunk_size : int, optional
+        The number of B-Scans transformed and rasterized at a time. Default is TRANSFORM_CHUNK_SIZE
+    stats : IOStats, optional
+        If given, the time of the phases 'allocate' (the result), 'read_b_scans' (copying the B-Scans out of the memory
+        map, see _read_b_scans), 'transform' and 'rasterize' and the bytes read are recorded into it. Default is None
 
     Returns
     --------
@@ -79,25 +252,209 @@ def combine_oct_and_segmentation_as_numpy(oct_vol: OCTVol) -> np.ndarray:
         of the array consists of the OCT volumetric image with the rest consisting of the segmented layers from the
         innermost to the outermost
 
+    Notes
+    -----
+    The result is allocated once and filled chunk by chunk, so the memory needed is close to the size of the result
+    (plus the B-Scans if oct_vol is not memory-mapped).
     """
-    # Get rid of invalid numbers by replacing them with 0 (black)
-    b_scans = deepcopy(oct_vol.b_scans)
-    b_scans[b_scans > 1] = 0
+    segmented_boundaries = order_segmented_layers(oct_vol)
+    if len(segmented_boundaries) == 0:
+        raise ValueError('At least one boundary is needed to rasterize layers.')
+    boundaries = [oct_vol.b_scan_header[boundary] for boundary in segmented_boundaries]
 
-    # Transfer the image with the formula provided by HE (pixel intensity is the 4th root of the stored values)
-    b_scans = b_scans ** 0.25
+    # The OCT image followed by the one-hot encoded layers, see rasterize_layers
+    with phase(stats, 'allocate'):
+        combined_b_scans_seg = np.empty((len(boundaries) + 2,) + oct_vol.b_scans.shape, dtype=dtype)
 
-    # Extract the segmentation
-    segmented_layers = extract_segmentation(oct_vol)
+    # Get rid of invalid numbers and transfer the image with the formula provided by HE
+    for i_first in range(0, oct_vol.header['num_b_scans'], chunk_size):
+        b_scans = _read_b_scans(oct_vol, slice(i_first, i_first + chunk_size), stats)
+        with phase(stats, 'transform'):
+            transform_b_scans(b_scans, out=combined_b_scans_seg[0, ..., i_first:i_first + chunk_size], chunk_size=chunk_size)
 
-    # combine with segmentation
-    b_scans = b_scans[np.newaxis, ...]
-    combined_b_scans_seg = np.concatenate((b_scans, segmented_layers), axis=0)
+    # Extract the segmentation
+    with phase(stats, 'rasterize'):
+        for i_first in range(0, oct_vol.header['num_b_scans'], chunk_size):
+            rasterize_layers([boundary[i_first:i_first + chunk_size] for boundary in boundaries], oct_vol.header['size_z'],
+                             out=combined_b_scans_seg[1:, ..., i_first:i_first + chunk_size])
 
     return combined_b_scans_seg
 
 
-def save_oct_and_segmentation_as_numpy(data_dir: str) -> None:
+def _read_b_scans(oct_vol: OCTVol, selected: slice, stats: IOStats = None) -> np.ndarray:
+    """
+    Return some B-Scans of oct_vol. With stats and a memory-mapped oct_vol they are copied out of the memory map in the
+    phase 'read_b_scans' and counted as one read, so that reading them from the disk is not recorded as 'transform'
+    """
+    b_scans = oct_vol.b_scans[:, :, selected]
+    if stats is not None and oct_vol.mmap:
+        with phase(stats, 'read_b_scans'):
+            b_scans = np.array(b_scans)
+        stats.reads += 1
+        stats.bytes_read += b_scans.nbytes
+    return b_scans
+
+
+def save_oct_and_segmentation_as_chunks(oct_vol: OCTVol, store_path: str, chunk_size: int = 1,
+                                        compression: str = 'zlib', stats: IOStats = None) -> None:
+    """
+    Save the OCT B-Scans and segmentation of an OCTVol object as a chunked store for random access to single B-Scans
+
+    Parameters
+    ----------
+    oct_vol : OCTVol
+        An OCTVol object containing an OCT volumetric scan and its information
+    store_path : str
+        The path of the store without suffix, see ChunkedStoreWriter
+    chunk_size : int, optional
+        The number of B-Scans per chunk. Default is 1
+    compression : str, optional
+        The compression of the chunks, 'zlib', 'lzma' or 'none'. Default is 'zlib'
+    stats : IOStats, optional
+        If given, the time of the phases 'read_b_scans' (see _read_b_scans), 'transform', 'rasterize' and 'save'
+        (compressing and writing the chunks) and the bytes read and written are recorded into it. Default is None
+
+    Notes
+    -----
+    The store has two channels with the B-Scans along the first axis: 'image', the transformed B-Scans as float16
+    arrays of size_z * size_x, and 'labels', the uint8 label maps of the segmented layers (see rasterize_layers). The
+    ordered boundaries the labels refer to are stored in the 'boundaries' attribute.
+    """
+    segmented_boundaries = order_segmented_layers(oct_vol)
+    boundaries = [oct_vol.b_scan_header[boundary] for boundary in segmented_boundaries]
+    attributes = dict(vol_path=oct_vol.vol_path, boundaries=segmented_boundaries,
+                      label_map_unlabeled=LABEL_MAP_UNLABELED)
+
+    with ChunkedStoreWriter(store_path, chunk_size=chunk_size, compression=compression, attributes=attributes) as writer:
+        for i_first in range(0, oct_vol.header['num_b_scans'], chunk_size):
+            b_scans = _read_b_scans(oct_vol, slice(i_first, i_first + chunk_size), stats)
+            with phase(stats, 'transform'):
+                b_scans = transform_b_scans(b_scans, dtype=np.float16)
+            with phase(stats, 'rasterize'):
+                labels = rasterize_layers([boundary[i_first:i_first + chunk_size] for boundary in boundaries],
+                                          oct_vol.header['size_z'], label_map=True)
+            with phase(stats, 'save'):
+                writer.add_chunk(image=b_scans.transpose((2, 0, 1)), labels=labels.transpose((2, 0, 1)))
+    if stats is not None:
+        stats.writes += sum(len(channel['chunks']) for channel in writer.index['channels'].values()) + 1
+        stats.bytes_written += os.path.getsize(store_path + DATA_SUFFIX) + os.path.getsize(store_path + INDEX_SUFFIX)
+
+
+def convert_vol_file(vol_file_path: str, save_dir: str, output_format: str = 'npy', chunk_size: int = 1,
+                     compression: str = 'zlib', dtype=np.float64, oct_vol: OCTVol = None,
+                     stats: IOStats = None) -> tuple[str, str]:
+    """
+    Read an OCT vol file and save the OCT and the segmentation as a numpy array in save_dir
+
+    Parameters
+    ----------
+    vol_file_path : str
+        The path to the vol file
+    save_dir : str
+        The path to the folder the .npy file is saved in
+    output_format : str, optional
+        'npy' to save a .npy file (see combine_oct_and_segmentation_as_numpy) or 'chunked' to save a chunked store (see
+        save_oct_and_segmentation_as_chunks). Default is 'npy'
+    chunk_size : int, optional
+        The number of B-Scans per chunk of a chunked store. Default is 1
+    compression : str, optional
+        The compression of a chunked store. Default is 'zlib'
+    dtype : data-type, optional
+        The dtype of the .npy file, see combine_oct_and_segmentation_as_numpy. Default is np.float64
+    oct_vol : OCTVol, optional
+        The already read vol file, e.g. by prefetch_vols. Default is None, i.e. the vol file is read here
+    stats : IOStats, optional
+        If given, the time of the phases of reading (see OCTVol), converting and saving ('save') the vol file and the
+        I/O are recorded into it. Default is None
+
+    Returns
+    --------
+    tuple of str
+        The path to the vol file and the error raised while processing it, None if it was processed successfully
+
+    """
+    try:
+        # Map the vol file, the B-Scans are only read chunk by chunk while they are transformed
+        if oct_vol is None:
+            oct_vol = OCTVol(vol_file_path, mmap=True, stats=stats)
+
+        if output_format == 'chunked':
+            save_oct_and_segmentation_as_chunks(oct_vol, _output_path(vol_file_path, save_dir, output_format),
+                                                chunk_size=chunk_size, compression=compression, stats=stats)
+        else:
+            # Combine OCT and the segmentation as numpy
+            combined_b_scans_seg = combine_oct_and_segmentation_as_numpy(oct_vol, dtype=dtype, stats=stats)
+
+            # Save the numpy stack
+            with phase(stats, 'save'):
+                np.save(_output_path(vol_file_path, save_dir, output_format), combined_b_scans_seg)
+            if stats is not None:
+                stats.writes += 1
+                stats.bytes_written += os.path.getsize(_output_path(vol_file_path, save_dir, output_format))
+
+    except Exception as error:
+        return vol_file_path, repr(error)
+
+    return vol_file_path, None
+
+
+def _output_path(vol_file_path: str, save_dir: str, output_format: str = 'npy') -> str:
+    """ Return the path of the .npy file (or of the chunked store, without suffix) a vol file is saved as """
+    if output_format == 'chunked':
+        return os.path.join(save_dir, os.path.basename(vol_file_path).replace(".vol", ""))
+    return os.path.join(save_dir, os.path.basename(vol_file_path).replace(".vol", ".npy"))
+
+
+def manifest_entry(vol_stat: os.stat_result, output_format: str = 'npy', dtype=np.float64) -> dict:
+    """
+    Return the manifest entry of a vol file from its os.stat result taken before it was converted, i.e. its size and
+    mtime, the converter version, the output format and the dtype of the .npy file
+    """
+    return dict(size=vol_stat.st_size, mtime_ns=vol_stat.st_mtime_ns, converter_version=CONVERTER_VERSION,
+                output_format=output_format, dtype=np.dtype(dtype).name)
+
+
+def load_manifest(save_dir: str) -> dict:
+    """ Load the manifest of the vol files converted into save_dir, mapping the vol file names to their entries """
+    manifest_path = os.path.join(save_dir, MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_path):
+        return dict()
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(manifest: dict, save_dir: str) -> None:
+    """ Save the manifest into save_dir, replacing the previous one only once it is completely written """
+    manifest_path = os.path.join(save_dir, MANIFEST_FILE_NAME)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def is_up_to_date(vol_file_path: str, entry: dict, save_dir: str, output_format: str = 'npy', dtype=np.float64) -> bool:
+    """
+    Check whether the .npy file of a vol file is up-to-date according to its manifest entry
+
+    Notes
+    -----
+    The output (of the given format and, for .npy files, dtype) is up-to-date if it exists, was written by the current
+    converter version and the vol file still has the recorded size and mtime. Any other change of the vol file, e.g.
+    patching its segmentation with OCTVol.patch_vol or copying it without its mtime, makes the output stale.
+    """
+    output_path = _output_path(vol_file_path, save_dir, output_format)
+    if entry is None or entry.get('converter_version') != CONVERTER_VERSION or \
+            entry.get('output_format', 'npy') != output_format or \
+            (output_format == 'npy' and entry.get('dtype', 'float64') != np.dtype(dtype).name) or \
+            not os.path.isfile(output_path + INDEX_SUFFIX if output_format == 'chunked' else output_path):
+        return False
+
+    stat = os.stat(vol_file_path)
+    return stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']
+
+
+def save_oct_and_segmentation_as_numpy(data_dir: str, workers: int = 1, verbose: bool = True, force: bool = False,
+                                       output_format: str = 'npy', chunk_size: int = 1, compression: str = 'zlib',
+                                       dtype=np.float64, prefetch: int = 0, stats: IOStats = None) -> dict:
     """
     Read OCT vol files and save the OCT and the segmentation as numpy arrays
 
@@ -105,38 +462,178 @@ def save_oct_and_segmentation_as_numpy(data_dir: str) -> None:
     ----------
     data_dir : str
         The path to the data directory consisting vol files
+    workers : int, optional
+        The number of processes converting the vol files in parallel, None for one per CPU. Only the file paths are
+        sent to the worker processes, which read the vol files and write the .npy files themselves. Default is 1, i.e.
+        the files are converted one after another in this process
+    verbose : bool, optional
+        If True, print the summary of the conversion at the end. Default is True
+    force : bool, optional
+        If True, convert all vol files even if their .npy files are up-to-date according to the manifest. Default is
+        False
+    output_format : str, optional
+        'npy' to save one .npy file per vol file or 'chunked' to save a chunked store per vol file, see
+        convert_vol_file. Default is 'npy'
+    chunk_size : int, optional
+        The number of B-Scans per chunk of a chunked store. Default is 1
+    compression : str, optional
+        The compression of a chunked store, 'zlib', 'lzma' or 'none'. Default is 'zlib'
+    dtype : data-type, optional
+        The dtype of the .npy files, e.g. np.float16 or np.uint8 for smaller files, see
+        combine_oct_and_segmentation_as_numpy. Default is np.float64
+    prefetch : int, optional
+        The number of threads reading the next vol files (see prefetch_vols) while one is converted, e.g. for vol files
+        on network storage. Only used if the vol files are converted in this process (workers=1). Default is 0, i.e.
+        every vol file is read when it is converted
+    stats : IOStats, optional
+        If given, the stats of converting every vol file (see convert_vol_file) are recorded, also in the worker
+        processes, and added up into it. The reading of prefetched vol files is not recorded. Default is None
+
+    Returns
+    --------
+    dict
+        Summary of the conversion with 'save_dir', the list of 'saved' vol file paths, the list of 'skipped' vol file
+        paths that were already up-to-date and the 'failed' vol file paths mapped to the error raised while processing
+        them. With stats, also 'file_stats', the stats of each converted vol file as dict (see IOStats.as_dict)
+
+    Notes
+    -----
+    The converted vol files are recorded in a manifest (MANIFEST_FILE_NAME) in the numpy_arrays folder, see
+    is_up_to_date for when a vol file is skipped. The manifest is saved every MANIFEST_SAVE_INTERVAL vol files and when
+    the conversion ends, also if it is interrupted. A vol file whose worker process died fails, like other errors.
 
     """
     # Find .vol files in the directory
-    vol_files_list = glob(os.path.join(data_dir, "*.vol"))
+    vol_files_list = sorted(glob(os.path.join(data_dir, "*.vol")))
 
     # Create a new folder to save numpy arrays
     save_dir = os.path.join(data_dir, "numpy_arrays")
     if not os.path.isdir(save_dir):
         os.mkdir(save_dir)
 
-    # Go through each volume and save the BScans of each volumes as a .npy file
+    # Skip the volumes whose .npy files are up-to-date. Entries of vol files that are gone are dropped
+    old_manifest = load_manifest(save_dir)
+    manifest = dict()
+    summary = dict(save_dir=save_dir, saved=[], skipped=[], failed=dict())
+    if stats is not None:
+        summary['file_stats'] = dict()
+    pending_files_list, vol_stats = [], dict()
     for vol_file_path in vol_files_list:
+        entry = old_manifest.get(os.path.basename(vol_file_path))
+        if not force and is_up_to_date(vol_file_path, entry, save_dir, output_format, dtype):
+            manifest[os.path.basename(vol_file_path)] = entry
+            summary['skipped'].append(vol_file_path)
+        else:
+            # Taken before converting, so that a vol file changed during its conversion is converted again next time
+            vol_stats[vol_file_path] = os.stat(vol_file_path)
+            pending_files_list.append(vol_file_path)
+
+    # Go through each volume and save the BScans of each volumes as a .npy file, either here or in a pool of processes
+    convert = partial(_convert_recording_stats, convert=partial(
+        convert_vol_file, save_dir=save_dir, output_format=output_format, chunk_size=chunk_size, compression=compression,
+        dtype=dtype), trace_memory=None if stats is None else stats.trace_memory)
+
+    # Gather the results and record the converted volumes in the manifest, which is saved every MANIFEST_SAVE_INTERVAL
+    # vol files and also if the conversion is interrupted, so that a rerun does not redo the ones converted so far
+    try:
+        results = _conversion_results(convert, pending_files_list, workers, prefetch)
+        for i_result, (vol_file_path, error, file_stats) in enumerate(results, start=1):
+            if file_stats is not None:
+                stats.merge(file_stats)
+                summary['file_stats'][vol_file_path] = file_stats.as_dict()
+            if error is None:
+                manifest[os.path.basename(vol_file_path)] = manifest_entry(vol_stats[vol_file_path], output_format, dtype)
+                summary['saved'].append(vol_file_path)
+            else:
+                summary['failed'][vol_file_path] = error
+            if i_result % MANIFEST_SAVE_INTERVAL == 0:
+                save_manifest(manifest, save_dir)
+    finally:
+        save_manifest(manifest, save_dir)
+
+    if verbose:
+        print_conversion_summary(summary)
+        if stats is not None:
+            print(stats.report())
+
+    return summary
+
+
+def _conversion_results(convert, vol_file_paths: list[str], workers: int = 1, prefetch: int = 0):
+    """
+    Convert vol files with convert (see _convert_recording_stats), here or in a pool of worker processes, and yield
+    the results in the order of vol_file_paths as soon as they are available
+    """
+    if (workers == 1 or len(vol_file_paths) <= 1) and prefetch > 0:
+        for vol_file_path, oct_vol, error in prefetch_vols(vol_file_paths, workers=prefetch):
+            yield (vol_file_path, error, None) if error is not None else convert(vol_file_path, oct_vol=oct_vol)
+    elif workers == 1 or len(vol_file_paths) <= 1:
+        for vol_file_path in vol_file_paths:
+            yield convert(vol_file_path)
+    else:
+        # The vol files not started yet are cancelled if the conversion is interrupted, e.g. by Ctrl+C
+        executor = ProcessPoolExecutor(max_workers=workers)
         try:
-            # Read the vol file
-            oct_vol = OCTVol(vol_file_path)
+            futures = [executor.submit(convert, vol_file_path) for vol_file_path in vol_file_paths]
+            for vol_file_path, future in zip(vol_file_paths, futures):
+                try:
+                    yield future.result()
+                except Exception as error:  # e.g. BrokenProcessPool if a worker process died
+                    yield vol_file_path, repr(error), None
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
-            # Combine OCT and the segmentation as numpy
-            combined_b_scans_seg = combine_oct_and_segmentation_as_numpy(oct_vol)
 
-            # Save the numpy stack
-            np.save(os.path.join(save_dir, os.path.basename(vol_file_path).replace(".vol", ".npy")), combined_b_scans_seg)
+def _convert_recording_stats(vol_file_path: str, convert, trace_memory: bool = None,
+                             oct_vol: OCTVol = None) -> tuple[str, str, IOStats]:
+    """ Convert a vol file with convert and return its result and the stats recorded, None if trace_memory is None """
+    file_stats = None if trace_memory is None else IOStats(trace_memory=trace_memory)
+    return convert(vol_file_path, oct_vol=oct_vol, stats=file_stats) + (file_stats,)
 
-        except Exception as error:
-            print(vol_file_path + " was NOT processed. This error was raised: {}".format(repr(error)))
-            continue
 
-        # Print info
-        print("The BScans and segmentation of {} were saved as numpy in {} folder".format(vol_file_path, save_dir))
+def print_conversion_summary(summary: dict) -> None:
+    """ Print the summary returned by save_oct_and_segmentation_as_numpy """
+    for vol_file_path, error in summary['failed'].items():
+        print(vol_file_path + " was NOT processed. This error was raised: {}".format(error))
+    print("The BScans and segmentation of {} of {} vol files were saved as numpy in {} folder ({} were up-to-date)".format(
+        len(summary['saved']), len(summary['saved']) + len(summary['failed']), summary['save_dir'],
+        len(summary.get('skipped', []))))
 
 
 save_vol_and_segmentation_as_numpy = save_oct_and_segmentation_as_numpy # This is to maintain the compatibility with the previous version of this code
 
 
+def main(argv: list[str] = None) -> int:
+    """ Command line entry point of save_oct_and_segmentation_as_numpy, returns 1 if any vol file failed """
+    parser = argparse.ArgumentParser(description="Save the OCT and the segmentation of the vol files in a directory as "
+                                                 "numpy arrays in its numpy_arrays folder")
+    parser.add_argument("data_dir", help="The path to the data directory consisting vol files")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="The number of processes converting vol files in parallel, 0 for one per CPU (default: 1)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Convert all vol files, even the ones that are up-to-date according to the manifest")
+    parser.add_argument("--format", dest="output_format", choices=("npy", "chunked"), default="npy",
+                        help="Save a .npy file or a chunked store per vol file (default: npy)")
+    parser.add_argument("--chunk-size", type=int, default=1, help="B-Scans per chunk of a chunked store (default: 1)")
+    parser.add_argument("--compression", choices=("zlib", "lzma", "none"), default="zlib",
+                        help="Compression of a chunked store (default: zlib)")
+    parser.add_argument("--dtype", choices=("float64", "float32", "float16", "uint16", "uint8"), default="float64",
+                        help="dtype of the .npy files, the OCT image is quantized for uint16 and uint8 (default: float64)")
+    parser.add_argument("--stats", action="store_true",
+                        help="Record and print the time of each phase of the conversion and the I/O")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="With --stats, also trace the peak memory allocated in each phase (slower)")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="Threads reading the next vol files ahead, e.g. for network storage, with --workers 1 (default: 0)")
+    args = parser.parse_args(argv)
+
+    summary = save_oct_and_segmentation_as_numpy(args.data_dir, workers=args.workers or None, force=args.force,
+                                                 output_format=args.output_format, chunk_size=args.chunk_size,
+                                                 compression=args.compression, dtype=args.dtype,
+                                                 prefetch=args.prefetch,
+                                                 stats=IOStats(trace_memory=args.trace_memory) if args.stats else None)
+    return 1 if summary['failed'] else 0
+
+
 if __name__ == '__main__':
-    save_oct_and_segmentation_as_numpy(r"C:\Users\Amir\Downloads")
+    sys.exit(main())
@@ -0,0 +1,121 @@
+from OCT.formats.OCTVol import OCTVol
+import numpy as np
+
+
+# The boundaries segmented by HE from the innermost to the outermost (see detect_segmented_layers) and their relative
+# depth within the retina, 0 at the ILM and 1 at the BM
+SEGMENTED_BOUNDARIES = dict(boundary_1=0.0, boundary_3=0.1, boundary_4=0.22, boundary_5=0.33, boundary_6=0.45,
+                            boundary_7=0.55, boundary_9=0.75, boundary_15=0.8, boundary_16=0.87, boundary_17=0.93,
+                            boundary_2=1.0)
+INVALID_PATTERNS = ('none', 'random', 'edges')
+
+
+def make_synthetic_vol(vol_path: str, size_x: int = 512, size_z: int = 496, num_b_scans: int = 25,
+                       size_x_slo: int = 768, size_y_slo: int = 768, num_seg: int = 17,
+                       segmented_boundaries: list[str] = None, invalid_pattern: str = 'edges',
+                       invalid_fraction: float = 0.05, thickness_grid: bool = True, seed: int = 0) -> str:
+    """
+    Write a synthetic vol file with the layout of HE vol files, e.g. for tests and benchmarks
+
+    Parameters
+    ----------
+    vol_path : str
+        The path where the vol file is written to
+    size_x, size_z, num_b_scans : int, optional
+        The number of A-scans per B-scan, pixels per A-scan and B-scans. Default is 512, 496 and 25
+    size_x_slo, size_y_slo : int, optional
+        The size of the SLO image. Default is 768 * 768
+    num_seg : int, optional
+        The number of boundaries stored per B-scan. Default is 17
+    segmented_boundaries : list of str, optional
+        The boundaries with segmentation data, the others are invalid everywhere. Default is None, i.e. the ones of
+        SEGMENTED_BOUNDARIES up to num_seg
+    invalid_pattern : str, optional
+        Where the segmented boundaries are invalid (the largest float32 number), one of INVALID_PATTERNS: 'none',
+        'random' (randomly chosen A-scans) or 'edges' (the A-scans at both ends of the B-scans). Default is 'edges'
+    invalid_fraction : float, optional
+        The fraction of invalid A-scans for the 'random' and 'edges' patterns. Default is 0.05
+    thickness_grid : bool, optional
+        If True, a thickness grid is written. Default is True
+    seed : int, optional
+        The seed of the random numbers, the same arguments give the same file. Default is 0
+
+    Returns
+    -------
+    str
+        The path of the written vol file
+
+    Notes
+    -----
+    The B-scans are generated (and written) one at a time, so large volumes do not have to fit into memory. The B-scans
+    are noise with the stored intensities of HE, i.e. 4th powers, brighter between the ILM and the BM.
+    """
+    if invalid_pattern not in INVALID_PATTERNS:
+        raise ValueError('Unknown invalid_pattern {}. Valid patterns are {}.'.format(invalid_pattern, INVALID_PATTERNS))
+    if segmented_boundaries is None:
+        segmented_boundaries = [boundary for boundary in SEGMENTED_BOUNDARIES if int(boundary.split('_')[1]) <= num_seg]
+    rng = np.random.default_rng(seed)
+    invalid = np.finfo(np.float32).max
+
+    # The B-scan headers have room for the segmentation, rounded up to multiples of 4096 bytes
+    b_scan_hdr_size = int(np.ceil((OCTVol.B_SCAN_HEADER_DTYPE.itemsize + num_seg * size_x * 4) / 4096) * 4096)
+    records_end = OCTVol.HEADER_DTYPE.itemsize + size_x_slo * size_y_slo + num_b_scans * (b_scan_hdr_size + size_x * size_z * 4)
+    header = dict(version='HSF-OCT-103', size_x=size_x, num_b_scans=num_b_scans, size_z=size_z, scale_x=0.0114,
+                  distance=0.12, scale_z=0.0039, size_x_slo=size_x_slo, size_y_slo=size_y_slo, scale_x_slo=0.0114,
+                  scale_y_slo=0.0114, field_size_slo=30, scan_focus=-0.5, scan_position='OD',
+                  unconverted_exam_time=np.uint64(132500000000000000), scan_pattern=3, b_scan_hdr_size=b_scan_hdr_size,
+                  id='SYNTH{:011d}'.format(seed), reference_id='', pid=seed, patient_id='SYNTHETIC',
+                  padding=np.zeros(3, dtype='int8'), unconverted_dob=30000.0, vid=seed, visit_id='SYNTHETIC',
+                  unconverted_visit_date=44000.0, grid_type=1 if thickness_grid else 0,
+                  grid_offset=records_end if thickness_grid else 0, spare=np.zeros(1832, dtype='int8'))
+
+    slo = rng.integers(0, 256, (size_y_slo, size_x_slo), dtype='uint8')
+
+    # Raster scan over the fundus, from the top to the bottom
+    y = np.arange(num_b_scans) * header['distance']
+    b_scan_header = dict(version=np.repeat(np.array(list('HSF-BS-103') + ['', ''], dtype='U1')[:, np.newaxis], num_b_scans, axis=1),
+                         b_scan_hdr_size=np.full(num_b_scans, b_scan_hdr_size, dtype='int32'),
+                         start_x=np.zeros(num_b_scans), start_y=y, end_x=np.full(num_b_scans, size_x * header['scale_x']),
+                         end_y=y, num_seg=np.full(num_b_scans, num_seg, dtype='int32'),
+                         off_seg=np.full(num_b_scans, OCTVol.B_SCAN_HEADER_DTYPE.itemsize, dtype='int32'),
+                         quality=rng.uniform(20, 40, num_b_scans).astype('float32'),
+                         shift=np.zeros(num_b_scans, dtype='int32'), spare=np.zeros((192, num_b_scans), dtype='int8'))
+
+    # The retina is a smooth band with a foveal pit in the middle of the volume
+    a_scans, b_scans_pos = np.meshgrid(np.linspace(-1, 1, size_x), np.linspace(-1, 1, num_b_scans))
+    pit = np.exp(-(a_scans ** 2 + b_scans_pos ** 2) / 0.05)
+    ilm = size_z * (0.25 + 0.08 * pit + 0.02 * rng.standard_normal((num_b_scans, size_x)).cumsum(axis=1) / np.sqrt(size_x))
+    bm = size_z * (0.65 + 0.02 * a_scans)
+    for i_boundary in range(num_seg):
+        boundary = 'boundary_{}'.format(i_boundary + 1)
+        if boundary in segmented_boundaries:
+            depth = SEGMENTED_BOUNDARIES.get(boundary, 0.5)
+            b_scan_header[boundary] = (ilm + depth * (1 - pit * (depth < 0.7)) * (bm - ilm)).astype('float32')
+            if invalid_pattern == 'random':
+                b_scan_header[boundary][rng.random((num_b_scans, size_x)) < invalid_fraction] = invalid
+            elif invalid_pattern == 'edges':
+                n_edge = int(round(size_x * invalid_fraction / 2))
+                b_scan_header[boundary][:, :n_edge] = invalid
+                b_scan_header[boundary][:, size_x - n_edge:] = invalid
+        else:
+            b_scan_header[boundary] = np.full((num_b_scans, size_x), invalid, dtype='float32')
+
+    grid = dict()
+    if thickness_grid:
+        grid = dict(type=1, diameter=np.array([1.0, 3.0, 6.0]), center_pos=np.array([size_x * header['scale_x'] / 2, y[-1] / 2]),
+                    central_thk=np.float32(0.27), min_central_thk=np.float32(0.22), max_central_thk=np.float32(0.31),
+                    total_volume=np.float32(8.6))
+        for i_sector in range(9):
+            grid['sector_{}'.format(i_sector + 1)] = dict(thickness=np.float32(0.27 + 0.01 * i_sector),
+                                                          volume=np.float32(0.2 + 0.1 * i_sector))
+
+    def b_scans():
+        z = np.arange(size_z).reshape((size_z, 1))
+        for i_b_scan in range(num_b_scans):
+            retina = (z >= ilm[i_b_scan]) & (z < bm[i_b_scan])
+            b_scan = (rng.random((size_z, size_x), dtype='float32') * (0.15 + 0.35 * retina)) ** 4
+            yield b_scan
+
+    vol_path = vol_path if '.vol' in vol_path else vol_path + '.vol'
+    OCTVol.write_vol_stream(vol_path, header, slo, b_scan_header, b_scans(), grid)
+    return vol_path
@@ -0,0 +1,214 @@
+from OCT.formats.OCTVol import OCTVol
+import numpy as np
+import datetime
+import sqlite3
+import os
+
+
+CATALOG_COMMIT_INTERVAL = 100  # vol files read between commits of the catalog during an update
+
+class VolCatalog:
+    """
+    The VolCatalog object is a searchable SQLite index over the metadata of the vol files in a directory tree
+
+    Parameters
+    ----------
+    db_path : str
+        Path to the SQLite database file of the catalog, created if it does not exist
+
+    Attributes
+    ----------
+    db_path : str
+        The path to the SQLite database file
+    connection : sqlite3.Connection
+        The connection to the database
+
+    Class Attributes
+    ----------------
+    COLUMNS : dict
+        The columns of the catalog and their SQLite types. Besides the path and the file size and mtime, these are the
+        header fields, a summary of the thickness grid (NULL without grid) and statistics of the B scan quality
+
+    Notes
+    -----
+    Only the header, the thickness grid and the B scan header fields of a vol file are read to catalog it, i.e. neither
+    the SLO image, the segmentation nor the B scans. Files which cannot be read are kept in the catalog with the error
+    (and are left out of the queries) so that they are not read again until they change.
+
+    Examples
+    --------
+    >>> catalog = VolCatalog("/path/to/catalog.sqlite")
+    >>> catalog.update("/path/to/vol/archive")
+    >>> catalog.query(patient_id="X", scan_pattern=3, exam_after=datetime.datetime(2022, 1, 1), has_thickness_grid=True)
+    """
+    COLUMNS = dict(path='TEXT PRIMARY KEY', size='INTEGER', mtime_ns='INTEGER', error='TEXT',
+                   version='TEXT', id='TEXT', reference_id='TEXT', pid='INTEGER', patient_id='TEXT', vid='INTEGER',
+                   visit_id='TEXT', exam_time='TEXT', dob='TEXT', visit_date='TEXT', scan_pattern='INTEGER',
+                   scan_position='TEXT', num_b_scans='INTEGER', size_x='INTEGER', size_z='INTEGER', scale_x='REAL',
+                   scale_z='REAL', distance='REAL', size_x_slo='INTEGER', size_y_slo='INTEGER', scale_x_slo='REAL',
+                   scale_y_slo='REAL', field_size_slo='INTEGER', grid_type='INTEGER', central_thk='REAL',
+                   min_central_thk='REAL', max_central_thk='REAL', total_volume='REAL', quality_min='REAL',
+                   quality_mean='REAL', quality_max='REAL')
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS vol_files ({})'.format(
+            ', '.join('{} {}'.format(column, column_type) for column, column_type in VolCatalog.COLUMNS.items())))
+        for column in ('patient_id', 'exam_time', 'scan_pattern'):
+            self.connection.execute('CREATE INDEX IF NOT EXISTS vol_files_{0} ON vol_files ({0})'.format(column))
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Close the connection to the database """
+        self.connection.close()
+
+    def update(self, root_dir):
+        """
+        Catalog the vol files in a directory tree, reading only the ones that are new or changed since the last update
+
+        Parameters
+        ----------
+        root_dir : str
+            The path to the directory searched (recursively) for vol files
+
+        Returns
+        -------
+        dict
+            The number of 'added', 'updated', 'unchanged', 'removed' (no longer existing) and 'failed' vol files
+
+        Notes
+        -----
+        The catalog is committed every CATALOG_COMMIT_INTERVAL vol files read and when the update ends, also if it is
+        interrupted, so that an interrupted update continues with the vol files not cataloged yet when rerun.
+        """
+        root_dir = os.path.abspath(root_dir)
+        cataloged = {path: (size, mtime_ns) for path, size, mtime_ns in self.connection.execute(
+            'SELECT path, size, mtime_ns FROM vol_files') if path.startswith(os.path.join(root_dir, ''))}
+
+        counts = dict(added=0, updated=0, unchanged=0, removed=0, failed=0)
+        found = set()
+        num_read = 0
+        try:
+            for dir_path, _, file_names in os.walk(root_dir):
+                for file_name in sorted(file_names):
+                    if not file_name.endswith('.vol'):
+                        continue
+                    vol_path = os.path.join(dir_path, file_name)
+                    found.add(vol_path)
+                    stat = os.stat(vol_path)
+                    if cataloged.get(vol_path) == (stat.st_size, stat.st_mtime_ns):
+                        counts['unchanged'] += 1
+                        continue
+
+                    row = VolCatalog._catalog_row(vol_path, stat)
+                    self.connection.execute('INSERT OR REPLACE INTO vol_files ({}) VALUES ({})'.format(
+                        ', '.join(row), ', '.join('?' * len(row))), tuple(row.values()))
+                    counts['failed' if row['error'] is not None else 'updated' if vol_path in cataloged else 'added'] += 1
+                    num_read += 1
+                    if num_read % CATALOG_COMMIT_INTERVAL == 0:
+                        self.connection.commit()
+
+            removed = [(vol_path,) for vol_path in cataloged if vol_path not in found]
+            self.connection.executemany('DELETE FROM vol_files WHERE path = ?', removed)
+            counts['removed'] = len(removed)
+        finally:
+            self.connection.commit()
+
+        return counts
+
+    @staticmethod
+    def _catalog_row(vol_path, stat):
+        """ Read the header, thickness grid and B scan headers of a vol file and return its row of the catalog """
+        row = dict(path=vol_path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, error=None)
+        try:
+            oct_vol = OCTVol(vol_path, load=('header', 'b_scan_header'))
+        except Exception as error:
+            row['error'] = repr(error)
+            return row
+
+        for column in VolCatalog.COLUMNS:
+            if column in oct_vol.header:
+                value = oct_vol.header[column]
+                row[column] = value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else \
+                    value.item() if isinstance(value, np.generic) else value
+        for column in ('central_thk', 'min_central_thk', 'max_central_thk', 'total_volume'):
+            row[column] = oct_vol.thickness_grid[column].item() if oct_vol.thickness_grid else None
+        if oct_vol.header['num_b_scans'] > 0:
+            quality = oct_vol.b_scan_header['quality']
+            row.update(quality_min=quality.min().item(), quality_mean=quality.mean().item(),
+                       quality_max=quality.max().item())
+
+        return row
+
+    def query(self, exam_after=None, exam_before=None, has_thickness_grid=None, **filters):
+        """
+        Find the cataloged vol files matching all the given criteria
+
+        Parameters
+        ----------
+        exam_after : datetime.datetime, optional
+            Only vol files with an exam_time at or after this time
+        exam_before : datetime.datetime, optional
+            Only vol files with an exam_time before this time
+        has_thickness_grid : bool, optional
+            Only vol files with (True) or without (False) a thickness grid
+        **filters
+            Column names of COLUMNS mapped to the value they must have, or to a list/tuple of allowed values, e.g.
+            patient_id='X' or scan_pattern=(3, 4)
+
+        Returns
+        -------
+        list of str
+            The paths of the matching vol files, ordered by path
+
+        Raises
+        ------
+        ValueError
+            if a filter is not a column of the catalog
+        """
+        conditions, parameters = ['error IS NULL'], []
+        if exam_after is not None:
+            conditions.append('exam_time >= ?')
+            parameters.append(exam_after.isoformat())
+        if exam_before is not None:
+            conditions.append('exam_time < ?')
+            parameters.append(exam_before.isoformat())
+        if has_thickness_grid is not None:
+            conditions.append('grid_type != 0' if has_thickness_grid else 'grid_type = 0')
+        for column, value in filters.items():
+            if column not in VolCatalog.COLUMNS:
+                raise ValueError('{} is not a column of the catalog. Valid columns are {}.'.format(column, list(VolCatalog.COLUMNS)))
+            values = list(value) if isinstance(value, (list, tuple)) else [value]
+            conditions.append('{} IN ({})'.format(column, ', '.join('?' * len(values))))
+            parameters.extend(values)
+
+        return [path for path, in self.connection.execute(
+            'SELECT path FROM vol_files WHERE {} ORDER BY path'.format(' AND '.join(conditions)), parameters)]
+
+    def query_vols(self, exam_after=None, exam_before=None, has_thickness_grid=None, mmap=True, load=OCTVol.LOAD_ITEMS,
+                   **filters):
+        """
+        Like query, but yields the matching vol files as OCTVol objects opened one at a time
+
+        Parameters
+        ----------
+        mmap : bool, optional
+            Passed to OCTVol, by default the vol files are memory-mapped. Default is True
+        load : tuple of str, optional
+            Passed to OCTVol. Default is OCTVol.LOAD_ITEMS
+
+        Yields
+        ------
+        OCTVol
+            The matching vol files, ordered by path
+        """
+        for vol_path in self.query(exam_after=exam_after, exam_before=exam_before,
+                                   has_thickness_grid=has_thickness_grid, **filters):
+            yield OCTVol(vol_path, mmap=mmap, load=load)
@@ -0,0 +1,118 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.save_OCT_and_segmentation_as_numpy import order_segmented_layers, rasterize_layers, transform_b_scans
+from collections import OrderedDict
+import numpy as np
+
+
+class VolDataset:
+    """
+    The VolDataset object gives random access to the B-scans of many vol files, e.g. for training data loaders
+
+    Parameters
+    ----------
+    vol_paths : list of str
+        Paths to the vol files
+    max_open_vols : int, optional
+        The maximum number of vol files kept open (memory-mapped) at a time. Default is 32
+    max_open_bytes : int, optional
+        The maximum number of bytes of the open vol files (their mapped B-scan records), None for no limit. Default is
+        None
+    label_map : bool, optional
+        If True, the labels of a B-scan are a uint8 label map of size_z * size_x, otherwise the one-hot encoded layers
+        of (n boundaries + 1) * size_z * size_x (see rasterize_layers). Default is True
+    dtype : data-type, optional
+        The dtype of the one-hot encoded layers if label_map is False. Default is np.uint8
+
+    Attributes
+    ----------
+    vol_paths : list of str
+        The paths to the vol files
+    offsets : np.ndarray
+        The global index of the first B-scan of each vol file, with the total number of B-scans appended
+
+    Notes
+    -----
+    Only the headers of the vol files are read when the dataset is created. A vol file is memory-mapped on the first
+    access to one of its B-scans and stays mapped until it is the least recently used one and max_open_vols or
+    max_open_bytes is exceeded. Indexing the dataset only reads and decodes the B-scan header (incl. segmentation) and
+    the B-scan itself. The segmented boundaries of a vol file are detected once, on its first access, from its whole
+    segmentation, which is not kept.
+
+    Examples
+    --------
+    >>> dataset = VolDataset(glob("/path/to/vol/files/*.vol"))
+    >>> image, labels = dataset[1234]
+    """
+    def __init__(self, vol_paths: list[str], max_open_vols: int = 32, max_open_bytes: int = None,
+                 label_map: bool = True, dtype=np.uint8):
+        self.vol_paths = list(vol_paths)
+        self.max_open_vols = max_open_vols
+        self.max_open_bytes = max_open_bytes
+        self.label_map = label_map
+        self.dtype = dtype
+
+        # Index all B-scans from the headers
+        num_b_scans = [OCTVol(vol_path, load=('header',)).header['num_b_scans'] for vol_path in self.vol_paths]
+        self.offsets = np.concatenate(([0], np.cumsum(num_b_scans, dtype=np.int64)))
+
+        self._open_vols = OrderedDict()  # index of the vol file -> (header, raw B-scan headers, B-scans, bytes)
+        self._open_bytes = 0
+        self._segmented_boundaries = dict()  # index of the vol file -> ordered segmented boundaries
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """ Return the transformed image (see transform_b_scans) and the labels of a B-scan """
+        i_vol, i_b_scan = self.locate(index)
+        header, b_scan_headers_raw, b_scans = self._open(i_vol)
+
+        image = transform_b_scans(b_scans[:, :, i_b_scan])
+        b_scan_header = OCTVol._parse_b_scan_headers(b_scan_headers_raw[i_b_scan:i_b_scan + 1], header)
+        labels = rasterize_layers([b_scan_header[boundary] for boundary in self._segmented_boundaries[i_vol]],
+                                  header['size_z'], dtype=self.dtype, label_map=self.label_map)
+
+        return image, labels[..., 0]
+
+    def __getstate__(self) -> dict:
+        # The open vol files are not passed on, e.g. to data loader worker processes
+        state = self.__dict__.copy()
+        state['_open_vols'], state['_open_bytes'] = OrderedDict(), 0
+        return state
+
+    def locate(self, index: int) -> tuple[int, int]:
+        """ Return the index of the vol file and the index of the B-scan within it of a global B-scan index """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('B-scan {} is out of range for a dataset of {} B-scans.'.format(index, len(self)))
+        i_vol = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return i_vol, int(index - self.offsets[i_vol])
+
+    def _open(self, i_vol: int) -> tuple[dict, np.ndarray, np.ndarray]:
+        """
+        Return the header, the raw B-scan headers and the B-scans (see OCTVol._map_records) of the memory-mapped vol
+        file, mapping it and evicting others if needed
+        """
+        if i_vol in self._open_vols:
+            self._open_vols.move_to_end(i_vol)
+            return self._open_vols[i_vol][:3]
+
+        vol_path = self.vol_paths[i_vol]
+        if i_vol not in self._segmented_boundaries:
+            self._segmented_boundaries[i_vol] = order_segmented_layers(OCTVol(vol_path, mmap=True, load=('segmentation',)))
+
+        vol_map = np.memmap(vol_path, dtype='uint8', mode='r')
+        header = OCTVol._parse_header(OCTVol._map_exactly(vol_map, 0, OCTVol.HEADER_DTYPE.itemsize, vol_path))
+        b_scan_headers_raw, b_scans = OCTVol._map_records(vol_map, header)
+        open_bytes = b_scan_headers_raw.nbytes + b_scans.nbytes
+        self._open_vols[i_vol] = (header, b_scan_headers_raw, b_scans, open_bytes)
+        self._open_bytes += open_bytes
+
+        # Close the least recently used vol files (but never the one just opened)
+        while len(self._open_vols) > 1 and (len(self._open_vols) > self.max_open_vols or
+                                            (self.max_open_bytes is not None and self._open_bytes > self.max_open_bytes)):
+            _, (*_, evicted_bytes) = self._open_vols.popitem(last=False)
+            self._open_bytes -= evicted_bytes
+
+        return self._open_vols[i_vol][:3]
@@ -0,0 +1,225 @@
+from OCT.formats.OCTVol import OCTVol
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import bisect
+import io
+import os
+
+
+BLOCK_SIZE = 16 * 2 ** 20  # bytes per read call, large reads keep the requests to network storage few
+MAX_GAP = 2 ** 20  # gaps between the parts of a vol file to read up to this size are read through rather than skipped
+MAX_IN_FLIGHT_BYTES = 2 * 2 ** 30  # default budget of the vol files read ahead and not yet consumed
+
+
+class _BufferFile(io.RawIOBase):
+    """
+    A read-only binary file object over the parts of a file read into buffers (without copying them), with the name of
+    the file they were read from. Reading where no part was read ends like the end of the file
+    """
+    def __init__(self, parts: list[tuple[int, bytearray]], name: str):
+        super().__init__()
+        self._offsets = [offset for offset, _ in parts]
+        self._buffers = [memoryview(buffer) for _, buffer in parts]
+        self._size = max([offset + len(buffer) for offset, buffer in parts], default=0)
+        self._position = 0
+        self.name = name
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._position = max(0, offset + (0, self._position, self._size)[whence])
+        return self._position
+
+    def readinto(self, array) -> int:
+        i_part = bisect.bisect_right(self._offsets, self._position) - 1
+        if i_part < 0:
+            return 0
+        start = self._position - self._offsets[i_part]
+        data = self._buffers[i_part][start:start + memoryview(array).nbytes]
+        memoryview(array).cast('B')[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def _read_range(vf, start: int, stop: int, block_size: int) -> bytearray:
+    """ Read the bytes from start to stop (or the end of the file) with sequential reads of block_size bytes """
+    vf.seek(start)
+    buffer = bytearray(max(0, min(stop, os.fstat(vf.fileno()).st_size) - start))
+    view, position = memoryview(buffer), 0
+    while position < len(buffer):
+        n_read = vf.readinto(view[position:position + block_size])
+        if not n_read:
+            del view
+            del buffer[position:]  # the file ends before stop, which _open_vol reports as truncated
+            break
+        position += n_read
+    return buffer
+
+
+def read_vol_file(vol_path: str, block_size: int = BLOCK_SIZE) -> bytearray:
+    """ Read a whole vol file into memory with sequential reads of block_size bytes """
+    with open(vol_path, 'rb', buffering=0) as vf:
+        return _read_range(vf, 0, os.fstat(vf.fileno()).st_size, block_size)
+
+
+def vol_file_ranges(header: dict, load=OCTVol.LOAD_ITEMS, max_gap: int = MAX_GAP) -> list[tuple[int, int]]:
+    """
+    Return the byte ranges of a vol file OCTVol reads to load the given parts (see OCTVol.LOAD_ITEMS) of all B-scans
+
+    Parameters
+    ----------
+    header : dict
+        The header of the vol file, see OCTVol
+    load : tuple of str, optional
+        The parts of the vol file to read. Default is OCTVol.LOAD_ITEMS
+    max_gap : int, optional
+        Ranges at most max_gap bytes apart are merged into one. Default is MAX_GAP
+
+    Returns
+    --------
+    list of tuple
+        The (start, stop) byte offsets of the ranges in ascending order, the first one starting with the header
+    """
+    load = OCTVol._check_load(load)
+    size_x, size_z, num_b_scans, b_scan_hdr_size, grid_offset = (int(header[field]) for field in (
+        'size_x', 'size_z', 'num_b_scans', 'b_scan_hdr_size', 'grid_offset'))  # no int32 overflows in large files
+    slo_offset = OCTVol.HEADER_DTYPE.itemsize
+    records_offset = slo_offset + int(header['size_x_slo']) * int(header['size_y_slo'])
+    record_size = b_scan_hdr_size + size_x * size_z * 4
+
+    ranges = [(0, slo_offset)]
+    if 'slo' in load:
+        ranges.append((slo_offset, records_offset))
+    if 'b_scans' in load:
+        ranges.append((records_offset, records_offset + num_b_scans * record_size))
+    elif 'b_scan_header' in load:
+        b_scan_header_size = b_scan_hdr_size if 'segmentation' in load else OCTVol.B_SCAN_HEADER_DTYPE.itemsize
+        ranges.extend((record_offset, record_offset + b_scan_header_size) for record_offset in
+                      range(records_offset, records_offset + num_b_scans * record_size, record_size))
+    if header['grid_type'] != 0:
+        ranges.append((grid_offset, grid_offset + OCTVol.THICKNESS_GRID_DTYPE.itemsize))
+
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def read_vol_parts(vol_path: str, load=OCTVol.LOAD_ITEMS, block_size: int = BLOCK_SIZE,
+                   max_gap: int = MAX_GAP) -> list[tuple[int, bytearray]]:
+    """
+    Read the parts of a vol file needed to load the given parts (see vol_file_ranges) into memory
+
+    Returns
+    --------
+    list of tuple
+        The offset and the bytes of each range read. If the B-scans are loaded, the whole file is read as one range
+
+    Notes
+    -----
+    Without the B-scans, the header is read first to find the other parts, which are then read with one sequential
+    pass of block_size reads per range, e.g. for load=('header',) only the header and the thickness grid.
+    """
+    load = OCTVol._check_load(load)
+    if 'b_scans' in load:
+        return [(0, read_vol_file(vol_path, block_size))]
+
+    with open(vol_path, 'rb', buffering=0) as vf:
+        header_bytes = _read_range(vf, 0, OCTVol.HEADER_DTYPE.itemsize, block_size)
+        if len(header_bytes) < OCTVol.HEADER_DTYPE.itemsize:
+            return [(0, header_bytes)]  # _open_vol reports the truncated header
+        ranges = vol_file_ranges(OCTVol._parse_header(header_bytes), load, max_gap)
+
+        # The first range starts with the header which was read already
+        parts = [(0, header_bytes + _read_range(vf, len(header_bytes), ranges[0][1], block_size))]
+        parts.extend((start, _read_range(vf, start, stop, block_size)) for start, stop in ranges[1:])
+    return parts
+
+
+def _read_and_open(vol_path: str, load: tuple, block_size: int) -> tuple[OCTVol, str, int]:
+    """ Read the parts of a vol file needed for load and parse them, returning the OCTVol object, the error and the bytes read """
+    try:
+        parts = read_vol_parts(vol_path, load, block_size)
+        n_read = sum(len(buffer) for _, buffer in parts)
+        return OCTVol(vol_path, load=load, vol_file=_BufferFile(parts, vol_path)), None, n_read
+    except Exception as error:
+        return None, repr(error), 0
+
+
+def prefetch_vols(vol_paths: list[str], load=OCTVol.LOAD_ITEMS, workers: int = 4,
+                  max_in_flight_bytes: int = MAX_IN_FLIGHT_BYTES, block_size: int = BLOCK_SIZE):
+    """
+    Read vol files ahead in a pool of threads and yield them in order as OCTVol objects
+
+    Parameters
+    ----------
+    vol_paths : list of str
+        The paths to the vol files
+    load : tuple of str, optional
+        The parts of the vol files to read and parse, see OCTVol. Default is OCTVol.LOAD_ITEMS
+    workers : int, optional
+        The number of threads reading vol files at the same time. Default is 4
+    max_in_flight_bytes : int, optional
+        The maximum total size of the vol files being read or read but not yet consumed. A single vol file larger than
+        this is still read, just not ahead. Default is MAX_IN_FLIGHT_BYTES
+    block_size : int, optional
+        The number of bytes read per read call. Default is BLOCK_SIZE
+
+    Yields
+    ------
+    tuple
+        The path to the vol file, the OCTVol object (None if it could not be read) and the error raised while reading
+        it (None if it was read successfully)
+
+    Notes
+    -----
+    The parts of every vol file needed for load (see read_vol_parts) are read with a few large sequential reads and then
+    parsed from memory, so the many small reads and seeks of parsing do not wait on the storage. While the caller
+    processes a vol file, the next ones are read in the background. A vol file counts against max_in_flight_bytes
+    until the caller asks for the next one, with the bytes read from it once they are known and the size of the whole
+    file before (only the size of the header and the thickness grid for load=('header',)).
+
+    Examples
+    --------
+    >>> for vol_path, oct_vol, error in prefetch_vols(glob("/mnt/archive/*.vol"), max_in_flight_bytes=2 ** 30):
+    ...     process(oct_vol)
+    """
+    vol_paths = list(vol_paths)
+    load = OCTVol._check_load(load)
+    # The bytes each vol file counts with: the whole file with the B-scans, only the header and the thickness grid
+    # for the header alone and otherwise the whole file until it was read and the actual bytes read are known
+    sizes = [os.path.getsize(vol_path) if os.path.isfile(vol_path) else 0 for vol_path in vol_paths]
+    if load == ('header',):
+        sizes = [min(size, OCTVol.HEADER_DTYPE.itemsize + OCTVol.THICKNESS_GRID_DTYPE.itemsize) for size in sizes]
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending, in_flight, i_next = deque(), 0, 0
+        while pending or i_next < len(vol_paths):
+            for i_vol, future in pending:
+                if future.done():
+                    in_flight -= sizes[i_vol] - future.result()[2]
+                    sizes[i_vol] = future.result()[2]
+
+            # Read ahead as long as the budget allows, but always at least the next vol file
+            while i_next < len(vol_paths) and (not pending or in_flight + sizes[i_next] <= max_in_flight_bytes):
+                pending.append((i_next, executor.submit(_read_and_open, vol_paths[i_next], load, block_size)))
+                in_flight += sizes[i_next]
+                i_next += 1
+
+            i_vol, future = pending.popleft()
+            oct_vol, error, _ = future.result()
+            yield vol_paths[i_vol], oct_vol, error
+            in_flight -= sizes[i_vol]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
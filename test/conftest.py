@@ -0,0 +1,24 @@
+from OCT.src.synthetic_vol import make_synthetic_vol
+import pytest
+
+
+# The small synthetic vol file the tests run on, see make_synthetic_vol
+SMALL_VOL = dict(size_x=64, size_z=48, num_b_scans=7, size_x_slo=32, size_y_slo=24, invalid_pattern='random',
+                 invalid_fraction=0.2)
+
+
+@pytest.fixture
+def make_vol(tmp_path):
+    """ Return a function writing a small synthetic vol file into tmp_path, make_vol(name='orig.vol', **SMALL_VOL) """
+    def make_vol(name: str = 'orig.vol', **kwargs) -> str:
+        return make_synthetic_vol(str(tmp_path / name), **{**SMALL_VOL, **kwargs})
+    return make_vol
+
+
+@pytest.fixture
+def vol_path(request, make_vol):
+    """
+    The path to a small synthetic vol file 'orig.vol' in tmp_path. Parametrize it indirectly with a dict to override
+    the arguments of make_synthetic_vol, e.g. @pytest.mark.parametrize('vol_path', [dict(num_b_scans=5)], indirect=True)
+    """
+    return make_vol(**getattr(request, 'param', dict()))
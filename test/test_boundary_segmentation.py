@@ -0,0 +1,48 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.boundary_segmentation import BoundarySegmentation
+from OCT.src.save_OCT_and_segmentation_as_numpy import extract_segmentation
+import numpy as np
+import pytest
+import io
+
+
+@pytest.fixture
+def oct_vol(vol_path):
+    return OCTVol(vol_path)
+
+
+def test_rasterize(oct_vol):
+    segmentation = BoundarySegmentation.from_oct_vol(oct_vol)
+    assert len(segmentation) == 7 and segmentation.shape == (48, 64, 7)
+    label_map = extract_segmentation(oct_vol, label_map=True)
+    one_hot = extract_segmentation(oct_vol, dtype=np.uint8)
+    assert np.array_equal(segmentation.rasterize(), label_map)
+    assert np.array_equal(segmentation.rasterize(label_map=False), one_hot)
+    assert np.array_equal(segmentation.rasterize(b_scan_indices=2), label_map[:, :, 2:3])
+    assert np.array_equal(segmentation.rasterize(b_scan_indices=[6, 0], a_scan_indices=slice(10, 20), z_range=(5, 30),
+                                                 label_map=False), one_hot[:, 5:30, 10:20][..., [6, 0]])
+    # Only the rows in z_range are rasterized, clipped like a slice
+    window = segmentation.rasterize(b_scan_indices=slice(1, 4), z_range=(40, 100))
+    assert window.base is None and np.array_equal(window, label_map[40:, :, 1:4])
+
+
+def test_layer_at(oct_vol):
+    segmentation = BoundarySegmentation.from_oct_vol(oct_vol)
+    label_map = extract_segmentation(oct_vol, label_map=True)
+    one_hot = extract_segmentation(oct_vol, dtype=bool)
+    rng = np.random.default_rng(0)
+    z, x, b = rng.integers(0, 48, 1000), rng.integers(0, 64, 1000), rng.integers(0, 7, 1000)
+    assert np.array_equal(segmentation.layer_at(z, x, b), label_map[z, x, b])
+    assert np.array_equal(segmentation.in_layer(3, z, x, b), one_hot[3, z, x, b])
+    assert segmentation.layer_at(47, 30, 2) == label_map[47, 30, 2]
+
+
+def test_save_load(oct_vol):
+    segmentation = BoundarySegmentation.from_oct_vol(oct_vol)
+    file = io.BytesIO()
+    segmentation.save(file)
+    file.seek(0)
+    loaded = BoundarySegmentation.load(file)
+    assert loaded.names == segmentation.names and loaded.size_z == segmentation.size_z
+    assert np.array_equal(loaded.boundaries, segmentation.boundaries)
+    assert len(file.getvalue()) < extract_segmentation(oct_vol).nbytes / 100
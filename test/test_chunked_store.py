@@ -0,0 +1,93 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.chunked_store import ChunkedStoreWriter, ChunkedStore, DATA_SUFFIX, INDEX_SUFFIX
+from OCT.src.save_OCT_and_segmentation_as_numpy import convert_vol_file, transform_b_scans, rasterize_layers, \
+    order_segmented_layers
+import numpy as np
+import pytest
+import os
+
+
+@pytest.fixture
+def channels():
+    rng = np.random.default_rng(0)
+    return dict(image=rng.random((7, 6, 5)).astype(np.float16), labels=rng.integers(0, 12, (7, 6, 5), dtype=np.uint8))
+
+
+def write_store(store_path, channels, chunk_size, compression='zlib'):
+    with ChunkedStoreWriter(store_path, chunk_size=chunk_size, compression=compression,
+                            attributes=dict(source='test')) as writer:
+        for i_first in range(0, 7, chunk_size):
+            writer.add_chunk(**{name: array[i_first:i_first + chunk_size] for name, array in channels.items()})
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma', 'none'])
+@pytest.mark.parametrize('chunk_size', [1, 3])
+def test_round_trip(channels, tmp_path, compression, chunk_size):
+    store_path = str(tmp_path / 'store')
+    write_store(store_path, channels, chunk_size, compression)
+    store = ChunkedStore(store_path)
+    assert len(store) == 7 and store.attributes == dict(source='test')
+    assert store.index['compression'] == compression
+    assert len(store.index['channels']['image']['chunks']) == int(np.ceil(7 / chunk_size))
+    for i_b_scan in [0, 2, 3, 6, 1]:
+        b_scan = store[i_b_scan]
+        assert b_scan.keys() == channels.keys()
+        for name, array in channels.items():
+            assert b_scan[name].dtype == array.dtype and np.array_equal(b_scan[name], array[i_b_scan])
+    assert store.read_b_scan(5, channels=['labels']).keys() == {'labels'}
+    last_chunk = store.read_chunk((7 - 1) // chunk_size)
+    assert np.array_equal(last_chunk['image'], channels['image'][(7 - 1) // chunk_size * chunk_size:])
+    store.close()
+    if compression == 'none':
+        assert os.path.getsize(store_path + DATA_SUFFIX) == channels['labels'].nbytes + channels['image'].nbytes
+
+
+def test_indexing(channels, tmp_path):
+    write_store(str(tmp_path / 'store'), channels, chunk_size=3)
+    store = ChunkedStore(str(tmp_path / 'store'))
+    assert np.array_equal(store[-1]['labels'], channels['labels'][6])
+    assert np.array_equal(store[-7]['image'], channels['image'][0])
+    for i_b_scan in (7, -8):
+        with pytest.raises(IndexError):
+            store[i_b_scan]
+
+
+def test_mismatch(channels, tmp_path):
+    store_path = str(tmp_path / 'store')
+    with pytest.raises(ValueError):
+        ChunkedStoreWriter(store_path, compression='zip')
+    for mismatch in (dict(image=channels['image'][3:6].astype(np.float32)), dict(labels=channels['labels'][3:6, :, :4]),
+                     dict(labels=channels['labels'][3:5])):
+        with pytest.raises(ValueError):
+            with ChunkedStoreWriter(store_path) as writer:
+                writer.add_chunk(image=channels['image'][:3], labels=channels['labels'][:3])
+                writer.add_chunk(**{**dict(image=channels['image'][3:6], labels=channels['labels'][3:6]), **mismatch})
+        assert not os.path.exists(store_path + INDEX_SUFFIX)
+
+
+def test_failed_rewrite(channels, tmp_path):
+    store_path = str(tmp_path / 'store')
+    write_store(store_path, channels, chunk_size=3)
+    with pytest.raises(RuntimeError):
+        with ChunkedStoreWriter(store_path, chunk_size=3) as writer:
+            writer.add_chunk(image=channels['image'][4:7], labels=channels['labels'][4:7])
+            raise RuntimeError('The conversion failed')
+    assert not os.path.exists(store_path + INDEX_SUFFIX)
+    with pytest.raises(FileNotFoundError):
+        ChunkedStore(store_path)
+
+
+def test_convert_vol_file_chunked(vol_path, tmp_path):
+    save_dir = str(tmp_path / 'chunked')
+    os.mkdir(save_dir)
+    assert convert_vol_file(vol_path, save_dir, output_format='chunked', chunk_size=3, compression='lzma') == (vol_path, None)
+
+    oct_vol = OCTVol(vol_path)
+    store = ChunkedStore(os.path.join(save_dir, 'orig'))
+    boundaries = order_segmented_layers(oct_vol)
+    assert len(store) == 7 and store.attributes['boundaries'] == boundaries and store.index['chunk_size'] == 3
+    image = transform_b_scans(oct_vol.b_scans, dtype=np.float16)
+    labels = rasterize_layers([oct_vol.b_scan_header[boundary] for boundary in boundaries], 48, label_map=True)
+    for i_b_scan in range(7):
+        assert np.array_equal(store[i_b_scan]['image'], image[:, :, i_b_scan])
+        assert np.array_equal(store[i_b_scan]['labels'], labels[:, :, i_b_scan])
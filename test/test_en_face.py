@@ -0,0 +1,64 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.en_face import en_face_projections, b_scan_positions_on_slo, a_scan_positions_on_slo, \
+    draw_b_scan_positions, en_face_overview
+from OCT.src.save_OCT_and_segmentation_as_numpy import rasterize_layers
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def vol_path(make_vol):
+    vol_path = make_vol(size_x_slo=96, size_y_slo=80)
+    OCTVol.patch_vol(vol_path, header=dict(scale_x_slo=0.01, scale_y_slo=0.012))
+    return vol_path
+
+
+def test_en_face_projections(vol_path):
+    oct_vol = OCTVol(vol_path)
+    # Mark a few pixels invalid and one A-scan completely
+    b_scans = oct_vol.b_scans.copy()
+    b_scans[:, 10, 3] = np.finfo(np.float32).max
+    b_scans[:5, 20, 1] = 2
+    oct_vol.b_scans = b_scans
+
+    projections = en_face_projections(oct_vol, slabs=dict(retina=('boundary_1', 'boundary_2')), chunk_size=3)
+    valid = b_scans <= 1
+    transformed = np.where(valid, b_scans, 0) ** 0.25
+    with np.errstate(invalid='ignore'):
+        assert np.allclose(projections['mean'], (transformed.sum(axis=0) / valid.sum(axis=0)).T, equal_nan=True)
+    assert np.isnan(projections['mean'][3, 10]) and np.isnan(projections['max'][3, 10])
+    assert np.array_equal(np.nan_to_num(projections['max'], nan=-1), np.where(valid.any(axis=0), transformed.max(axis=0), -1).T)
+
+    retina = rasterize_layers([oct_vol.b_scan_header['boundary_1'], oct_vol.b_scan_header['boundary_2']], 48, dtype=bool)[1] & valid
+    with np.errstate(invalid='ignore'):
+        expected = (np.where(retina, transformed, 0).sum(axis=0) / retina.sum(axis=0)).T
+    assert np.allclose(projections['retina'], expected, equal_nan=True)
+    assert projections['retina'].shape == (7, 64) and np.isnan(projections['retina']).any()
+
+
+def test_en_face_projections_mmap(vol_path):
+    projections = en_face_projections(OCTVol(vol_path))
+    mapped_projections = en_face_projections(OCTVol(vol_path, mmap=True))
+    for name in ('mean', 'max'):
+        assert np.array_equal(projections[name], mapped_projections[name], equal_nan=True)
+
+
+def test_positions_on_slo(vol_path):
+    oct_vol = OCTVol(vol_path, load=('header', 'slo', 'b_scan_header'))
+    positions = b_scan_positions_on_slo(oct_vol)
+    assert positions.shape == (7, 2, 2)
+    assert np.allclose(positions[:, 1, 0], oct_vol.b_scan_header['end_x'] / 0.01)
+    assert np.allclose(positions[:, 0, 1], oct_vol.b_scan_header['start_y'] / 0.012)
+    x, y = a_scan_positions_on_slo(oct_vol)
+    assert np.allclose(x[:, [0, -1]], positions[:, :, 0]) and np.allclose(y[:, [0, -1]], positions[:, :, 1])
+
+    slo = np.zeros((80, 96), dtype=np.uint8)
+    overlay = draw_b_scan_positions(slo, positions, value=7)
+    assert not slo.any()
+    rows = np.rint(positions[:, 0, 1]).astype(int)
+    assert np.all(overlay[rows, :74] == 7) and np.all(overlay[rows, 74:] == 0)
+    assert np.count_nonzero(overlay) == 7 * 74
+    assert np.array_equal(draw_b_scan_positions(slo, positions[:0]), slo)
+
+    overview = en_face_overview(vol_path)
+    assert overview['mean'].shape == (7, 64) and overview['slo_overlay'].shape == (80, 96)
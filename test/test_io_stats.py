@@ -0,0 +1,53 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.formats.io_stats import IOStats
+from OCT.src.save_OCT_and_segmentation_as_numpy import save_oct_and_segmentation_as_numpy
+import numpy as np
+import pytest
+import os
+
+
+def test_read_write_stats(vol_path, tmp_path):
+    stats = IOStats(trace_memory=True)
+    oct_vol = OCTVol(vol_path, stats=stats)
+    assert stats.files == 1 and stats.bytes_read == os.path.getsize(vol_path)
+    assert stats.calls['read_b_scans'] == 7 and stats.seeks == 3
+    assert {'read_header', 'read_slo', 'read_b_scan_headers', 'parse_b_scan_headers', 'read_thickness_grid'} <= set(stats.seconds)
+    assert stats.peak_bytes['parse_b_scan_headers'] > 0
+
+    write_stats = IOStats()
+    oct_vol.write_vol(str(tmp_path / 'written.vol'), stats=write_stats)
+    assert write_stats.bytes_written == os.path.getsize(vol_path) and write_stats.writes == 2 + 7 + 1
+    assert write_stats.peak_bytes == dict()
+
+    stats.merge(write_stats)
+    assert stats.files == 2 and stats.calls['write_b_scans'] == 1
+    assert 'write_b_scans' in stats.report()
+
+
+def test_mapped_read_stats(vol_path):
+    stats = IOStats()
+    oct_vol = OCTVol(vol_path, mmap=True, load=('header', 'b_scan_header', 'b_scans'), b_scan_indices=[1, 4, 5], stats=stats)
+    header_bytes = OCTVol.HEADER_DTYPE.itemsize + OCTVol.THICKNESS_GRID_DTYPE.itemsize
+    assert stats.bytes_read == header_bytes + 3 * OCTVol.B_SCAN_HEADER_DTYPE.itemsize + oct_vol.b_scans.nbytes
+    assert stats.reads == 2 + 3 + 3 and stats.seeks == 0
+    assert {'read_header', 'read_b_scan_headers', 'parse_b_scan_headers', 'read_b_scans', 'read_thickness_grid'} == set(stats.seconds)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_conversion_stats(vol_path, make_vol, tmp_path, workers):
+    make_vol('other.vol', num_b_scans=5)
+    stats = IOStats()
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), workers=workers, verbose=False, stats=stats)
+    assert stats.files == 2 and stats.calls['transform'] == 2 and stats.calls['save'] == 2
+    assert stats.calls['read_b_scans'] == 2 and stats.calls['read_b_scan_headers'] == 2
+    # The conversion maps the vol files, the headers, the B-scan headers with the segmentation and the B-scans are read
+    header_bytes = OCTVol.HEADER_DTYPE.itemsize + OCTVol.THICKNESS_GRID_DTYPE.itemsize
+    record_size = OCTVol(vol_path, load=('header',)).header['b_scan_hdr_size'] + 48 * 64 * 4
+    assert stats.bytes_read > 0
+    assert stats.bytes_read == sum(header_bytes + num_b_scans * record_size for num_b_scans in (7, 5))
+    assert stats.reads == sum(2 + num_b_scans + 1 for num_b_scans in (7, 5))
+    assert stats.bytes_written == sum(os.path.getsize(os.path.join(summary['save_dir'], name))
+                                      for name in ('orig.npy', 'other.npy'))
+    assert sorted(summary['file_stats']) == sorted(summary['saved'])
+    assert sum(file_stats['bytes_written'] for file_stats in summary['file_stats'].values()) == stats.bytes_written
+    assert np.load(os.path.join(summary['save_dir'], 'orig.npy')).shape == (13, 48, 64, 7)
@@ -0,0 +1,66 @@
+from OCT.formats.OCTVol import OCTVol
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def orig_vol(vol_path):
+    return OCTVol(vol_path)
+
+
+def assert_equal_items(expected, actual):
+    assert expected.keys() == actual.keys()
+    for key in expected:
+        if isinstance(expected[key], np.ndarray):
+            assert expected[key].dtype == actual[key].dtype
+            assert np.array_equal(expected[key], actual[key])
+        else:
+            assert expected[key] == actual[key]
+
+
+def test_mmap(orig_vol, vol_path):
+    mapped_vol = OCTVol(vol_path, mmap=True)
+    assert_equal_items(orig_vol.header, mapped_vol.header)
+    assert_equal_items(orig_vol.b_scan_header, mapped_vol.b_scan_header)
+    assert np.array_equal(orig_vol.slo, mapped_vol.slo)
+    assert np.array_equal(orig_vol.b_scans, mapped_vol.b_scans)
+    assert not mapped_vol.b_scans.flags.writeable
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+@pytest.mark.parametrize('b_scan_indices', [None, slice(2, 5), [5, 1], -1])
+@pytest.mark.parametrize('load', [('header',), ('b_scan_header',), ('segmentation',), ('slo', 'b_scans')])
+def test_partial_read(orig_vol, vol_path, mmap, b_scan_indices, load):
+    oct_vol = OCTVol(vol_path, mmap=mmap, load=load, b_scan_indices=b_scan_indices)
+    selected = np.atleast_1d(np.arange(orig_vol.header['num_b_scans'])[slice(None) if b_scan_indices is None else b_scan_indices])
+    assert np.array_equal(oct_vol.b_scan_indices, selected)
+    assert_equal_items(orig_vol.header, oct_vol.header)
+    assert_equal_items(orig_vol.thickness_grid, oct_vol.thickness_grid)
+
+    if 'slo' in load:
+        assert np.array_equal(orig_vol.slo, oct_vol.slo)
+    else:
+        assert oct_vol.slo is None
+
+    if 'b_scans' in load:
+        assert np.array_equal(orig_vol.b_scans[:, :, selected], oct_vol.b_scans)
+    else:
+        assert oct_vol.b_scans is None
+
+    if 'b_scan_header' in load or 'segmentation' in load:
+        expected = {key: value[..., selected] if key in ('version', 'spare') else value[selected]
+                    for key, value in orig_vol.b_scan_header.items()
+                    if 'segmentation' in load or not key.startswith('boundary')}
+        assert_equal_items(expected, oct_vol.b_scan_header)
+    else:
+        assert oct_vol.b_scan_header == dict()
+
+
+def test_partial_write(vol_path, tmp_path):
+    with pytest.raises(ValueError):
+        OCTVol(vol_path, b_scan_indices=slice(0, 2)).write_vol(str(tmp_path / 'test.vol'))
+
+
+def test_unknown_load_item(vol_path):
+    with pytest.raises(ValueError):
+        OCTVol(vol_path, load=('header', 'pixels'))
@@ -0,0 +1,46 @@
+from OCT.formats.OCTVol import OCTVol
+import numpy as np
+import pytest
+import os
+
+
+@pytest.mark.parametrize('atomic', [False, True])
+def test_patch_vol(vol_path, atomic):
+    orig_vol = OCTVol(vol_path)
+    os.chmod(vol_path, 0o640)
+    boundary_1 = orig_vol.b_scan_header['boundary_1'][2:5] + 1.5
+    quality = np.array([1, 2, 3], dtype='float32')
+    written = OCTVol.patch_vol(vol_path, header=dict(patient_id='PATCHED', unconverted_visit_date=44100.0),
+                               b_scan_header=dict(boundary_1=boundary_1, quality=quality),
+                               thickness_grid=dict(central_thk=0.5, sector_2=dict(volume=1.5)),
+                               b_scan_indices=slice(2, 5), atomic=atomic)
+    assert written == 21 + 8 + 3 * (64 * 4 + 4) + OCTVol.THICKNESS_GRID_DTYPE.itemsize
+    assert os.listdir(os.path.dirname(vol_path)) == ['orig.vol'] and os.stat(vol_path).st_mode & 0o777 == 0o640
+
+    patched_vol = OCTVol(vol_path)
+    assert patched_vol.header['patient_id'] == 'PATCHED' and patched_vol.header['visit_date'] != orig_vol.header['visit_date']
+    assert all(np.array_equal(patched_vol.header[key], value) for key, value in orig_vol.header.items()
+               if key not in ('patient_id', 'unconverted_visit_date', 'visit_date'))
+    assert np.array_equal(patched_vol.b_scan_header['boundary_1'][2:5], boundary_1)
+    assert np.array_equal(patched_vol.b_scan_header['boundary_1'][5:], orig_vol.b_scan_header['boundary_1'][5:])
+    assert np.array_equal(patched_vol.b_scan_header['quality'][2:5], quality)
+    assert all(np.array_equal(patched_vol.b_scan_header[key], value) for key, value in orig_vol.b_scan_header.items()
+               if key not in ('boundary_1', 'quality'))
+    assert patched_vol.thickness_grid['central_thk'] == np.float32(0.5)
+    assert patched_vol.thickness_grid['sector_2'] == dict(thickness=orig_vol.thickness_grid['sector_2']['thickness'],
+                                                          volume=np.float32(1.5))
+    assert np.array_equal(patched_vol.slo, orig_vol.slo) and np.array_equal(patched_vol.b_scans, orig_vol.b_scans)
+
+
+@pytest.mark.parametrize('patch', [dict(header=dict(num_b_scans=3)), dict(header=dict(patient_id='X' * 22)),
+                                   dict(b_scan_header=dict(boundary_18=np.zeros((7, 64)))),
+                                   dict(b_scan_header=dict(quality=np.zeros(3))),
+                                   dict(b_scan_header=dict(off_seg=np.zeros(7))),
+                                   dict(thickness_grid=dict(sectors=np.zeros((9, 2))))])
+def test_patch_vol_invalid(vol_path, patch):
+    with open(vol_path, 'rb') as vol_file:
+        orig_bytes = vol_file.read()
+    with pytest.raises(ValueError):
+        OCTVol.patch_vol(vol_path, **{'header': dict(patient_id='PATCHED'), **patch})
+    with open(vol_path, 'rb') as vol_file:
+        assert vol_file.read() == orig_bytes
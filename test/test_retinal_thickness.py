@@ -0,0 +1,61 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.retinal_thickness import thickness_map, layer_thickness_maps, fundus_coordinates, etdrs_sectors, \
+    sector_statistics, batch_sector_statistics, ETDRS_SECTORS
+import numpy as np
+import pytest
+
+
+# The A-scans have to be dense enough to cover every ETDRS sector
+pytestmark = pytest.mark.parametrize('vol_path', [dict(size_x=512, num_b_scans=49)], indirect=True, ids=['512x49'])
+
+
+def test_thickness_map(vol_path):
+    oct_vol = OCTVol(vol_path, load=('header', 'segmentation'))
+    invalid = np.finfo(np.float32).max
+    thickness = thickness_map(oct_vol, 'boundary_1', 'boundary_2')
+    for i_b_scan in range(oct_vol.header['num_b_scans']):
+        for i_a_scan in range(oct_vol.header['size_x']):
+            upper = oct_vol.b_scan_header['boundary_1'][i_b_scan, i_a_scan]
+            lower = oct_vol.b_scan_header['boundary_2'][i_b_scan, i_a_scan]
+            if upper == invalid or lower == invalid:
+                assert np.isnan(thickness[i_b_scan, i_a_scan])
+            else:
+                assert np.isclose(thickness[i_b_scan, i_a_scan], (float(lower) - float(upper)) * oct_vol.header['scale_z'])
+
+    thickness_maps = layer_thickness_maps(oct_vol)
+    assert list(thickness_maps)[0] == 'boundary_1-boundary_3'
+    assert np.array_equal(thickness_maps['total'], thickness, equal_nan=True)
+
+
+def test_sector_statistics(vol_path):
+    oct_vol = OCTVol(vol_path, load=('header', 'segmentation'))
+    x, y = fundus_coordinates(oct_vol)
+    assert np.allclose(x[:, 0], oct_vol.b_scan_header['start_x']) and np.allclose(y[:, -1], oct_vol.b_scan_header['end_y'])
+
+    sectors = etdrs_sectors(oct_vol, center=(x[24, 100], y[24, 100]))
+    assert sectors[24, 100] == 0
+    assert sectors[0, 100] == ETDRS_SECTORS.index('outer_superior') and sectors[-1, 100] == ETDRS_SECTORS.index('outer_inferior')
+    assert sectors[24, 160] == ETDRS_SECTORS.index('inner_nasal') and sectors[24, 0] == ETDRS_SECTORS.index('inner_temporal')
+    assert sectors[24, -1] == -1  # 4.7 mm to the nasal side of the right eye
+
+    assert np.array_equal(etdrs_sectors(oct_vol), etdrs_sectors(oct_vol, center=oct_vol.thickness_grid['center_pos']))
+
+    thickness = thickness_map(oct_vol)
+    means, counts = sector_statistics(thickness, sectors)
+    for i_sector in range(len(ETDRS_SECTORS)):
+        in_sector = (sectors == i_sector) & ~np.isnan(thickness)
+        assert counts[i_sector] == in_sector.sum()
+        assert means[i_sector] == pytest.approx(thickness[in_sector].mean())
+
+
+def test_batch_sector_statistics(vol_path, tmp_path):
+    junk_path = str(tmp_path / 'junk.vol')
+    with open(junk_path, 'wb') as junk_file:
+        junk_file.write(b'junk')
+    statistics = batch_sector_statistics([vol_path, junk_path, vol_path], workers=2)
+
+    oct_vol = OCTVol(vol_path, load=('header', 'segmentation'))
+    means, counts = sector_statistics(thickness_map(oct_vol), etdrs_sectors(oct_vol))
+    assert np.array_equal(statistics['means'][0], means, equal_nan=True)
+    assert np.array_equal(statistics['counts'][2], counts)
+    assert list(statistics['failed']) == [junk_path] and np.all(np.isnan(statistics['means'][1]))
@@ -0,0 +1,163 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src import save_OCT_and_segmentation_as_numpy as save_module
+from OCT.src.save_OCT_and_segmentation_as_numpy import extract_segmentation, order_segmented_layers, transform_b_scans, \
+    combine_oct_and_segmentation_as_numpy, save_oct_and_segmentation_as_numpy, convert_vol_file, load_manifest, \
+    save_manifest, main, LABEL_MAP_UNLABELED
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+import time
+import os
+
+
+@pytest.fixture(params=['none', 'random', 'edges'])
+def oct_vol(request, make_vol):
+    return OCTVol(make_vol(num_b_scans=5, invalid_pattern=request.param))
+
+
+def extract_segmentation_loop(oct_vol):
+    """ The A-scan by A-scan one-hot encoding extract_segmentation has to reproduce """
+    segmented_boundaries = order_segmented_layers(oct_vol)
+    invalid = np.finfo(np.float32).max
+    n_layers = len(segmented_boundaries) + 1
+    segmented_layers = np.zeros((n_layers, oct_vol.header['size_z'], oct_vol.header['size_x'], oct_vol.header['num_b_scans']))
+    for i_layer in range(n_layers):
+        for i_b_scan in range(oct_vol.header['num_b_scans']):
+            for i_a_scan in range(oct_vol.header['size_x']):
+                upper = oct_vol.b_scan_header[segmented_boundaries[i_layer - 1]][i_b_scan, i_a_scan] if i_layer > 0 else None
+                lower = oct_vol.b_scan_header[segmented_boundaries[i_layer]][i_b_scan, i_a_scan] if i_layer < n_layers - 1 else None
+                if upper == invalid or lower == invalid:
+                    continue
+                segmented_layers[i_layer, None if upper is None else int(np.ceil(upper)):None if lower is None else int(np.ceil(lower)), i_a_scan, i_b_scan] = 1
+    return segmented_layers
+
+
+def test_extract_segmentation(oct_vol):
+    expected = extract_segmentation_loop(oct_vol)
+    segmented_layers = extract_segmentation(oct_vol)
+    assert segmented_layers.dtype == np.float64
+    assert np.array_equal(expected, segmented_layers)
+    assert np.array_equal(expected.astype(bool), extract_segmentation(oct_vol, dtype=bool))
+
+
+def test_extract_segmentation_label_map(oct_vol):
+    expected = extract_segmentation_loop(oct_vol)
+    label_map = extract_segmentation(oct_vol, label_map=True)
+    assert label_map.dtype == np.uint8
+    labeled = expected.any(axis=0)
+    assert np.array_equal(label_map == LABEL_MAP_UNLABELED, ~labeled)
+    outermost_layer = expected.shape[0] - 1 - np.argmax(expected[::-1], axis=0)
+    assert np.array_equal(label_map[labeled], outermost_layer[labeled])
+
+
+def test_combine_oct_and_segmentation_as_numpy(oct_vol):
+    b_scans = oct_vol.b_scans.copy()
+    b_scans[b_scans > 1] = 0
+    expected = np.concatenate(((b_scans ** 0.25)[np.newaxis], extract_segmentation_loop(oct_vol)), axis=0)
+    assert np.array_equal(expected, combine_oct_and_segmentation_as_numpy(oct_vol))
+    assert np.array_equal(expected, combine_oct_and_segmentation_as_numpy(OCTVol(oct_vol.vol_path, mmap=True), chunk_size=2))
+    assert np.array_equal(expected.astype(np.float16), combine_oct_and_segmentation_as_numpy(oct_vol, dtype=np.float16))
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_transform_b_scans_quantized(oct_vol, dtype):
+    b_scans = oct_vol.b_scans.copy()
+    b_scans[b_scans > 1] = 0
+    expected = np.round((b_scans.astype(np.float64) ** 0.25) * np.iinfo(dtype).max)
+    quantized = transform_b_scans(oct_vol.b_scans, dtype=dtype, chunk_size=2)
+    assert quantized.dtype == dtype
+    assert np.abs(quantized - expected).max() <= 1
+
+
+@pytest.mark.parametrize('dtype', [np.uint32, np.uint64, np.int16, bool])
+def test_transform_b_scans_unsupported_dtype(oct_vol, dtype):
+    with pytest.raises(ValueError):
+        transform_b_scans(oct_vol.b_scans, dtype=dtype)
+
+
+@pytest.fixture
+def vol_paths(make_vol):
+    """ Three vol files last modified a second ago, so that changing them changes their mtime on any file system """
+    vol_paths = [make_vol('{}.vol'.format(name), seed=seed) for seed, name in enumerate(('a', 'b', 'c'))]
+    for vol_path in vol_paths:
+        mtime_ns = os.stat(vol_path).st_mtime_ns - 10 ** 9
+        os.utime(vol_path, ns=(mtime_ns, mtime_ns))
+    return vol_paths
+
+
+def test_skip_up_to_date(vol_paths, tmp_path):
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), verbose=False)
+    assert summary['saved'] == vol_paths and summary['skipped'] == []
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), verbose=False)
+    assert summary['saved'] == [] and summary['skipped'] == vol_paths
+
+    # Re-segmenting changes neither the size nor the header, only the mtime and the segmentation
+    boundary_1 = OCTVol(vol_paths[0], load=('header', 'segmentation')).b_scan_header['boundary_1']
+    OCTVol.patch_vol(vol_paths[0], b_scan_header=dict(boundary_1=np.where(boundary_1 < 40, boundary_1 + 3, boundary_1)))
+    os.remove(os.path.join(summary['save_dir'], 'b.npy'))
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), verbose=False)
+    assert summary['saved'] == vol_paths[:2] and summary['skipped'] == vol_paths[2:]
+    assert np.array_equal(np.load(os.path.join(summary['save_dir'], 'a.npy')),
+                          combine_oct_and_segmentation_as_numpy(OCTVol(vol_paths[0])))
+
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), verbose=False, dtype=np.uint8)
+    assert summary['saved'] == vol_paths
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), verbose=False, dtype=np.uint8, force=True)
+    assert summary['saved'] == vol_paths and summary['skipped'] == []
+    assert sorted(load_manifest(summary['save_dir'])) == ['a.vol', 'b.vol', 'c.vol']
+
+
+def test_main_force(vol_paths, tmp_path, capsys):
+    assert main([str(tmp_path)]) == 0
+    assert '3 of 3 vol files' in capsys.readouterr().out
+    assert main([str(tmp_path)]) == 0
+    assert '0 of 0 vol files' in capsys.readouterr().out
+    assert main([str(tmp_path), '--force']) == 0
+    assert '3 of 3 vol files' in capsys.readouterr().out
+
+
+def convert_until_c(vol_file_path, *args, **kwargs):
+    """ convert_vol_file interrupted at c.vol, converting the vol files after it slowly (also in worker processes) """
+    if vol_file_path.endswith('c.vol'):
+        raise KeyboardInterrupt
+    if os.path.basename(vol_file_path) > 'c.vol':
+        time.sleep(0.2)  # still queued when c.vol is interrupted unless a worker already started them
+    return convert_vol_file(vol_file_path, *args, **kwargs)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_interrupted_conversion(vol_paths, make_vol, tmp_path, monkeypatch, workers):
+    later_paths = [make_vol('{}.vol'.format(name), num_b_scans=1) for name in 'defghijkl']
+    saved_manifests = []
+    monkeypatch.setattr(save_module, 'MANIFEST_SAVE_INTERVAL', 1)
+    monkeypatch.setattr(save_module, 'convert_vol_file', convert_until_c)
+    monkeypatch.setattr(save_module, 'save_manifest',
+                        lambda manifest, save_dir: saved_manifests.append(sorted(manifest)) or save_manifest(manifest, save_dir))
+    with pytest.raises(KeyboardInterrupt):
+        save_oct_and_segmentation_as_numpy(str(tmp_path), workers=workers, verbose=False)
+    assert saved_manifests == [['a.vol'], ['a.vol', 'b.vol'], ['a.vol', 'b.vol']]
+    # The queued vol files are cancelled, only the ones the workers run or were handed (workers + 1) are converted
+    converted = [vol_path for vol_path in later_paths
+                 if os.path.exists(os.path.join(str(tmp_path), 'numpy_arrays', os.path.basename(vol_path)[:-4] + '.npy'))]
+    assert len(converted) <= 2 * workers + 1
+
+    monkeypatch.undo()
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), verbose=False)
+    assert summary['saved'] == vol_paths[2:] + later_paths and summary['skipped'] == vol_paths[:2]
+
+
+def test_broken_worker(vol_paths, tmp_path, monkeypatch):
+    class BrokenPoolExecutor(ThreadPoolExecutor):
+        """ A pool whose worker process converting b.vol dies """
+        def submit(self, fn, vol_file_path, *args, **kwargs):
+            if vol_file_path.endswith('b.vol'):
+                future = Future()
+                future.set_exception(BrokenProcessPool('A process in the process pool was terminated abruptly'))
+                return future
+            return super().submit(fn, vol_file_path, *args, **kwargs)
+
+    monkeypatch.setattr(save_module, 'ProcessPoolExecutor', BrokenPoolExecutor)
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), workers=2, verbose=False)
+    assert summary['saved'] == [vol_paths[0], vol_paths[2]] and 'BrokenProcessPool' in summary['failed'][vol_paths[1]]
+    assert sorted(load_manifest(summary['save_dir'])) == ['a.vol', 'c.vol']
@@ -0,0 +1,101 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src import vol_catalog
+from OCT.src.vol_catalog import VolCatalog
+import datetime
+import pytest
+import sqlite3
+import os
+
+
+@pytest.fixture
+def archive(make_vol, tmp_path):
+    """ Two vol files of different patients and exam times, one without thickness grid in a subfolder, and a broken one """
+    os.mkdir(str(tmp_path / 'sub'))
+    vol_paths = dict(a=make_vol('a.vol'), b=make_vol(os.path.join('sub', 'b.vol'), seed=1, thickness_grid=False),
+                     c=make_vol('c.vol', seed=2))
+    OCTVol.patch_vol(vol_paths['c'], header=dict(patient_id='OTHER', unconverted_exam_time=133000000000000000))
+    with open(str(tmp_path / 'junk.vol'), 'wb') as junk_file:
+        junk_file.write(b'junk')
+    vol_paths['junk'] = str(tmp_path / 'junk.vol')
+    # Last modified a second ago, so that changing them changes their mtime on any file system
+    for vol_path in vol_paths.values():
+        mtime_ns = os.stat(vol_path).st_mtime_ns - 10 ** 9
+        os.utime(vol_path, ns=(mtime_ns, mtime_ns))
+    return vol_paths
+
+
+def test_update(archive, tmp_path):
+    with VolCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        assert catalog.update(str(tmp_path)) == dict(added=3, updated=0, unchanged=0, removed=0, failed=1)
+        assert catalog.update(str(tmp_path)) == dict(added=0, updated=0, unchanged=4, removed=0, failed=0)
+
+        OCTVol.patch_vol(archive['a'], header=dict(patient_id='RENAMED'))
+        os.utime(archive['c'])
+        os.remove(archive['b'])
+        assert catalog.update(str(tmp_path)) == dict(added=0, updated=2, unchanged=1, removed=1, failed=0)
+        assert catalog.query(patient_id='RENAMED') == [archive['a']]
+
+    # The catalog is kept in its database file, the broken file is not read again until it changes
+    with VolCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        assert catalog.update(str(tmp_path)) == dict(added=0, updated=0, unchanged=3, removed=0, failed=0)
+        error, = catalog.connection.execute('SELECT error FROM vol_files WHERE path = ?', (archive['junk'],)).fetchone()
+        assert error is not None
+
+
+def test_interrupted_update(archive, tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'catalog.sqlite')
+    catalog_row = VolCatalog._catalog_row
+    num_read = []
+
+    def interrupt_at_junk(vol_path, stat):
+        # The first two vol files are already committed when the third one is read
+        num_read.append(vol_path)
+        if len(num_read) == 3:
+            connection = sqlite3.connect(db_path)
+            assert connection.execute('SELECT COUNT(*) FROM vol_files').fetchone() == (2,)
+            connection.close()
+        if vol_path == archive['junk']:
+            raise KeyboardInterrupt
+        return catalog_row(vol_path, stat)
+
+    monkeypatch.setattr(vol_catalog, 'CATALOG_COMMIT_INTERVAL', 2)
+    monkeypatch.setattr(VolCatalog, '_catalog_row', staticmethod(interrupt_at_junk))
+    with VolCatalog(db_path) as catalog:
+        with pytest.raises(KeyboardInterrupt):
+            catalog.update(str(tmp_path))
+    assert num_read == [archive['a'], archive['c'], archive['junk']]
+
+    # The rerun only reads the vol files not cataloged yet
+    monkeypatch.setattr(VolCatalog, '_catalog_row', staticmethod(catalog_row))
+    with VolCatalog(db_path) as catalog:
+        assert catalog.update(str(tmp_path)) == dict(added=1, updated=0, unchanged=2, removed=0, failed=1)
+
+
+def test_query(archive, tmp_path):
+    with VolCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        catalog.update(str(tmp_path))
+        assert catalog.query() == sorted([archive['a'], archive['b'], archive['c']])
+        assert catalog.query(patient_id='SYNTHETIC') == sorted([archive['a'], archive['b']])
+        assert catalog.query(patient_id=['OTHER', 'NOBODY']) == [archive['c']]
+        assert catalog.query(pid=(0, 2), scan_position='OD') == [archive['a'], archive['c']]
+
+        exam_time_a = OCTVol(archive['a'], load=('header',)).header['exam_time']
+        exam_time_c = OCTVol(archive['c'], load=('header',)).header['exam_time']
+        assert exam_time_a < datetime.datetime(2022, 1, 1) <= exam_time_c
+        assert catalog.query(exam_after=datetime.datetime(2022, 1, 1)) == [archive['c']]
+        assert catalog.query(exam_after=exam_time_c) == [archive['c']]
+        assert catalog.query(exam_before=exam_time_c, patient_id='SYNTHETIC') == sorted([archive['a'], archive['b']])
+        assert catalog.query(exam_after=exam_time_a, exam_before=exam_time_c, has_thickness_grid=True) == [archive['a']]
+        assert catalog.query(has_thickness_grid=False) == [archive['b']]
+
+        with pytest.raises(ValueError):
+            catalog.query(patient_name='SYNTHETIC')
+
+
+def test_query_vols(archive, tmp_path):
+    with VolCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        catalog.update(str(tmp_path))
+        oct_vols = list(catalog.query_vols(has_thickness_grid=True, load=('header', 'b_scans')))
+    assert [oct_vol.vol_path for oct_vol in oct_vols] == [archive['a'], archive['c']]
+    assert oct_vols[1].header['patient_id'] == 'OTHER' and oct_vols[1].b_scan_header == dict()
+    assert oct_vols[0].b_scans.shape == (48, 64, 7) and not oct_vols[0].b_scans.flags.writeable
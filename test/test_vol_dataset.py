@@ -0,0 +1,86 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.vol_dataset import VolDataset
+from OCT.src.save_OCT_and_segmentation_as_numpy import extract_segmentation, transform_b_scans
+import numpy as np
+import pytest
+import pickle
+
+
+@pytest.fixture
+def vol_paths(make_vol):
+    return [make_vol('orig_{}.vol'.format(seed), seed=seed, num_b_scans=num_b_scans)
+            for seed, num_b_scans in enumerate((4, 7, 5))]
+
+
+@pytest.mark.parametrize('label_map', [True, False])
+def test_getitem(vol_paths, label_map):
+    dataset = VolDataset(vol_paths, max_open_vols=2, label_map=label_map)
+    assert len(dataset) == 16 and list(dataset.offsets) == [0, 4, 11, 16]
+    for i_vol, vol_path in enumerate(vol_paths):
+        oct_vol = OCTVol(vol_path)
+        images = transform_b_scans(oct_vol.b_scans)
+        labels = extract_segmentation(oct_vol, label_map=True) if label_map else extract_segmentation(oct_vol, dtype=np.uint8)
+        for i_b_scan in range(oct_vol.header['num_b_scans']):
+            image, b_scan_labels = dataset[int(dataset.offsets[i_vol]) + i_b_scan]
+            assert np.array_equal(image, images[:, :, i_b_scan])
+            assert b_scan_labels.dtype == np.uint8 and np.array_equal(b_scan_labels, labels[..., i_b_scan])
+
+
+def test_locate(vol_paths):
+    dataset = VolDataset(vol_paths)
+    assert [dataset.locate(index) for index in (0, 3, 4, 10, 11, 15)] == [(0, 0), (0, 3), (1, 0), (1, 6), (2, 0), (2, 4)]
+    assert [dataset.locate(index) for index in (-1, -5, -6, -16)] == [(2, 4), (2, 0), (1, 6), (0, 0)]
+    for index in (16, -17):
+        with pytest.raises(IndexError):
+            dataset.locate(index)
+    assert np.array_equal(dataset[-1][0], dataset[15][0])
+
+
+def test_lru_eviction(vol_paths):
+    dataset = VolDataset(vol_paths, max_open_vols=2)
+    for index in (0, 4, 1, 11):  # vol files 0, 1, 0, 2
+        dataset[index]
+    assert list(dataset._open_vols) == [0, 2]
+
+    # Any limit below the size of a single vol file keeps the last one open
+    dataset = VolDataset(vol_paths, max_open_bytes=1)
+    for index in (0, 4, 11):
+        dataset[index]
+        assert len(dataset._open_vols) == 1
+
+    unlimited = VolDataset(vol_paths)
+    for index in (0, 4, 11):
+        unlimited[index]
+    vol_bytes = [unlimited._open_vols[i_vol][3] for i_vol in range(3)]
+    assert unlimited._open_bytes == sum(vol_bytes) and vol_bytes[0] < vol_bytes[2] < vol_bytes[1]
+
+    # Vol files 1 and 0 fit, opening 2 evicts the least recently used 1
+    dataset = VolDataset(vol_paths, max_open_bytes=vol_bytes[0] + vol_bytes[1])
+    for index in (4, 0):
+        dataset[index]
+    assert list(dataset._open_vols) == [1, 0]
+    dataset[11]
+    assert list(dataset._open_vols) == [0, 2] and dataset._open_bytes == vol_bytes[0] + vol_bytes[2]
+
+
+def test_open_maps_only(vol_paths):
+    dataset = VolDataset(vol_paths, max_open_vols=1)
+    dataset[5]
+    header, b_scan_headers_raw, b_scans, open_bytes = dataset._open_vols[1]
+    # Only views into the memory map are kept, the bytes are those of the mapped B-scan records
+    assert not b_scan_headers_raw.flags.owndata and not b_scans.flags.owndata
+    record_size = header['b_scan_hdr_size'] + header['size_x'] * header['size_z'] * 4
+    assert open_bytes == 7 * record_size
+    # The segmented boundaries outlive the eviction of the vol file
+    dataset[0]
+    assert list(dataset._open_vols) == [0] and sorted(dataset._segmented_boundaries) == [0, 1]
+
+
+def test_pickle(vol_paths):
+    dataset = VolDataset(vol_paths)
+    image, labels = dataset[5]
+    unpickled = pickle.loads(pickle.dumps(dataset))
+    assert unpickled._open_vols == dict() and unpickled._open_bytes == 0
+    assert len(dataset._open_vols) == 1
+    unpickled_image, unpickled_labels = unpickled[5]
+    assert np.array_equal(image, unpickled_image) and np.array_equal(labels, unpickled_labels)
@@ -0,0 +1,82 @@
+from OCT.formats.OCTVol import OCTVol
+from OCT.src.vol_prefetch import prefetch_vols, read_vol_parts, vol_file_ranges, _BufferFile
+from OCT.src.save_OCT_and_segmentation_as_numpy import save_oct_and_segmentation_as_numpy
+import numpy as np
+import pytest
+import os
+
+
+@pytest.fixture
+def vol_paths(make_vol):
+    return [make_vol('orig_{}.vol'.format(seed), seed=seed) for seed in range(4)]
+
+
+@pytest.mark.parametrize('max_in_flight_bytes', [1, 10 ** 9])
+def test_prefetch_vols(vol_paths, max_in_flight_bytes):
+    prefetched = list(prefetch_vols(vol_paths, workers=2, max_in_flight_bytes=max_in_flight_bytes, block_size=4096))
+    assert [vol_path for vol_path, _, _ in prefetched] == vol_paths
+    for vol_path, oct_vol, error in prefetched:
+        assert error is None
+        orig_vol = OCTVol(vol_path)
+        assert oct_vol.header.keys() == orig_vol.header.keys() and oct_vol.header['id'] == orig_vol.header['id']
+        assert np.array_equal(oct_vol.slo, orig_vol.slo)
+        assert np.array_equal(oct_vol.b_scans, orig_vol.b_scans)
+        for key in orig_vol.b_scan_header:
+            assert np.array_equal(oct_vol.b_scan_header[key], orig_vol.b_scan_header[key])
+
+
+@pytest.mark.parametrize('load', [('header',), ('b_scan_header',), ('segmentation',), ('slo', 'segmentation')])
+def test_read_vol_parts(vol_paths, load):
+    orig_vol = OCTVol(vol_paths[0], load=load)
+    with open(vol_paths[0], 'rb') as vol_file:
+        vol_bytes = vol_file.read()
+
+    parts = read_vol_parts(vol_paths[0], load, block_size=4096, max_gap=0)
+    ranges = vol_file_ranges(orig_vol.header, load, max_gap=0)
+    assert [(offset, offset + len(buffer)) for offset, buffer in parts] == ranges
+    assert all(buffer == vol_bytes[offset:offset + len(buffer)] for offset, buffer in parts)
+    if load == ('header',):
+        grid_offset = orig_vol.header['grid_offset']
+        assert ranges == [(0, OCTVol.HEADER_DTYPE.itemsize), (grid_offset, grid_offset + OCTVol.THICKNESS_GRID_DTYPE.itemsize)]
+    else:
+        # The header, the SLO image if loaded (then merged with the first B-scan header), 7 B-scan headers and the grid
+        assert len(ranges) == 9 - ('slo' in load) and sum(len(buffer) for _, buffer in parts) < len(vol_bytes) / 2
+    assert read_vol_parts(vol_paths[0], load) == [(0, vol_bytes)]  # the ranges of a small file merge into one
+
+    oct_vol = OCTVol(vol_paths[0], load=load, vol_file=_BufferFile(parts, vol_paths[0]))
+    assert oct_vol.header.keys() == orig_vol.header.keys() and oct_vol.header['id'] == orig_vol.header['id']
+    assert oct_vol.thickness_grid.keys() == orig_vol.thickness_grid.keys()
+    assert np.array_equal(oct_vol.thickness_grid['center_pos'], orig_vol.thickness_grid['center_pos'])
+    assert (oct_vol.slo is None) == (orig_vol.slo is None) and (orig_vol.slo is None or np.array_equal(oct_vol.slo, orig_vol.slo))
+    assert oct_vol.b_scan_header.keys() == orig_vol.b_scan_header.keys()
+    for key in orig_vol.b_scan_header:
+        assert np.array_equal(oct_vol.b_scan_header[key], orig_vol.b_scan_header[key])
+
+    prefetched = list(prefetch_vols(vol_paths, load=load, max_in_flight_bytes=1))
+    assert all(error is None and oct_vol.b_scans is None for _, oct_vol, error in prefetched)
+
+
+def test_prefetch_vols_errors(vol_paths, tmp_path):
+    truncated_path = str(tmp_path / 'truncated.vol')
+    with open(vol_paths[0], 'rb') as vol_file, open(truncated_path, 'wb') as truncated_file:
+        truncated_file.write(vol_file.read(5000))
+    with open(vol_paths[0], 'rb') as vol_file, open(str(tmp_path / 'short.vol'), 'wb') as short_file:
+        short_file.write(vol_file.read(1000))
+    prefetched = list(prefetch_vols([truncated_path, str(tmp_path / 'missing.vol'), vol_paths[1], str(tmp_path / 'short.vol')],
+                                    load=('header', 'segmentation')))
+    assert prefetched[0][1] is None and 'truncated' in prefetched[0][2]
+    assert prefetched[3][1] is None and 'truncated' in prefetched[3][2]
+    assert prefetched[1][1] is None and prefetched[1][2] is not None
+    assert prefetched[2][2] is None and prefetched[2][1].b_scans is None
+
+
+def test_save_with_prefetch(vol_paths, tmp_path):
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), verbose=False, prefetch=2)
+    assert sorted(summary['saved']) == vol_paths
+    npy_paths = [os.path.join(summary['save_dir'], os.path.basename(vol_path).replace('.vol', '.npy')) for vol_path in vol_paths]
+    prefetched = [np.load(npy_path) for npy_path in npy_paths]
+
+    summary = save_oct_and_segmentation_as_numpy(str(tmp_path), verbose=False, force=True)
+    assert sorted(summary['saved']) == vol_paths
+    for expected, npy_path in zip(prefetched, npy_paths):
+        assert np.array_equal(expected, np.load(npy_path))
@@ -1,17 +1,18 @@
 from OCT.formats.OCTVol import OCTVol
 import numpy as np
 import pytest
+import struct
 import os
 
 
-@pytest.fixture
-def orig_vol():
-    return OCTVol(r'c:\Users\Amir\Downloads\EYE00023_8370.vol')
+@pytest.fixture(params=[True, False], ids=['thickness_grid', 'no_thickness_grid'])
+def orig_vol(request, make_vol):
+    return OCTVol(make_vol(num_b_scans=5, thickness_grid=request.param))
 
 
 @pytest.fixture
-def written_vol(orig_vol):
-    temp_save_path = r'c:\Users\Amir\Downloads\test.vol'
+def written_vol(orig_vol, tmp_path):
+    temp_save_path = str(tmp_path / 'test.vol')
     orig_vol.write_vol(temp_save_path)
     yield OCTVol(temp_save_path)
     os.remove(temp_save_path)
@@ -48,3 +49,59 @@ def test_thickness_grid(orig_vol, written_vol):
         else:
             assert written_vol.thickness_grid[key] == orig_vol.thickness_grid[key]
 
+
+def test_bytes(orig_vol, written_vol):
+    with open(orig_vol.vol_path, 'rb') as orig_file, open(written_vol.vol_path, 'rb') as written_file:
+        assert orig_file.read() == written_file.read()
+
+
+def test_write_vol_stream(orig_vol, tmp_path):
+    temp_save_path = str(tmp_path / 'stream.vol')
+    OCTVol.write_vol_stream(temp_save_path, orig_vol.header, orig_vol.slo, orig_vol.b_scan_header,
+                            (orig_vol.b_scans[:, :, i_b_scan] for i_b_scan in range(orig_vol.header['num_b_scans'])),
+                            orig_vol.thickness_grid)
+    with open(orig_vol.vol_path, 'rb') as orig_file, open(temp_save_path, 'rb') as written_file:
+        assert orig_file.read() == written_file.read()
+
+
+def pack_vol_file(thickness_grid: bool) -> bytes:
+    """
+    Pack a tiny vol file field by field with struct in the order of the original write_vol, independent of the writer
+    """
+    size_x, num_b_scans, size_z, size_x_slo, size_y_slo, num_seg, off_seg, b_scan_hdr_size = 4, 2, 3, 5, 3, 3, 256, 512
+    grid_offset = 2048 + size_x_slo * size_y_slo + num_b_scans * (b_scan_hdr_size + size_x * size_z * 4) if thickness_grid else 0
+    invalid = np.finfo(np.float32).max
+
+    vol_bytes = struct.pack('<12s3i3d2i2did4sQ2i16s16si21s3sdi24sd2i1832s', b'HSF-OCT-103', size_x, num_b_scans, size_z,
+                            0.0114, 0.12, 0.0039, size_x_slo, size_y_slo, 0.0114, 0.0114, 30, -0.5, b'OS',
+                            132500000000000000, 3, b_scan_hdr_size, b'GOLDEN', b'REF', 7, b'PATIENT', bytes(3), 30000.0,
+                            8, b'VISIT', 44000.0, int(thickness_grid), grid_offset, bytes(1832))
+    vol_bytes += bytes(range(size_x_slo * size_y_slo))
+    for i_b_scan in range(num_b_scans):
+        b_scan_header = struct.pack('<12sidddd2ifi192s', b'HSF-BS-103', b_scan_hdr_size, 0.0, 0.12 * i_b_scan, 0.0456,
+                                    0.12 * i_b_scan, num_seg, off_seg, 30.5 + i_b_scan, 0, bytes(192))
+        boundaries = [[1.5 + i_boundary + i_b_scan, 2.0, invalid, 0.25] for i_boundary in range(num_seg)]
+        b_scan_header += struct.pack('<{}f'.format(num_seg * size_x), *np.ravel(boundaries))
+        vol_bytes += b_scan_header + bytes(b_scan_hdr_size - len(b_scan_header))
+        vol_bytes += struct.pack('<{}f'.format(size_z * size_x), *(0.001 * (i_b_scan * 100 + np.arange(size_z * size_x))))
+    if thickness_grid:
+        vol_bytes += struct.pack('<i3d2d4f18f', 1, 1.0, 3.0, 6.0, 0.0228, 0.06, 0.27, 0.22, 0.31, 8.6,
+                                 *np.ravel([[0.27 + 0.01 * i_sector, 0.2 + 0.1 * i_sector] for i_sector in range(9)]))
+    return vol_bytes
+
+
+@pytest.mark.parametrize('thickness_grid', [True, False], ids=['thickness_grid', 'no_thickness_grid'])
+def test_golden_bytes(tmp_path, thickness_grid):
+    golden_bytes = pack_vol_file(thickness_grid)
+    golden_path = str(tmp_path / 'golden.vol')
+    with open(golden_path, 'wb') as golden_file:
+        golden_file.write(golden_bytes)
+    golden_vol = OCTVol(golden_path)
+    assert golden_vol.header['id'] == 'GOLDEN' and golden_vol.b_scans[2, 3, 1] == np.float32(0.111)
+
+    golden_vol.write_vol(str(tmp_path / 'written.vol'))
+    OCTVol.write_vol_stream(str(tmp_path / 'stream.vol'), golden_vol.header, golden_vol.slo, golden_vol.b_scan_header,
+                            (golden_vol.b_scans[:, :, i_b_scan] for i_b_scan in range(2)), golden_vol.thickness_grid)
+    for written_path in (tmp_path / 'written.vol', tmp_path / 'stream.vol'):
+        with open(written_path, 'rb') as written_file:
+            assert written_file.read() == golden_bytes